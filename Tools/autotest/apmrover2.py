@@ -2,6 +2,7 @@
 
 import util, pexpect, sys, time, math, shutil, os
 from common import *
+from mission import MissionLegs
 from pymavlink import mavutil
 import random
 
@@ -55,6 +56,8 @@ def drive_mission(mavproxy, mav, filename):
     '''drive a mission from a file'''
     global homeloc
     print("Driving mission %s" % filename)
+    legs = MissionLegs(filename, speed=5.0)
+    print(legs.summary())
     mavproxy.send('wp load %s\n' % filename)
     mavproxy.expect('flight plan received')
     mavproxy.send('wp list\n')
@@ -62,16 +65,19 @@ def drive_mission(mavproxy, mav, filename):
     mavproxy.send('switch 4\n') # auto mode
     mavproxy.send('rc 3 1500\n')
     wait_mode(mav, 'AUTO')
-    if not wait_waypoint(mav, 1, 4, max_dist=5):
+    if not wait_waypoint(mav, 1, 4, max_dist=5, legs=legs):
         return False
     wait_mode(mav, 'HOLD')
     print("Mission OK")
     return True
 
 
-def drive_APMrover2(viewerip=None, map=False):
+def drive_APMrover2(viewerip=None, map=False, embed_sim=False):
     '''drive APMrover2 in SIL
 
+    with embed_sim the simulator runs inside this process rather than
+    as a separate sim_rover.py
+
     you can pass viewerip as an IP address to optionally send fg and
     mavproxy packets too for local viewing of the mission in real time
     '''
@@ -98,11 +104,23 @@ def drive_APMrover2(viewerip=None, map=False):
 
     sim_cmd = util.reltopdir('Tools/autotest/pysim/sim_rover.py') + ' --rate=50 --home=%f,%f,%u,%u' % (
         HOME.lat, HOME.lng, HOME.alt, HOME.heading)
-
-    runsim = pexpect.spawn(sim_cmd, logfile=sys.stdout, timeout=10)
-    runsim.delaybeforesend = 0
-    util.pexpect_autoclose(runsim)
-    runsim.expect('Starting at lat')
+    # frame timing and health of the simulator for this run
+    sim_telemetry = util.reltopdir("../buildlogs/APMrover2-sim.json")
+    sim_cmd += ' --telemetry=%s' % sim_telemetry
+
+    if embed_sim:
+        import runner
+        from rover import Rover
+        a = Rover()
+        a.set_home(HOME.lat, HOME.lng, HOME.alt, HOME.heading)
+        runsim = runner.SimulatorRunner(a, runner.SteeringDecoder(), rate=50,
+                                        telemetry=sim_telemetry, name='sim_rover')
+        runsim.start()
+    else:
+        runsim = pexpect.spawn(sim_cmd, logfile=sys.stdout, timeout=10)
+        runsim.delaybeforesend = 0
+        util.pexpect_autoclose(runsim)
+        runsim.expect('Starting at lat')
 
     sil = util.start_SIL('APMrover2')
     mavproxy = util.start_MAVProxy_SIL('APMrover2', options=options)
@@ -124,7 +142,11 @@ def drive_APMrover2(viewerip=None, map=False):
     util.expect_setup_callback(mavproxy, expect_callback)
 
     expect_list_clear()
-    expect_list_extend([runsim, sil, mavproxy])
+    expect_list_extend([sil, mavproxy])
+    if embed_sim:
+        expect_sim_thread(runsim)
+    else:
+        expect_list_extend([runsim])
 
     print("Started simulator")
 
@@ -157,14 +179,17 @@ def drive_APMrover2(viewerip=None, map=False):
 #        if not drive_RTL(mavproxy, mav):
 #            print("Failed RTL")
 #            failed = True
-    except pexpect.TIMEOUT, e:
+    except (pexpect.TIMEOUT, SimulatorStopped), e:
         print("Failed with timeout")
         failed = True
 
     mav.close()
     util.pexpect_close(mavproxy)
     util.pexpect_close(sil)
-    util.pexpect_close(runsim)
+    if embed_sim:
+        runsim.close()
+    else:
+        util.pexpect_close(runsim)
 
     if os.path.exists('APMrover2-valgrind.log'):
         os.chmod('APMrover2-valgrind.log', 0644)
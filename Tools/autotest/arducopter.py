@@ -9,6 +9,7 @@
 
 import util, pexpect, sys, time, math, shutil, os
 from common import *
+from mission import MissionLegs
 from pymavlink import mavutil, mavwp
 import random
 
@@ -22,6 +23,7 @@ AVCHOME=mavutil.location(40.072842,-105.230575,1586,0)
 
 homeloc = None
 num_wp = 0
+mission_legs = None
 
 def hover(mavproxy, mav, hover_throttle=1450):
     mavproxy.send('rc 3 %u\n' % hover_throttle)
@@ -675,12 +677,13 @@ def fly_mission(mavproxy, mav, height_accuracy=-1, target_altitude=None):
     '''fly a mission from a file'''
     global homeloc
     global num_wp
+    global mission_legs
     print("test: Fly a mission from 1 to %u" % num_wp)
     mavproxy.send('wp set 1\n')
     mavproxy.send('switch 4\n') # auto mode
     wait_mode(mav, 'AUTO')
     #wait_altitude(mav, 30, 40)
-    ret = wait_waypoint(mav, 0, num_wp, timeout=500, mode='AUTO')
+    ret = wait_waypoint(mav, 0, num_wp, timeout=500, mode='AUTO', legs=mission_legs)
     print("test: MISSION COMPLETE: passed=%s" % ret)
     # wait here until ready
     mavproxy.send('switch 5\n') # loiter mode
@@ -690,10 +693,13 @@ def fly_mission(mavproxy, mav, height_accuracy=-1, target_altitude=None):
 def load_mission_from_file(mavproxy, mav, filename):
     '''load a mission from a file'''
     global num_wp
+    global mission_legs
     wploader = mavwp.MAVWPLoader()
     wploader.load(filename)
     num_wp = wploader.count()
     print("loaded mission with %u waypoints" % num_wp)
+    mission_legs = MissionLegs(filename, speed=5.0, climb_rate=2.5)
+    print(mission_legs.summary())
     return True
 
 def upload_mission_from_file(mavproxy, mav, filename):
@@ -707,10 +713,13 @@ def upload_mission_from_file(mavproxy, mav, filename):
 
 def save_mission_to_file(mavproxy, mav, filename):
     global num_wp
+    global mission_legs
     mavproxy.send('wp save %s\n' % filename)
     mavproxy.expect('Saved ([0-9]+) waypoints')
     num_wp = int(mavproxy.match.group(1))
     print("num_wp: %d" % num_wp)
+    mission_legs = MissionLegs(filename, speed=5.0, climb_rate=2.5)
+    print(mission_legs.summary())
     return True
 
 def setup_rc(mavproxy):
@@ -721,9 +730,12 @@ def setup_rc(mavproxy):
     mavproxy.send('rc 3 1000\n')
 
 
-def fly_ArduCopter(viewerip=None, map=False):
+def fly_ArduCopter(viewerip=None, map=False, embed_sim=False):
     '''fly ArduCopter in SIL
 
+    with embed_sim the simulator runs inside this process rather than
+    as a separate sim_multicopter.py
+
     you can pass viewerip as an IP address to optionally send fg and
     mavproxy packets too for local viewing of the flight in real time
     '''
@@ -735,6 +747,9 @@ def fly_ArduCopter(viewerip=None, map=False):
     sim_cmd = util.reltopdir('Tools/autotest/pysim/sim_multicopter.py') + ' --frame=%s --rate=400 --home=%f,%f,%u,%u' % (
         FRAME, HOME.lat, HOME.lng, HOME.alt, HOME.heading)
     sim_cmd += ' --wind=6,45,.3'
+    # frame timing and health of the simulator for this run
+    sim_telemetry = util.reltopdir("../buildlogs/ArduCopter-sim.json")
+    sim_cmd += ' --telemetry=%s' % sim_telemetry
     if viewerip:
         sim_cmd += ' --fgout=%s:5503' % viewerip
 
@@ -752,9 +767,21 @@ def fly_ArduCopter(viewerip=None, map=False):
     util.pexpect_close(sil)
 
     sil = util.start_SIL('ArduCopter', height=HOME.alt)
-    sim = pexpect.spawn(sim_cmd, logfile=sys.stdout, timeout=10)
-    sim.delaybeforesend = 0
-    util.pexpect_autoclose(sim)
+    if embed_sim:
+        import runner
+        from multicopter import MultiCopter
+        a = MultiCopter(frame=FRAME)
+        a.set_home(HOME.lat, HOME.lng, HOME.alt, HOME.heading)
+        a.wind = util.Wind('6,45,.3')
+        sim = runner.SimulatorRunner(a, runner.ServoDecoder(), rate=400,
+                                     telemetry=sim_telemetry, name='sim_multicopter')
+        if viewerip:
+            sim.add_flightgear('%s:5503' % viewerip, 30)
+        sim.start()
+    else:
+        sim = pexpect.spawn(sim_cmd, logfile=sys.stdout, timeout=10)
+        sim.delaybeforesend = 0
+        util.pexpect_autoclose(sim)
     options = '--sitl=127.0.0.1:5501 --out=127.0.0.1:19550 --quadcopter --streamrate=5'
     if viewerip:
         options += ' --out=%s:14550' % viewerip
@@ -781,7 +808,11 @@ def fly_ArduCopter(viewerip=None, map=False):
     util.expect_setup_callback(mavproxy, expect_callback)
 
     expect_list_clear()
-    expect_list_extend([sim, sil, mavproxy])
+    expect_list_extend([sil, mavproxy])
+    if embed_sim:
+        expect_sim_thread(sim)
+    else:
+        expect_list_extend([sim])
 
     # get a mavlink connection going
     try:
@@ -1018,13 +1049,16 @@ def fly_ArduCopter(viewerip=None, map=False):
             print("disarm_motors failed")
             failed = True
 
-    except pexpect.TIMEOUT, e:
+    except (pexpect.TIMEOUT, SimulatorStopped), e:
         failed = True
 
     mav.close()
     util.pexpect_close(mavproxy)
     util.pexpect_close(sil)
-    util.pexpect_close(sim)
+    if embed_sim:
+        sim.close()
+    else:
+        util.pexpect_close(sim)
 
     if os.path.exists('ArduCopter-valgrind.log'):
         os.chmod('ArduCopter-valgrind.log', 0644)
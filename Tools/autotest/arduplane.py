@@ -408,9 +408,12 @@ def fly_mission(mavproxy, mav, filename, height_accuracy=-1, target_altitude=Non
     return True
 
 
-def fly_ArduPlane(viewerip=None, map=False):
+def fly_ArduPlane(viewerip=None, map=False, embed_sim=False):
     '''fly ArduPlane in SIL
 
+    with embed_sim the pysim plane model runs inside this process
+    rather than JSBSim running under jsbsim/runsim.py
+
     you can pass viewerip as an IP address to optionally send fg and
     mavproxy packets too for local viewing of the flight in real time
     '''
@@ -440,10 +443,22 @@ def fly_ArduPlane(viewerip=None, map=False):
     if viewerip:
         cmd += " --fgout=%s:5503" % viewerip
 
-    runsim = pexpect.spawn(cmd, logfile=sys.stdout, timeout=10)
-    runsim.delaybeforesend = 0
-    util.pexpect_autoclose(runsim)
-    runsim.expect('Simulator ready to fly')
+    if embed_sim:
+        import runner
+        from plane import Plane
+        a = Plane()
+        (lat, lon, alt, hdg) = runner.parse_home(HOME_LOCATION)
+        a.set_home(lat, lon, alt, hdg)
+        a.wind = util.Wind(WIND)
+        runsim = runner.SimulatorRunner(a, runner.PlaneDecoder(), rate=400, name='sim_plane')
+        if viewerip:
+            runsim.add_flightgear('%s:5503' % viewerip, 30)
+        runsim.start()
+    else:
+        runsim = pexpect.spawn(cmd, logfile=sys.stdout, timeout=10)
+        runsim.delaybeforesend = 0
+        util.pexpect_autoclose(runsim)
+        runsim.expect('Simulator ready to fly')
 
     sil = util.start_SIL('ArduPlane')
     mavproxy = util.start_MAVProxy_SIL('ArduPlane', options=options)
@@ -465,7 +480,11 @@ def fly_ArduPlane(viewerip=None, map=False):
     util.expect_setup_callback(mavproxy, expect_callback)
 
     expect_list_clear()
-    expect_list_extend([runsim, sil, mavproxy])
+    expect_list_extend([sil, mavproxy])
+    if embed_sim:
+        expect_sim_thread(runsim)
+    else:
+        expect_list_extend([runsim])
 
     print("Started simulator")
 
@@ -529,14 +548,17 @@ def fly_ArduPlane(viewerip=None, map=False):
                            target_altitude=homeloc.alt+100):
             print("Failed mission")
             failed = True
-    except pexpect.TIMEOUT, e:
+    except (pexpect.TIMEOUT, SimulatorStopped), e:
         print("Failed with timeout")
         failed = True
 
     mav.close()
     util.pexpect_close(mavproxy)
     util.pexpect_close(sil)
-    util.pexpect_close(runsim)
+    if embed_sim:
+        runsim.close()
+    else:
+        util.pexpect_close(runsim)
 
     if os.path.exists('ArduPlane-valgrind.log'):
         os.chmod('ArduPlane-valgrind.log', 0644)
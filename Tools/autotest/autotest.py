@@ -150,6 +150,7 @@ parser.add_option("--skip", type='string', default='', help='list of steps to sk
 parser.add_option("--list", action='store_true', default=False, help='list the available steps')
 parser.add_option("--viewerip", default=None, help='IP address to send MAVLink and fg packets to')
 parser.add_option("--map", action='store_true', default=False, help='show map')
+parser.add_option("--embed-sim", action='store_true', default=False, help='run the simulators in-process, with the pysim plane model in place of JSBSim')
 parser.add_option("--experimental", default=False, action='store_true', help='enable experimental tests')
 parser.add_option("--timeout", default=3000, type='int', help='maximum runtime in seconds')
 
@@ -250,16 +251,16 @@ def run_step(step):
         return dump_logs('APMrover2')
 
     if step == 'fly.ArduCopter':
-        return arducopter.fly_ArduCopter(viewerip=opts.viewerip, map=opts.map)
+        return arducopter.fly_ArduCopter(viewerip=opts.viewerip, map=opts.map, embed_sim=opts.embed_sim)
 
     if step == 'fly.CopterAVC':
         return arducopter.fly_CopterAVC(viewerip=opts.viewerip, map=opts.map)
 
     if step == 'fly.ArduPlane':
-        return arduplane.fly_ArduPlane(viewerip=opts.viewerip, map=opts.map)
+        return arduplane.fly_ArduPlane(viewerip=opts.viewerip, map=opts.map, embed_sim=opts.embed_sim)
 
     if step == 'drive.APMrover2':
-        return apmrover2.drive_APMrover2(viewerip=opts.viewerip, map=opts.map)
+        return apmrover2.drive_APMrover2(viewerip=opts.viewerip, map=opts.map, embed_sim=opts.embed_sim)
 
     if step == 'build.All':
         return build_all()
@@ -346,6 +347,7 @@ def write_fullresults():
     results.addglob('DataFlash Log', '*.flashlog')
     results.addglob("MAVLink log", '*.tlog')
     results.addglob("GPX track", '*.gpx')
+    results.addglob("Simulator telemetry", '*-sim.json')
     results.addfile('ArduPlane build log', 'ArduPlane.txt')
     results.addfile('ArduPlane code size', 'ArduPlane.sizes.txt')
     results.addfile('ArduPlane stack sizes', 'ArduPlane.framesizes.txt')
@@ -1,26 +1,51 @@
-import util, pexpect, time, math
+import util, pexpect, time, math, geodesy
 from pymavlink import mavwp
 
 # a list of pexpect objects to read while waiting for
 # messages. This keeps the output to stdout flowing
 expect_list = []
 
+# simulators running in a thread of this process. They have no output
+# to read, but are checked while waiting so that one which has stopped
+# fails the test rather than leaving it to time out
+sim_threads = []
+
+class SimulatorStopped(Exception):
+    '''an embedded simulator stopped while a test was running'''
+    pass
+
 def expect_list_clear():
     '''clear the expect list'''
-    global expect_list
+    global expect_list, sim_threads
     for p in expect_list[:]:
         expect_list.remove(p)
+    for s in sim_threads[:]:
+        sim_threads.remove(s)
 
 def expect_list_extend(list):
     '''extend the expect list'''
     global expect_list
     expect_list.extend(list)
 
+def expect_sim_thread(sim):
+    '''check a SimulatorRunner running in a thread while waiting'''
+    global sim_threads
+    sim_threads.append(sim)
+
+def check_sim_threads():
+    '''raise SimulatorStopped if an embedded simulator has stopped. One
+    closed by the test has no thread, and is not an error'''
+    global sim_threads
+    for s in sim_threads:
+        if s.thread is not None and not s.thread.is_alive():
+            raise SimulatorStopped("%s has stopped" % s.name)
+
 def idle_hook(mav):
     '''called when waiting for a mavlink message'''
     global expect_list
     for p in expect_list:
         util.pexpect_drain(p)
+    check_sim_threads()
 
 def message_hook(mav, msg):
     '''called as each mavlink msg is received'''
@@ -33,21 +58,15 @@ def expect_callback(e):
         if p == e:
             continue
         util.pexpect_drain(p)
+    check_sim_threads()
 
 def get_distance(loc1, loc2):
     '''get ground distance between two locations'''
-    dlat 		= loc2.lat - loc1.lat
-    dlong		= loc2.lng - loc1.lng
-    return math.sqrt((dlat*dlat) + (dlong*dlong)) * 1.113195e5
+    return geodesy.gps_distance(loc1.lat, loc1.lng, loc2.lat, loc2.lng)
 
 def get_bearing(loc1, loc2):
     '''get bearing from loc1 to loc2'''
-    off_x = loc2.lng - loc1.lng
-    off_y = loc2.lat - loc1.lat
-    bearing = 90.00 + math.atan2(-off_y, off_x) * 57.2957795
-    if bearing < 0:
-        bearing += 360.00
-    return bearing;
+    return geodesy.gps_bearing(loc1.lat, loc1.lng, loc2.lat, loc2.lng)
 
 def wait_altitude(mav, alt_min, alt_max, timeout=30):
     climb_rate = 0
@@ -162,19 +181,32 @@ def wait_location(mav, loc, accuracy=5, timeout=30, target_altitude=None, height
     print("Failed to attain location")
     return False
 
-def wait_waypoint(mav, wpnum_start, wpnum_end, allow_skip=True, max_dist=2, timeout=400, mode=None):
-    '''wait for waypoint ranges'''
+def waypoint_timeout(legs, wpnum, timeout):
+    '''time allowed to reach waypoint wpnum. With legs, a
+    mission.MissionLegs for the mission, this is twice the expected time
+    of the leg to it plus a minute, but never more than timeout'''
+    if legs is None:
+        return timeout
+    leg = legs.leg_to(wpnum)
+    if leg is None:
+        return timeout
+    return min(timeout, 2*leg.time + 60)
+
+def wait_waypoint(mav, wpnum_start, wpnum_end, allow_skip=True, max_dist=2, timeout=400, mode=None, legs=None):
+    '''wait for waypoint ranges. If the legs of the mission are given
+    the wait for each waypoint is limited by its expected leg time'''
     tstart = time.time()
     # this message arrives after we set the current WP
     start_wp = mav.waypoint_current()
     current_wp = start_wp
+    wp_timeout = waypoint_timeout(legs, current_wp, timeout)
 
     print("\ntest: wait for waypoint ranges start=%u end=%u\n\n" % (wpnum_start, wpnum_end))
     # if start_wp != wpnum_start:
     #    print("test: Expected start waypoint %u but got %u" % (wpnum_start, start_wp))
     #    return False
 
-    while time.time() < tstart + timeout:
+    while time.time() < tstart + wp_timeout:
         seq = mav.waypoint_current()
         m = mav.recv_match(type='NAV_CONTROLLER_OUTPUT', blocking=True)
         wp_dist = m.wp_dist
@@ -190,6 +222,7 @@ def wait_waypoint(mav, wpnum_start, wpnum_end, allow_skip=True, max_dist=2, time
             print("test: Starting new waypoint %u" % seq)
             tstart = time.time()
             current_wp = seq
+            wp_timeout = waypoint_timeout(legs, current_wp, timeout)
             # the wp_dist check is a hack until we can sort out the right seqnum
             # for end of mission
         #if current_wp == wpnum_end or (current_wp == wpnum_end-1 and wp_dist < 2):
@@ -202,7 +235,7 @@ def wait_waypoint(mav, wpnum_start, wpnum_end, allow_skip=True, max_dist=2, time
         if seq > current_wp+1:
             print("Failed: Skipped waypoint! Got wp %u expected %u" % (seq, current_wp+1))
             return False
-    print("Failed: Timed out waiting for waypoint %u of %u" % (wpnum_end, wpnum_end))
+    print("Failed: Timed out after %.0fs waiting for waypoint %u of %u" % (wp_timeout, current_wp, wpnum_end))
     return False
 
 def save_wp(mavproxy, mav):
@@ -2,11 +2,15 @@
 # run a jsbsim model as a child process
 
 import sys, os, pexpect, socket
-import math, time, select, struct, signal, errno
+import math, time, signal, errno
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'pysim'))
 
-import util, atexit, fdpexpect
+import util, atexit, fdpexpect, sitl_protocol
+from runtime import Runtime
+from recording import Recorder
+from windfield import WindField
+from scheduler import monotonic_time
 from pymavlink import fgFDM
 
 class control_state(object):
@@ -26,10 +30,49 @@ def interpret_address(addrstr):
     a[1] = int(a[1])
     return tuple(a)
 
+class ConsoleBatcher(object):
+    '''JSBSim console commands, held until flush() and then written
+    together in one send. Setting a property to the value it already
+    has is dropped, and setting one again before a flush replaces the
+    pending value'''
+    def __init__(self, console):
+        self.console = console
+        self.lines = []
+        self.pending = {} # index in lines of each property being set
+        self.values = {}  # last value set for each property
+        self.commands = 0
+        self.writes = 0
+
+    def set(self, variable, value):
+        '''set a JSBSim property'''
+        if self.values.get(variable, None) == value:
+            return
+        self.values[variable] = value
+        line = 'set %s %s\r\n' % (variable, value)
+        i = self.pending.get(variable, None)
+        if i is None:
+            self.pending[variable] = len(self.lines)
+            self.lines.append(line)
+        else:
+            self.lines[i] = line
+
+    def command(self, cmd):
+        '''queue any other console command'''
+        self.lines.append(cmd + '\n')
+
+    def flush(self):
+        '''write the queued commands'''
+        if not self.lines:
+            return
+        self.console.send(''.join(self.lines))
+        self.commands += len(self.lines)
+        self.writes += 1
+        self.lines = []
+        self.pending = {}
+
 def jsb_set(variable, value):
     '''set a JSBSim variable'''
-    global jsb_console
-    jsb_console.send('set %s %s\r\n' % (variable, value))
+    jsb_batch.set(variable, value)
 
 def setup_template(home):
     '''setup aircraft/Rascal/reset.xml'''
@@ -66,16 +109,14 @@ def setup_template(home):
     print("Wrote %s" % out)
     
 
-def process_sitl_input(buf):
+def process_sitl_input(control):
     '''process control changes from SITL sim'''
-    control = list(struct.unpack('<14H', buf))
-    pwm = control[:11]
-    (speed, direction, turbulance) = control[11:]
+    pwm = control.pwm
 
     global wind
-    wind.speed      = speed*0.01
-    wind.direction  = direction*0.01
-    wind.turbulance = turbulance*0.01
+    wind.speed      = control.speed*0.01
+    wind.direction  = control.direction*0.01
+    wind.turbulance = control.turbulance*0.01
     
     aileron  = (pwm[0]-1500)/500.0
     elevator = (pwm[1]-1500)/500.0
@@ -97,22 +138,23 @@ def process_sitl_input(buf):
         # this matches VTAIL_OUTPUT==2
         elevator = (ch2-ch1)/2.0
         rudder   = (ch2+ch1)/2.0
-        
-    if aileron != sitl_state.aileron:
-        jsb_set('fcs/aileron-cmd-norm', aileron)
-        sitl_state.aileron = aileron
-    if elevator != sitl_state.elevator:
-        jsb_set('fcs/elevator-cmd-norm', elevator)
-        sitl_state.elevator = elevator
-    if rudder != sitl_state.rudder:
-        jsb_set('fcs/rudder-cmd-norm', rudder)
-        sitl_state.rudder = rudder
-    if throttle != sitl_state.throttle:
-        jsb_set('fcs/throttle-cmd-norm', throttle)
-        sitl_state.throttle = throttle
+
+    # unchanged values are dropped by the batcher
+    jsb_set('fcs/aileron-cmd-norm', aileron)
+    jsb_set('fcs/elevator-cmd-norm', elevator)
+    jsb_set('fcs/rudder-cmd-norm', rudder)
+    jsb_set('fcs/throttle-cmd-norm', throttle)
+    sitl_state.aileron = aileron
+    sitl_state.elevator = elevator
+    sitl_state.rudder = rudder
+    sitl_state.throttle = throttle
 
 def update_wind(wind):
     '''update wind simulation'''
+    wind.locate(fdm.get('latitude', units='degrees'),
+                fdm.get('longitude', units='degrees'),
+                fdm.get('altitude', units='meters'),
+                monotonic_time() - wind_start)
     (speed, direction) = wind.current()
     jsb_set('atmosphere/psiw-rad', math.radians(direction))
     jsb_set('atmosphere/wind-mag-fps', speed/0.3048)
@@ -132,30 +174,24 @@ def process_jsb_input(buf):
             if e.errno not in [ errno.ECONNREFUSED ]:
                 raise
 
-    simbuf = struct.pack('<17dI',
-                         fdm.get('latitude', units='degrees'),
-                         fdm.get('longitude', units='degrees'),
-                         fdm.get('altitude', units='meters'),
-                         fdm.get('psi', units='degrees'),
-                         fdm.get('v_north', units='mps'),
-                         fdm.get('v_east', units='mps'),
-                         fdm.get('v_down', units='mps'),
-                         fdm.get('A_X_pilot', units='mpss'),
-                         fdm.get('A_Y_pilot', units='mpss'),
-                         fdm.get('A_Z_pilot', units='mpss'),
-                         fdm.get('phidot', units='dps'),
-                         fdm.get('thetadot', units='dps'),
-                         fdm.get('psidot', units='dps'),
-                         fdm.get('phi', units='degrees'),
-                         fdm.get('theta', units='degrees'),
-                         fdm.get('psi', units='degrees'),
-                         fdm.get('vcas', units='mps'),
-                         0x4c56414f)
-    try:
-        sim_out.send(simbuf)
-    except socket.error as e:
-        if e.errno not in [ errno.ECONNREFUSED ]:
-            raise
+    fdm_pkt.pack(fdm.get('latitude', units='degrees'),
+                 fdm.get('longitude', units='degrees'),
+                 fdm.get('altitude', units='meters'),
+                 fdm.get('psi', units='degrees'),
+                 fdm.get('v_north', units='mps'),
+                 fdm.get('v_east', units='mps'),
+                 fdm.get('v_down', units='mps'),
+                 fdm.get('A_X_pilot', units='mpss'),
+                 fdm.get('A_Y_pilot', units='mpss'),
+                 fdm.get('A_Z_pilot', units='mpss'),
+                 fdm.get('phidot', units='dps'),
+                 fdm.get('thetadot', units='dps'),
+                 fdm.get('psidot', units='dps'),
+                 fdm.get('phi', units='degrees'),
+                 fdm.get('theta', units='degrees'),
+                 fdm.get('psi', units='degrees'),
+                 fdm.get('vcas', units='mps'))
+    fdm_pkt.send(sim_out)
 
 
 
@@ -172,6 +208,9 @@ parser.add_option("--options", type='string', help='jsbsim startup options')
 parser.add_option("--elevon", action='store_true', default=False, help='assume elevon input')
 parser.add_option("--vtail", action='store_true', default=False, help='assume vtail input')
 parser.add_option("--wind", dest="wind", help="Simulate wind (speed,direction,turbulance)", default='0,0,0')
+parser.add_option("--wind-field", dest="wind_field", help="gridded wind file for a wind that varies with position, overriding the SITL wind speed and direction", default=None)
+parser.add_option("--record", help="record the SITL packet streams to a file", default=None)
+parser.add_option("--quiet", action='store_true', default=False, help="don't echo the JSBSim console and output")
 
 (opts, args) = parser.parse_args()
 
@@ -193,7 +232,11 @@ cmd = "JSBSim --realtime --suspend --nice --simulation-rate=1000 --logdirectivef
 if opts.options:
     cmd += ' %s' % opts.options
 
-jsb = pexpect.spawn(cmd, logfile=sys.stdout, timeout=10)
+if opts.quiet:
+    logfile = None
+else:
+    logfile = sys.stdout
+jsb = pexpect.spawn(cmd, logfile=logfile, timeout=10)
 jsb.delaybeforesend = 0
 util.pexpect_autoclose(jsb)
 i = jsb.expect(["Successfully bound to socket for input on port (\d+)",
@@ -211,8 +254,9 @@ jsb.expect("JSBSim Execution beginning")
 print("JSBSim console on %s" % str(jsb_out_address))
 jsb_out = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 jsb_out.connect(jsb_out_address)
-jsb_console = fdpexpect.fdspawn(jsb_out.fileno(), logfile=sys.stdout)
+jsb_console = fdpexpect.fdspawn(jsb_out.fileno(), logfile=logfile)
 jsb_console.delaybeforesend = 0
+jsb_batch = ConsoleBatcher(jsb_console)
 
 # setup input from jsbsim
 print("JSBSim FG FDM input on %s" % str(jsb_in_address))
@@ -228,11 +272,19 @@ sim_in_address  = interpret_address(opts.simin)
 sim_in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sim_in.bind(sim_in_address)
 sim_in.setblocking(0)
+sim_control = sitl_protocol.ControlPacket(sim_in)
 
 # setup output to SITL sim
 sim_out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 sim_out.connect(interpret_address(opts.simout))
 sim_out.setblocking(0)
+fdm_pkt = sitl_protocol.FDMPacket()
+
+# optionally record the packets to and from SITL
+if opts.record:
+    recorder = Recorder(opts.record)
+    sim_control.recorder = recorder
+    fdm_pkt.recorder = recorder
 
 # setup possible output to FlightGear for display
 fg_out = None
@@ -243,6 +295,9 @@ if opts.fgout:
 
 # setup wind generator
 wind = util.Wind(opts.wind)
+if opts.wind_field:
+    wind.field = WindField(opts.wind_field)
+wind_start = monotonic_time()
 
 fdm = fgFDM.fgFDM()
 
@@ -254,71 +309,78 @@ jsb_console.logfile = None
 
 print("Simulator ready to fly")
 
+def jsb_input():
+    '''handle FG FDM packets from JSBSim'''
+    global frame_count
+    buf = jsb_in.recv(fdm.packet_size())
+    process_jsb_input(buf)
+    frame_count += 1
+
+def sitl_input():
+    '''handle all pending control packets from SITL. Only the last
+    value of each control is sent to JSBSim'''
+    global last_sim_input
+    while sim_control.recv():
+        process_sitl_input(sim_control)
+        last_sim_input = monotonic_time()
+
+def check_pause():
+    '''hold JSBSim while SITL isn't sending'''
+    global paused
+    if monotonic_time() - last_sim_input > 0.2:
+        if not paused:
+            print("PAUSING SIMULATION")
+            paused = True
+            jsb_batch.command('hold')
+    else:
+        if paused:
+            print("RESUMING SIMULATION")
+            paused = False
+            jsb_batch.command('resume')
+
+def report():
+    '''show the frame rate and state'''
+    global frame_count, last_report
+    tnow = monotonic_time()
+    print("FPS %u asl=%.1f agl=%.1f roll=%.1f pitch=%.1f a=(%.2f %.2f %.2f) console %u cmds in %u writes" % (
+        frame_count / (tnow - last_report),
+        fdm.get('altitude', units='meters'),
+        fdm.get('agl', units='meters'),
+        fdm.get('phi', units='degrees'),
+        fdm.get('theta', units='degrees'),
+        fdm.get('A_X_pilot', units='mpss'),
+        fdm.get('A_Y_pilot', units='mpss'),
+        fdm.get('A_Z_pilot', units='mpss'),
+        jsb_batch.commands, jsb_batch.writes))
+    jsb_batch.commands = 0
+    jsb_batch.writes = 0
+    frame_count = 0
+    last_report = tnow
+
 def main_loop():
     '''run main loop'''
-    tnow = time.time()
+    global last_report, last_sim_input, frame_count, paused
+    tnow = monotonic_time()
     last_report = tnow
     last_sim_input = tnow
-    last_wind_update = tnow
     frame_count = 0
     paused = False
 
-    while True:
-        rin = [jsb_in.fileno(), sim_in.fileno(), jsb_console.fileno(), jsb.fileno()]
-        try:
-            (rin, win, xin) = select.select(rin, [], [], 1.0)
-        except select.error:
-            util.check_parent()
-            continue
-
-        tnow = time.time()
-
-        if jsb_in.fileno() in rin:
-            buf = jsb_in.recv(fdm.packet_size())
-            process_jsb_input(buf)
-            frame_count += 1
-
-        if sim_in.fileno() in rin:
-            simbuf = sim_in.recv(28)
-            process_sitl_input(simbuf)
-            last_sim_input = tnow
-
-        # show any jsbsim console output
-        if jsb_console.fileno() in rin:
-            util.pexpect_drain(jsb_console)
-        if jsb.fileno() in rin:
-            util.pexpect_drain(jsb)
-
-        if tnow - last_sim_input > 0.2:
-            if not paused:
-                print("PAUSING SIMULATION")
-                paused = True
-                jsb_console.send('hold\n')
-        else:
-            if paused:
-                print("RESUMING SIMULATION")
-                paused = False
-                jsb_console.send('resume\n')
-
-        # only simulate wind above 5 meters, to prevent crashes while
-        # waiting for takeoff
-        if tnow - last_wind_update > 0.1:
-            update_wind(wind)
-            last_wind_update = tnow
-
-        if tnow - last_report > 3:
-            print("FPS %u asl=%.1f agl=%.1f roll=%.1f pitch=%.1f a=(%.2f %.2f %.2f)" % (
-                frame_count / (time.time() - last_report),
-                fdm.get('altitude', units='meters'),
-                fdm.get('agl', units='meters'),
-                fdm.get('phi', units='degrees'),
-                fdm.get('theta', units='degrees'),
-                fdm.get('A_X_pilot', units='mpss'),
-                fdm.get('A_Y_pilot', units='mpss'),
-                fdm.get('A_Z_pilot', units='mpss')))
-
-            frame_count = 0
-            last_report = time.time()
+    rt = Runtime()
+    rt.add_reader(jsb_in, jsb_input)
+    rt.add_reader(sim_in, sitl_input)
+    # show any jsbsim console output
+    rt.add_reader(jsb_console, lambda : util.pexpect_drain(jsb_console))
+    rt.add_reader(jsb, lambda : util.pexpect_drain(jsb))
+    rt.call_every(0.02, check_pause)
+    rt.call_every(0.1, lambda : update_wind(wind))
+    rt.call_every(3, report)
+    rt.call_every(1, util.check_parent)
+    # everything set during a pass goes to JSBSim in one write
+    rt.call_each_pass(jsb_batch.flush)
+    if opts.record:
+        rt.call_every(1, recorder.flush)
+    rt.run()
 
 def exit_handler():
     '''exit the sim'''
@@ -330,6 +392,8 @@ def exit_handler():
     jsb_console.send('quit\n')
     jsb.close(force=True)
     util.pexpect_close_all()
+    if opts.record:
+        recorder.close()
     sys.exit(1)
 
 signal.signal(signal.SIGINT, exit_handler)
@@ -0,0 +1,139 @@
+'''
+leg tables for waypoint missions, worked out once when a mission file
+is loaded so tests and post-flight analysis can look up distances,
+headings and expected times rather than recomputing them point by point
+'''
+
+import geodesy
+from pymavlink import mavwp
+
+# mission commands used when building legs
+MAV_CMD_NAV_WAYPOINT = 16
+MAV_CMD_NAV_LOITER_TIME = 19
+MAV_CMD_NAV_RETURN_TO_LAUNCH = 20
+MAV_CMD_NAV_LAST = 95
+MAV_CMD_DO_CHANGE_SPEED = 178
+
+# frame of altitudes relative to home
+MAV_FRAME_GLOBAL_RELATIVE_ALT = 3
+
+class MissionLeg(object):
+    '''one straight leg of a mission, between two navigation waypoints'''
+    def __init__(self, start, end, lat1, lon1, alt1, lat2, lon2, alt2, speed, climb_rate, hold=0.0):
+        self.start = start # mission index of the start waypoint
+        self.end = end     # mission index of the waypoint the leg goes to
+        self.lat = lat2
+        self.lng = lon2
+        self.alt = alt2    # meters above home
+        self.distance = geodesy.gps_distance(lat1, lon1, lat2, lon2)
+        self.bearing = geodesy.gps_bearing(lat1, lon1, lat2, lon2)
+        self.alt_change = alt2 - alt1
+        self.speed = speed
+        self.time = self.distance / speed
+        if climb_rate:
+            self.time = max(self.time, abs(self.alt_change) / climb_rate)
+        # time spent waiting at the end waypoint
+        self.hold = hold
+        self.time += hold
+        # totals up to the end of this leg, filled in by MissionLegs
+        self.cumulative_distance = 0.0
+        self.cumulative_time = 0.0
+
+
+class MissionLegs(object):
+    '''the legs of a mission file loaded with mavwp.MAVWPLoader, flown at
+    speed m/s unless the mission changes it. If climb_rate is given a leg
+    takes at least as long as its height change at that rate. Hold and
+    loiter times at waypoints are included in the leg times.
+
+    Legs start at home (waypoint 0) and go to each navigation command
+    with a position. Commands without one, such as a takeoff, stay where
+    they are, and a return to launch goes back to home'''
+    def __init__(self, filename, speed=5.0, climb_rate=None):
+        self.filename = filename
+        wploader = mavwp.MAVWPLoader()
+        wploader.load(filename)
+        self.count = wploader.count()
+        self.legs = []
+        if self.count == 0:
+            self.total_distance = 0.0
+            self.total_time = 0.0
+            return
+
+        home = wploader.wp(0)
+        (home_lat, home_lon) = (home.x, home.y)
+        (lat, lon, alt) = (home_lat, home_lon, 0.0)
+        prev = 0
+        for i in range(1, self.count):
+            wp = wploader.wp(i)
+            if wp.command == MAV_CMD_DO_CHANGE_SPEED and wp.param2 > 0:
+                speed = wp.param2
+                continue
+            if wp.command >= MAV_CMD_NAV_LAST:
+                continue
+            if wp.frame == MAV_FRAME_GLOBAL_RELATIVE_ALT:
+                wp_alt = wp.z
+            else:
+                wp_alt = wp.z - home.z
+            if wp.command == MAV_CMD_NAV_RETURN_TO_LAUNCH:
+                (wp_lat, wp_lon) = (home_lat, home_lon)
+                wp_alt = alt
+            elif wp.x == 0 and wp.y == 0:
+                (wp_lat, wp_lon) = (lat, lon)
+            else:
+                (wp_lat, wp_lon) = (wp.x, wp.y)
+            hold = 0.0
+            if wp.command in [ MAV_CMD_NAV_WAYPOINT, MAV_CMD_NAV_LOITER_TIME ]:
+                hold = wp.param1
+            self.legs.append(MissionLeg(prev, i, lat, lon, alt, wp_lat, wp_lon, wp_alt,
+                                        speed, climb_rate, hold=hold))
+            (lat, lon, alt) = (wp_lat, wp_lon, wp_alt)
+            prev = i
+
+        total_distance = 0.0
+        total_time = 0.0
+        for leg in self.legs:
+            total_distance += leg.distance
+            total_time += leg.time
+            leg.cumulative_distance = total_distance
+            leg.cumulative_time = total_time
+        self.total_distance = total_distance
+        self.total_time = total_time
+
+    def leg_to(self, wpnum):
+        '''return the leg ending at mission index wpnum, or None'''
+        for leg in self.legs:
+            if leg.end == wpnum:
+                return leg
+        return None
+
+    def progress(self, wpnum, loc):
+        '''distance in meters flown along the mission at location loc
+        while heading for waypoint wpnum'''
+        leg = self.leg_to(wpnum)
+        if leg is None:
+            return 0.0
+        remaining = geodesy.gps_distance(loc.lat, loc.lng, leg.lat, leg.lng)
+        return leg.cumulative_distance - min(remaining, leg.distance)
+
+    def expected_time(self, wpnum_start=0, wpnum_end=None):
+        '''expected time in seconds to fly from waypoint wpnum_start to
+        wpnum_end, by default to the end of the mission'''
+        t = 0.0
+        for leg in self.legs:
+            if leg.start >= wpnum_start and (wpnum_end is None or leg.end <= wpnum_end):
+                t += leg.time
+        return t
+
+    def distances_to(self, lats, lngs, wpnum):
+        '''distances from arrays of positions, such as a flight log, to
+        waypoint wpnum. Needs numpy'''
+        leg = self.leg_to(wpnum)
+        if leg is None:
+            raise RuntimeError("No leg ends at waypoint %u" % wpnum)
+        return geodesy.gps_distance_array(lats, lngs, leg.lat, leg.lng)
+
+    def summary(self):
+        '''a one line description of the mission'''
+        return "Mission %s: %u legs, %.0fm, expected %.0fs" % (
+            self.filename, len(self.legs), self.total_distance, self.total_time)
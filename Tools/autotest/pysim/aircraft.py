@@ -1,9 +1,10 @@
-import math, util, rotmat
-from rotmat import Vector3, Matrix3
+import math, util, rotmat, time, random, zlib, geodesy
+import cPickle as pickle
+from rotmat import Vector3, Matrix3, Quaternion
 
 class Aircraft(object):
     '''a basic aircraft class'''
-    def __init__(self):
+    def __init__(self, use_quaternion=False):
         self.home_latitude = 0
         self.home_longitude = 0
         self.home_altitude = 0
@@ -14,8 +15,19 @@ class Aircraft(object):
         self.longitude = self.home_longitude
         self.altitude  = self.home_altitude
 
+        # conversion from position to lat/lon/alt about home. With wgs84
+        # set before set_home() it follows the WGS84 ellipsoid rather
+        # than matching util.gps_newpos()
+        self.wgs84 = False
+        self.ltp = geodesy.LocalTangentPlane(self.home_latitude, self.home_longitude, self.home_altitude)
+
         self.dcm = Matrix3()
 
+        # optionally integrate attitude as a quaternion, with dcm
+        # derived from it each step
+        self.use_quaternion = use_quaternion
+        self.quaternion = Quaternion()
+
         # rotation rate in body frame
         self.gyro = Vector3(0,0,0) # rad/s
 
@@ -25,33 +37,252 @@ class Aircraft(object):
         self.update_frequency = 50 # in Hz
         self.gravity = 9.80665 # m/s/s
         self.accelerometer = Vector3(0, 0, -self.gravity)
+        self.accel_body = Vector3(0, 0, -self.gravity)
+
+        # acceleration in earth frame over the last integration step
+        self.accel_earth = Vector3(0, 0, 0) # m/s/s
+
+        # integration method used by integrate(), either
+        # 'semi-implicit' or 'rk4', and the number of physics sub-steps
+        # to make for each update
+        self.integrator = 'semi-implicit'
+        self.substeps = 1
+        self._dcm_start = Matrix3()
+        self._dcm_mid = Matrix3()
+        self._gyro_mean = Vector3()
 
         self.wind = util.Wind('0,0,0')
 
+        # simulation clock. This advances by the time step of each
+        # update, whether that comes from the wall clock or is given
+        # explicitly for lockstep operation
+        self.time_now = 0.0
+        self.last_time = time.time()
+
+        # values derived from the attitude, gyro and velocity are
+        # computed lazily and cached until the state version changes
+        self._version = 0
+        self._euler = None
+        self._euler_version = -1
+        self._dcm_T = Matrix3()
+        self._dcm_T_version = -1
+        self._earth_rates = None
+        self._earth_rates_version = -1
+        self._velocity_body = Vector3()
+        self._velocity_body_version = -1
+
+    def invalidate(self):
+        '''mark the derived state as stale. This must be called after
+        changing dcm, gyro or velocity in place'''
+        self._version += 1
+
+    @property
+    def euler(self):
+        '''attitude as a (roll, pitch, yaw) tuple in radians'''
+        if self._euler_version != self._version:
+            self._euler = self.dcm.to_euler()
+            self._euler_version = self._version
+        return self._euler
+
+    @property
+    def dcm_T(self):
+        '''transpose of dcm, rotating earth frame to body frame'''
+        if self._dcm_T_version != self._version:
+            self.dcm.transposed_into(self._dcm_T)
+            self._dcm_T_version = self._version
+        return self._dcm_T
+
+    @property
+    def earth_rates(self):
+        '''rotation rates in earth frame, rad/s'''
+        if self._earth_rates_version != self._version:
+            self._earth_rates = util.BodyRatesToEarthRates(self.dcm, self.gyro, euler=self.euler)
+            self._earth_rates_version = self._version
+        return self._earth_rates
+
+    @property
+    def velocity_body(self):
+        '''velocity in body frame, m/s'''
+        if self._velocity_body_version != self._version:
+            self.dcm_T.mul_vec_into(self.velocity, self._velocity_body)
+            self._velocity_body_version = self._version
+        return self._velocity_body
+
+    @property
+    def airspeed(self):
+        '''airspeed in m/s. Without a model of the air this is the
+        horizontal ground speed'''
+        v = self.velocity
+        return math.sqrt(v.x*v.x + v.y*v.y)
+
     def on_ground(self, position=None):
         '''return true if we are on the ground'''
         if position is None:
             position = self.position
         return (-position.z) + self.home_altitude <= self.ground_level + self.frame_height
 
+    def time_advance(self, delta_time=None):
+        '''advance the simulation clock, returning the time step in
+        seconds. If delta_time is None the time step is taken from the
+        wall clock'''
+        if delta_time is None:
+            t = time.time()
+            delta_time = t - self.last_time
+            self.last_time = t
+        self.time_now += delta_time
+        return delta_time
+
+    def update_attitude(self, delta_time, gyro=None):
+        '''integrate the attitude over delta_time using the body frame
+        gyro, or the given body frame rotation rate'''
+        if gyro is None:
+            gyro = self.gyro
+        if self.use_quaternion:
+            self.quaternion.rotate(gyro, delta_time)
+            self.quaternion.normalize()
+            self.quaternion.rotation_matrix(self.dcm)
+        else:
+            self.dcm.rotate_inplace(gyro, delta_time)
+            self.dcm.normalize_inplace()
+        self.invalidate()
+
+    def integrate(self, h):
+        '''advance gyro, attitude, velocity and position by h seconds
+        using the selected integrator. Models using this provide
+        rotational_accel(gx, gy, gz), giving body frame rotational
+        acceleration, and earth_accel(vx, vy, vz, dcm), giving earth
+        frame acceleration. Both return tuples. The mean earth frame
+        acceleration over the step is left in accel_earth'''
+        g = self.gyro
+        v = self.velocity
+        if self.integrator == 'semi-implicit':
+            # rates are updated before they are used
+            (rx, ry, rz) = self.rotational_accel(g.x, g.y, g.z)
+            g.set(g.x + rx*h, g.y + ry*h, g.z + rz*h)
+            self.update_attitude(h)
+            (ax, ay, az) = self.earth_accel(v.x, v.y, v.z, self.dcm)
+            v.set(v.x + ax*h, v.y + ay*h, v.z + az*h)
+            self.position.iadd_scaled(v, h)
+        elif self.integrator == 'rk4':
+            f = self.rotational_accel
+            (gx, gy, gz) = (g.x, g.y, g.z)
+            (k1x, k1y, k1z) = f(gx, gy, gz)
+            (g2x, g2y, g2z) = (gx + 0.5*h*k1x, gy + 0.5*h*k1y, gz + 0.5*h*k1z)
+            (k2x, k2y, k2z) = f(g2x, g2y, g2z)
+            (g3x, g3y, g3z) = (gx + 0.5*h*k2x, gy + 0.5*h*k2y, gz + 0.5*h*k2z)
+            (k3x, k3y, k3z) = f(g3x, g3y, g3z)
+            (g4x, g4y, g4z) = (gx + h*k3x, gy + h*k3y, gz + h*k3z)
+            (k4x, k4y, k4z) = f(g4x, g4y, g4z)
+            g.set(gx + h*(k1x + 2*k2x + 2*k3x + k4x)/6.0,
+                  gy + h*(k1y + 2*k2y + 2*k3y + k4y)/6.0,
+                  gz + h*(k1z + 2*k2z + 2*k3z + k4z)/6.0)
+
+            # rotate by the mean rate over the step, keeping the start
+            # and mid-point attitudes for the translational stages
+            wm = self._gyro_mean.set((gx + 2*g2x + 2*g3x + g4x)/6.0,
+                                     (gy + 2*g2y + 2*g3y + g4y)/6.0,
+                                     (gz + 2*g2z + 2*g3z + g4z)/6.0)
+            dcm0 = self._dcm_start.copy_from(self.dcm)
+            dcm_mid = self._dcm_mid.copy_from(self.dcm)
+            dcm_mid.rotate_inplace(wm, 0.5*h)
+            dcm_mid.normalize_inplace()
+            self.update_attitude(h, gyro=wm)
+
+            f = self.earth_accel
+            (vx, vy, vz) = (v.x, v.y, v.z)
+            (k1x, k1y, k1z) = f(vx, vy, vz, dcm0)
+            (v2x, v2y, v2z) = (vx + 0.5*h*k1x, vy + 0.5*h*k1y, vz + 0.5*h*k1z)
+            (k2x, k2y, k2z) = f(v2x, v2y, v2z, dcm_mid)
+            (v3x, v3y, v3z) = (vx + 0.5*h*k2x, vy + 0.5*h*k2y, vz + 0.5*h*k2z)
+            (k3x, k3y, k3z) = f(v3x, v3y, v3z, dcm_mid)
+            (v4x, v4y, v4z) = (vx + h*k3x, vy + h*k3y, vz + h*k3z)
+            (k4x, k4y, k4z) = f(v4x, v4y, v4z, self.dcm)
+            ax = (k1x + 2*k2x + 2*k3x + k4x)/6.0
+            ay = (k1y + 2*k2y + 2*k3y + k4y)/6.0
+            az = (k1z + 2*k2z + 2*k3z + k4z)/6.0
+            self.position.set(self.position.x + h*(vx + 2*v2x + 2*v3x + v4x)/6.0,
+                              self.position.y + h*(vy + 2*v2y + 2*v3y + v4y)/6.0,
+                              self.position.z + h*(vz + 2*v2z + 2*v3z + v4z)/6.0)
+            v.set(vx + h*ax, vy + h*ay, vz + h*az)
+        else:
+            raise RuntimeError("Unknown integrator '%s'" % self.integrator)
+        self.accel_earth.set(ax, ay, az)
+
+    def set_euler(self, roll, pitch, yaw):
+        '''set the attitude from Euler angles in radians'''
+        self.dcm.from_euler(roll, pitch, yaw)
+        self.quaternion.from_euler(roll, pitch, yaw)
+        self.invalidate()
+
     def update_position(self, delta_time):
         '''update lat/lon/alt from position'''
+        p = self.position
+        (self.latitude, self.longitude, self.altitude) = self.ltp.ned_to_lla(p.x, p.y, p.z)
 
-        bearing = math.degrees(math.atan2(self.position.y, self.position.x))
-        distance = math.sqrt(self.position.x**2 + self.position.y**2)
+        self.accelerometer.copy_from(self.accel_body)
 
-        (self.latitude, self.longitude) = util.gps_newpos(self.home_latitude, self.home_longitude,
-                                                          bearing, distance)
+        # velocity and attitude have changed for this step
+        self.invalidate()
 
-        self.altitude  = self.home_altitude - self.position.z
+    # checkpoint blobs start with this, followed by the version number
+    snapshot_magic = 'PYSIMCK'
+    snapshot_version = 1
 
-        velocity_body = self.dcm.transposed() * self.velocity
+    def snapshot(self):
+        '''return the complete model state, including wind and the random
+        number generator, as a compact binary blob'''
+        state = { 'class'  : self.__class__.__name__,
+                  'model'  : self.__dict__,
+                  'random' : random.getstate() }
+        return '%s%u' % (self.snapshot_magic, self.snapshot_version) + \
+            zlib.compress(pickle.dumps(state, 2))
 
-        self.accelerometer = self.accel_body.copy()
+    def restore(self, blob):
+        '''restore the model state from a blob made by snapshot()'''
+        header = '%s%u' % (self.snapshot_magic, self.snapshot_version)
+        if not blob.startswith(header):
+            raise RuntimeError("Not a version %u checkpoint" % self.snapshot_version)
+        state = pickle.loads(zlib.decompress(blob[len(header):]))
+        if state['class'] != self.__class__.__name__:
+            raise RuntimeError("Checkpoint is for a %s, not a %s" % (state['class'],
+                                                                   self.__class__.__name__))
+        self.__dict__.update(state['model'])
+        random.setstate(state['random'])
+
+        # carry on from now rather than from when the snapshot was taken
+        self.last_time = time.time()
+        self.wind.tlast = time.time()
+        self.invalidate()
+
+    def save_checkpoint(self, filename):
+        '''write a snapshot to a file'''
+        f = open(filename, mode='wb')
+        f.write(self.snapshot())
+        f.close()
+
+    def load_checkpoint(self, filename):
+        '''restore from a snapshot file'''
+        f = open(filename, mode='rb')
+        blob = f.read()
+        f.close()
+        self.restore(blob)
+
+    def set_home(self, latitude, longitude, altitude, yaw_degrees):
+        '''place the aircraft on the ground at a home position and heading'''
+        self.home_latitude = latitude
+        self.home_longitude = longitude
+        self.home_altitude = altitude
+        self.ground_level = altitude
+        self.ltp = geodesy.LocalTangentPlane(latitude, longitude, altitude, wgs84=self.wgs84)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.position.z = 0
+        self.set_yaw_degrees(yaw_degrees)
 
     def set_yaw_degrees(self, yaw_degrees):
         '''rotate to the given yaw'''
-        (roll, pitch, yaw) = self.dcm.to_euler()
+        (roll, pitch, yaw) = self.euler
         yaw = math.radians(yaw_degrees)
-        self.dcm.from_euler(roll, pitch, yaw)
-        
+        self.set_euler(roll, pitch, yaw)
+
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+'''
+conversion from a North, East, Down position relative to a home point
+to latitude, longitude and altitude. The scale factors for the home
+point are worked out once, so each conversion is a few multiplies.
+Also great circle distance and bearing between points, singly or for
+whole arrays
+'''
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for LocalTangentPlaneArray and the array
+    # distance and bearing functions
+    numpy = None
+
+# the spherical earth used by util.gps_newpos()
+radius_of_earth = 6378100.0 # in meters
+
+# WGS84 ellipsoid
+wgs84_a = 6378137.0
+wgs84_f = 1.0/298.257223563
+wgs84_e2 = wgs84_f * (2.0 - wgs84_f)
+
+def _need_numpy():
+    if numpy is None:
+        raise RuntimeError("numpy is required for array geodesy")
+
+def gps_distance(lat1, lon1, lat2, lon2):
+    '''great circle distance in meters between two points given in
+    degrees, by the haversine formula'''
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(0.5*dlat)**2 + math.cos(lat1)*math.cos(lat2)*math.sin(0.5*dlon)**2
+    return 2.0 * radius_of_earth * math.asin(min(1.0, math.sqrt(a)))
+
+def gps_bearing(lat1, lon1, lat2, lon2):
+    '''initial bearing in degrees, 0 to 360, of the great circle from the
+    first point to the second'''
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    dlon = math.radians(lon2 - lon1)
+    y = math.sin(dlon) * math.cos(lat2)
+    x = math.cos(lat1)*math.sin(lat2) - math.sin(lat1)*math.cos(lat2)*math.cos(dlon)
+    return math.degrees(math.atan2(y, x)) % 360.0
+
+def gps_distance_array(lat1, lon1, lat2, lon2):
+    '''gps_distance() for numpy arrays of points, or between an array
+    and a single point'''
+    _need_numpy()
+    lat1 = numpy.radians(lat1)
+    lat2 = numpy.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = numpy.radians(numpy.subtract(lon2, lon1))
+    a = numpy.sin(0.5*dlat)**2 + numpy.cos(lat1)*numpy.cos(lat2)*numpy.sin(0.5*dlon)**2
+    return 2.0 * radius_of_earth * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(a)))
+
+def gps_bearing_array(lat1, lon1, lat2, lon2):
+    '''gps_bearing() for numpy arrays of points, or between an array and
+    a single point'''
+    _need_numpy()
+    lat1 = numpy.radians(lat1)
+    lat2 = numpy.radians(lat2)
+    dlon = numpy.radians(numpy.subtract(lon2, lon1))
+    y = numpy.sin(dlon) * numpy.cos(lat2)
+    x = numpy.cos(lat1)*numpy.sin(lat2) - numpy.sin(lat1)*numpy.cos(lat2)*numpy.cos(dlon)
+    return numpy.degrees(numpy.arctan2(y, x)) % 360.0
+
+def _sphere_factors(lat0, cos, tan, sqrt):
+    '''scale factors of the spherical conversion at latitude lat0, in
+    degrees per meter and degrees per square meter'''
+    lat = lat0 * (math.pi/180.0)
+    (c, t) = (cos(lat), tan(lat))
+    return _surface_factors(c, t, radius_of_earth, radius_of_earth)
+
+def _wgs84_factors(lat0, cos, tan, sqrt):
+    '''scale factors of the conversion on the WGS84 ellipsoid at
+    latitude lat0, from its meridian and prime vertical radii of
+    curvature there'''
+    lat = lat0 * (math.pi/180.0)
+    (c, t) = (cos(lat), tan(lat))
+    w2 = 1.0 - wgs84_e2*(1.0 - c*c)
+    N = wgs84_a / sqrt(w2)
+    M = N * (1.0 - wgs84_e2) / w2
+    return _surface_factors(c, t, M, N)
+
+def _surface_factors(c, t, M, N):
+    '''degrees per meter and degrees per square meter for a surface with
+    meridian radius M and prime vertical radius N at the home point,
+    given the cosine and tangent of its latitude'''
+    deg = 180.0/math.pi
+    return (deg / M,
+            deg * t / (2*M*N),
+            deg / (N * c),
+            deg * t / (M * N * c))
+
+def _surface_to_lla(p, n, e, d):
+    '''second order expansion of the position n meters north and e
+    meters east of home along the surface, as util.gps_newpos() gives it
+    on a sphere, within a millimeter of it up to 1km from home. North and
+    east are distances along the surface rather than the tangent plane,
+    so altitude is always home altitude less d. Works on floats or
+    arrays'''
+    lat = p.lat0 + n*p.k_lat - e*e*p.k_lat2
+    lon = p.lon0 + e*p.k_lon + n*e*p.k_lon2
+    return (lat, lon, p.alt0 - d)
+
+
+class LocalTangentPlane(object):
+    '''conversion from NED offsets in meters about a home point to
+    latitude and longitude in degrees and altitude in meters. By default
+    this matches util.gps_newpos() on a spherical earth, with wgs84 set
+    it uses the radii of curvature of the WGS84 ellipsoid at home'''
+    def __init__(self, lat0, lon0, alt0=0.0, wgs84=False):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.alt0 = alt0
+        self.wgs84 = wgs84
+        factors = _wgs84_factors if wgs84 else _sphere_factors
+        (self.k_lat, self.k_lat2, self.k_lon, self.k_lon2) = factors(lat0, math.cos, math.tan, math.sqrt)
+
+    def ned_to_lla(self, n, e, d):
+        '''return (latitude, longitude, altitude) for a NED offset'''
+        return _surface_to_lla(self, n, e, d)
+
+
+class LocalTangentPlaneArray(object):
+    '''the same conversion as LocalTangentPlane for many vehicles at once,
+    each with its own home point. Takes and returns numpy arrays'''
+    def __init__(self, lat0, lon0, alt0, wgs84=False):
+        _need_numpy()
+        self.lat0 = numpy.array(lat0, dtype=float)
+        self.lon0 = numpy.array(lon0, dtype=float)
+        self.alt0 = numpy.array(alt0, dtype=float)
+        self.wgs84 = wgs84
+        factors = _wgs84_factors if wgs84 else _sphere_factors
+        (self.k_lat, self.k_lat2, self.k_lon, self.k_lon2) = factors(self.lat0, numpy.cos, numpy.tan, numpy.sqrt)
+
+    def ned_to_lla(self, n, e, d):
+        '''return arrays of (latitude, longitude, altitude) for arrays of
+        NED offsets'''
+        return _surface_to_lla(self, n, e, d)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 from aircraft import Aircraft
-import util, time, math
+import util, time, math, operator
 from math import degrees, radians
 from rotmat import Vector3, Matrix3
 
@@ -12,9 +12,45 @@ class Motor(object):
         self.servo = servo # what servo output drives this motor
 
 
-def build_motors(frame):
-    '''build a motors list given a frame type'''
+def load_frames(filename):
+    '''load multicopter frame definitions from a text file, returning a
+    dictionary of motor lists indexed by frame name.
+
+    Each frame starts with a line 'frame NAME [NAME...]' giving one or
+    more names for the frame, followed by one line per motor of the form
+    'motor ANGLE DIRECTION SERVO', where ANGLE is in degrees from the
+    front, DIRECTION is CW or CCW and SERVO is the servo output (starting
+    at 1) that drives the motor. Blank lines and lines starting with #
+    are ignored.
+    '''
+    frames = {}
+    motors = None
+    f = open(filename, mode='r')
+    for (lineno, line) in enumerate(f, 1):
+        a = line.split()
+        if len(a) == 0 or a[0].startswith('#'):
+            continue
+        if a[0] == 'frame' and len(a) > 1:
+            motors = []
+            for name in a[1:]:
+                frames[name.lower()] = motors
+        elif a[0] == 'motor' and len(a) == 4 and motors is not None and a[2].upper() in ['CW', 'CCW']:
+            motors.append(Motor(float(a[1]), a[2].upper() == 'CW', int(a[3])))
+        else:
+            f.close()
+            raise RuntimeError("Bad frame definition at %s:%u" % (filename, lineno))
+    f.close()
+    return frames
+
+
+def build_motors(frame, frame_file=None):
+    '''build a motors list given a frame type. Frames defined in
+    frame_file take precedence over the built in frames'''
     frame = frame.lower()
+    if frame_file is not None:
+        frames = load_frames(frame_file)
+        if frame in frames:
+            return frames[frame]
     if frame in [ 'quad', '+', 'x' ]:
         motors = [
             Motor(90,  False,  1),
@@ -72,109 +108,192 @@ def build_motors(frame):
     return motors
 
 
+class MotorMixer(object):
+    '''precomputed mixing coefficients for a list of motors'''
+    def __init__(self, motors):
+        self.motors = motors
+        # index into the servos array for each motor
+        self.servo_index = [ mot.servo-1 for mot in motors ]
+        # rotational acceleration in rad/s/s per unit of motor speed
+        self.roll  = [ -radians(5000.0) * math.sin(radians(mot.angle)) for mot in motors ]
+        self.pitch = [  radians(5000.0) * math.cos(radians(mot.angle)) for mot in motors ]
+        self.yaw   = [ -radians(400.0) if mot.clockwise else radians(400.0) for mot in motors ]
+
+    def motor_speeds(self, servos, motor_speed):
+        '''fill motor_speed from the servo outputs'''
+        for i, s in enumerate(self.servo_index):
+            servo = servos[s]
+            if servo <= 0.0:
+                motor_speed[i] = 0
+            else:
+                motor_speed[i] = servo
+
+
+def dot(a, b):
+    '''dot product of two equal length sequences'''
+    return sum(map(operator.mul, a, b))
+
+
 class MultiCopter(Aircraft):
     '''a MultiCopter'''
     def __init__(self, frame='+',
                  hover_throttle=0.45,
                  terminal_velocity=15.0,
                  frame_height=0.1,
-                 mass=1.5):
-        Aircraft.__init__(self)
-        self.motors = build_motors(frame)
+                 mass=1.5,
+                 use_quaternion=False,
+                 frame_file=None,
+                 integrator='semi-implicit',
+                 substeps=1,
+                 wind_drag=False):
+        Aircraft.__init__(self, use_quaternion=use_quaternion)
+        self.integrator = integrator
+        self.substeps = substeps
+        self.motors = build_motors(frame, frame_file=frame_file)
+        self.mixer = MotorMixer(self.motors)
         self.motor_speed = [ 0.0 ] * len(self.motors)
         self.mass = mass # Kg
         self.hover_throttle = hover_throttle
         self.terminal_velocity = terminal_velocity
         self.terminal_rotation_rate = 4*radians(360.0)
         self.frame_height = frame_height
+        self.wind_drag = wind_drag
 
         # scaling from total motor power to Newtons. Allows the copter
         # to hover against gravity when each motor is at hover_throttle
         self.thrust_scale = (self.mass * self.gravity) / (len(self.motors) * self.hover_throttle)
 
-        self.last_time = time.time()
+        # rotational air resistance, in rad/s/s per rad/s of rotation
+        self.rot_drag_xy = radians(5000.0) / self.terminal_rotation_rate
+        self.rot_drag_z  = radians(400.0)  / self.terminal_rotation_rate
 
-    def update(self, servos):
-        for i in range(0, len(self.motors)):
-            servo = servos[self.motors[i].servo-1]
-            if servo <= 0.0:
+        # motor rotational acceleration and thrust for the current update
+        self._motor_rot_accel = (0.0, 0.0, 0.0)
+        self._thrust = 0.0
 
-                self.motor_speed[i] = 0
-            else:
-                self.motor_speed[i] = servo
+        # wind as an x,y vector for the current update
+        self._wind_vector = (0.0, 0.0)
 
-        m = self.motor_speed
+        # scratch vector, reused each step to avoid allocation
+        self._accel_body = Vector3()
 
-        # how much time has passed?
-        t = time.time()
-        delta_time = t - self.last_time
-        self.last_time = t
-
-        # rotational acceleration, in rad/s/s, in body frame
-        rot_accel = Vector3(0,0,0)
-        thrust = 0.0
-        for i in range(len(self.motors)):
-            rot_accel.x  += -radians(5000.0) * math.sin(radians(self.motors[i].angle)) * m[i]
-            rot_accel.y  +=  radians(5000.0) * math.cos(radians(self.motors[i].angle)) * m[i]
-            if self.motors[i].clockwise:
-                rot_accel.z -= m[i] * radians(400.0)
-            else:
-                rot_accel.z += m[i] * radians(400.0)
-            thrust += m[i] * self.thrust_scale # newtons
+    def rotational_accel(self, gx, gy, gz):
+        '''rotational acceleration, in rad/s/s, in body frame, for the
+        given body frame rotation rates'''
+        (rx, ry, rz) = self._motor_rot_accel
 
         # rotational air resistance
-        rot_accel.x -= self.gyro.x * radians(5000.0) / self.terminal_rotation_rate
-        rot_accel.y -= self.gyro.y * radians(5000.0) / self.terminal_rotation_rate
-        rot_accel.z -= self.gyro.z * radians(400.0)  / self.terminal_rotation_rate
-
-        # update rotational rates in body frame
-        self.gyro += rot_accel * delta_time
+        return (rx - gx * self.rot_drag_xy,
+                ry - gy * self.rot_drag_xy,
+                rz - gz * self.rot_drag_z)
 
-        # update attitude
-        self.dcm.rotate(self.gyro * delta_time)
-        self.dcm.normalize()
+    def earth_accel(self, vx, vy, vz, dcm):
+        '''acceleration, in m/s/s, in earth frame, for the given earth
+        frame velocity and attitude'''
+        # thrust acts along the body z axis
+        a = -self._thrust / self.mass
+        ax = dcm.a.z * a
+        ay = dcm.b.z * a
+        az = dcm.c.z * a + self.gravity
 
         # air resistance
-        air_resistance = - self.velocity * (self.gravity/self.terminal_velocity)
+        k = self.gravity/self.terminal_velocity
+        ax -= vx * k
+        ay -= vy * k
+        az -= vz * k
 
-        accel_body = Vector3(0, 0, -thrust / self.mass)
-        accel_earth = self.dcm * accel_body
-        accel_earth += Vector3(0, 0, self.gravity)
-        accel_earth += air_resistance
-
-        # add in some wind (turn force into accel by dividing by mass).
-        # NOTE: disable this drag correction until we work out
-        # why it is blowing up
-        # accel_earth += self.wind.drag(self.velocity) / self.mass
+        # add in some wind (turn force into accel by dividing by mass)
+        if self.wind_drag:
+            (wx, wy) = self._wind_vector
+            (dx, dy) = self.wind.drag_accel(wx, wy, vx, vy, vz)
+            ax += dx / self.mass
+            ay += dy / self.mass
 
         # if we're on the ground, then our vertical acceleration is limited
         # to zero. This effectively adds the force of the ground on the aircraft
-        if self.on_ground() and accel_earth.z > 0:
-            accel_earth.z = 0
+        if az > 0 and self.on_ground():
+            az = 0
+        return (ax, ay, az)
+
+    def update(self, servos, delta_time=None):
+        '''update the model from the servo outputs. The time step is
+        delta_time seconds, or the wall clock time since the last update
+        if delta_time is None'''
+        mixer = self.mixer
+        mixer.motor_speeds(servos, self.motor_speed)
+        m = self.motor_speed
+
+        # how much time has passed?
+        delta_time = self.time_advance(delta_time)
 
-        # work out acceleration as seen by the accelerometers. It sees the kinematic
-        # acceleration (ie. real movement), plus gravity
-        self.accel_body = self.dcm.transposed() * (accel_earth + Vector3(0, 0, -self.gravity))
+        # the wind is held for the whole update
+        if self.wind_drag:
+            self.wind.locate(self.latitude, self.longitude, self.altitude, self.time_now)
+            (speed, direction) = self.wind.current(delta_time)
+            self._wind_vector = self.wind.vector(speed, direction)
 
-        # new velocity vector
-        self.velocity += accel_earth * delta_time
+        # rotational acceleration from the motors, in rad/s/s, in body frame
+        self._motor_rot_accel = (dot(mixer.roll, m),
+                                 dot(mixer.pitch, m),
+                                 dot(mixer.yaw, m))
+        self._thrust = sum(m) * self.thrust_scale # newtons
 
-        # new position vector
-        old_position = self.position.copy()
-        self.position += self.velocity * delta_time
+        h = delta_time / self.substeps
+        for i in range(self.substeps):
+            was_on_ground = self.on_ground()
 
-        # constrain height to the ground
-        if self.on_ground():
-            if not self.on_ground(old_position):
-                print("Hit ground at %f m/s" % (self.velocity.z))
+            # update rates, attitude, velocity and position
+            self.integrate(h)
 
-            self.velocity = Vector3(0, 0, 0)
-            # zero roll/pitch, but keep yaw
-            (r, p, y) = self.dcm.to_euler()
-            self.dcm.from_euler(0, 0, y)
+            # work out acceleration as seen by the accelerometers. It sees the kinematic
+            # acceleration (ie. real movement), plus gravity
+            accel_earth = self.accel_earth
+            self.dcm_T.mul_vec_into(self._accel_body.set(accel_earth.x,
+                                                         accel_earth.y,
+                                                         accel_earth.z - self.gravity),
+                                    self.accel_body)
 
-            self.position = Vector3(self.position.x, self.position.y,
-                                    -(self.ground_level + self.frame_height - self.home_altitude))
+            # constrain height to the ground
+            if self.on_ground():
+                if not was_on_ground:
+                    print("Hit ground at %f m/s" % (self.velocity.z))
+
+                self.velocity.zero()
+                # zero roll/pitch, but keep yaw
+                (r, p, y) = self.euler
+                self.set_euler(0, 0, y)
+
+                self.position.z = -(self.ground_level + self.frame_height - self.home_altitude)
 
         # update lat/lon/altitude
         self.update_position(delta_time)
+
+
+def test_field_wind():
+    '''check that a copter hovering in a wind field blowing east is
+    carried east, whatever the SITL wind says'''
+    import tempfile, os
+    from windfield import WindField, write_windfield
+    (fd, filename) = tempfile.mkstemp(suffix='.wnd')
+    os.close(fd)
+    try:
+        # 5m/s east everywhere
+        write_windfield(filename, -35.1, 0.1, 148.9, 0.1, 0, 1000,
+                        [[[[ (0, 5, 0) ]*3 ]*3 ]*2])
+        a = MultiCopter(wind_drag=True)
+        a.set_home(-35, 149, 584, 0)
+        a.wind.direction = 180
+        a.wind.field = WindField(filename)
+        a.position.z = -20
+        servos = [ a.hover_throttle ] * 11
+        for i in range(100):
+            a.update(servos, 0.01)
+        assert a.velocity.y > 0.1
+        assert abs(a.velocity.x) < 0.01 * a.velocity.y
+        a.wind.field.close()
+    finally:
+        os.unlink(filename)
+
+
+if __name__ == "__main__":
+    test_field_wind()
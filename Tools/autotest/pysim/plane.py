@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+'''
+simple fixed wing simulator core. The aerodynamics are the coefficients
+of the JSBSim Rascal 110 model in Tools/autotest/aircraft/Rascal, with
+the same control surface conventions, so ArduPlane.parm flies it
+'''
+
+from aircraft import Aircraft
+from math import sin, cos, sqrt, atan2, asin
+from rotmat import Vector3
+
+# sea level air density, kg/m^3
+air_density = 1.225
+
+def table_lookup(table, x):
+    '''linear interpolation in a table of (x, y) pairs in increasing x,
+    holding the end values outside it as JSBSim tables do'''
+    if x <= table[0][0]:
+        return table[0][1]
+    for i in range(1, len(table)):
+        (x1, y1) = table[i]
+        if x <= x1:
+            (x0, y0) = table[i-1]
+            return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+    return table[-1][1]
+
+def surface_angle(cmd, min_angle, max_angle):
+    '''deflection in radians of a control surface for a command from -1
+    to 1, scaled separately either side of zero'''
+    if cmd >= 0:
+        return min(cmd, 1.0) * max_angle
+    return max(cmd, -1.0) * -min_angle
+
+
+class ControlSurfaces(object):
+    '''inputs to a Plane, in the JSBSim command conventions'''
+    def __init__(self):
+        # aileron from -1 to 1, positive rolls right
+        self.aileron = 0
+        # elevator from -1 to 1, positive pitches down
+        self.elevator = 0
+        # rudder from -1 to 1, positive yaws left
+        self.rudder = 0
+        # throttle from 0 to 1
+        self.throttle = 0
+
+
+class Plane(Aircraft):
+    '''a fixed wing aircraft'''
+    def __init__(self,
+                 mass=6.58,
+                 wing_area=0.982,
+                 wing_span=2.795,
+                 chord=0.351,
+                 inertia=(2.644, 2.102, 2.590),
+                 max_thrust=41.0,
+                 prop_speed=44.0,
+                 frame_height=0.1,
+                 use_quaternion=False,
+                 integrator='semi-implicit',
+                 substeps=1):
+        Aircraft.__init__(self, use_quaternion=use_quaternion)
+        self.integrator = integrator
+        self.substeps = substeps
+        self.mass = mass # Kg
+        self.wing_area = wing_area # m^2
+        self.wing_span = wing_span # m
+        self.chord = chord # m
+        (self.Ixx, self.Iyy, self.Izz) = inertia # Kg m^2
+        self.frame_height = frame_height
+
+        # static thrust in newtons at full throttle, falling to zero at
+        # prop_speed m/s
+        self.max_thrust = max_thrust
+        self.prop_speed = prop_speed
+
+        # lift coefficient against angle of attack in radians
+        self.CL_alpha = [ (-0.20, -0.75), (0.0, 0.25), (0.23, 1.40), (0.60, 0.71) ]
+        self.CL_de = 0.2
+        # drag coefficients
+        self.CD_alpha = [ (-1.57, 1.5), (-0.26, 0.056), (0.0, 0.028), (0.26, 0.056), (1.57, 1.5) ]
+        self.CD_beta = [ (-1.57, 1.23), (-0.26, 0.05), (0.0, 0.0), (0.26, 0.05), (1.57, 1.23) ]
+        self.CD_induced = 0.04
+        self.CD_de = 0.03
+        # side force
+        self.CY_beta = -1.0
+        # roll moment
+        self.Cl_beta = -0.1
+        self.Cl_p = -0.4
+        self.Cl_r = 0.15
+        self.Cl_da = 0.13
+        self.Cl_dr = 0.01
+        # pitch moment
+        self.Cm_alpha = -0.5
+        self.Cm_de = -0.5
+        self.Cm_q = -12.0
+        # yaw moment
+        self.Cn_beta = 0.12
+        self.Cn_r = -0.15
+        self.Cn_dr = -0.05
+        self.Cn_da = -0.03
+        self.Cn_0 = 0.0007
+
+        # control surface ranges in radians, below and above zero
+        self.elevator_range = (-0.35, 0.3)
+        self.aileron_range = (-0.35, 0.35)
+        self.rudder_range = (-0.35, 0.35)
+
+        # rolling resistance on the ground, in m/s/s per m/s
+        self.ground_drag = 0.2
+
+        # control surface deflections and thrust for the current update
+        self._aileron = 0.0
+        self._elevator = 0.0
+        self._rudder = 0.0
+        self._thrust = 0.0
+
+        # air data for the current step, used by rotational_accel()
+        self._qS = 0.0   # dynamic pressure times wing area
+        self._damp = 0.0 # qS times 1/(2*airspeed)
+        self._alpha = 0.0
+        self._beta = 0.0
+        self._airspeed = 0.0
+
+        # wind as a North, East vector for the current update
+        self._wind = (0.0, 0.0)
+
+        # scratch vector, reused each step to avoid allocation
+        self._accel_body = Vector3()
+
+    @property
+    def airspeed(self):
+        '''airspeed in m/s'''
+        return self._airspeed
+
+    def air_data(self, vx, vy, vz, dcm):
+        '''return the airspeed, angle of attack, sideslip and the velocity
+        relative to the air in body frame, for an earth frame velocity'''
+        (wn, we) = self._wind
+        vx -= wn
+        vy -= we
+        (a, b, c) = (dcm.a, dcm.b, dcm.c)
+        u = a.x*vx + b.x*vy + c.x*vz
+        v = a.y*vx + b.y*vy + c.y*vz
+        w = a.z*vx + b.z*vy + c.z*vz
+        airspeed = sqrt(u*u + v*v + w*w)
+        if airspeed < 0.1:
+            return (airspeed, 0.0, 0.0, u, v, w)
+        return (airspeed, atan2(w, u), asin(v/airspeed), u, v, w)
+
+    def rotational_accel(self, gx, gy, gz):
+        '''rotational acceleration, in rad/s/s, in body frame, for the
+        given body frame rotation rates'''
+        (qS, damp, alpha, beta) = (self._qS, self._damp, self._alpha, self._beta)
+        (b, c) = (self.wing_span, self.chord)
+        (da, de, dr) = (self._aileron, self._elevator, self._rudder)
+        roll = qS*b*(self.Cl_beta*beta + self.Cl_da*da + self.Cl_dr*dr) + \
+            damp*b*b*(self.Cl_p*gx + self.Cl_r*gz)
+        pitch = qS*c*(self.Cm_alpha*alpha + self.Cm_de*de) + damp*c*c*self.Cm_q*gy
+        yaw = qS*b*(self.Cn_beta*beta + self.Cn_dr*dr + self.Cn_da*da + self.Cn_0) + \
+            damp*b*b*self.Cn_r*gz
+
+        (Ixx, Iyy, Izz) = (self.Ixx, self.Iyy, self.Izz)
+        return ((roll - (Izz - Iyy)*gy*gz) / Ixx,
+                (pitch - (Ixx - Izz)*gz*gx) / Iyy,
+                (yaw - (Iyy - Ixx)*gx*gy) / Izz)
+
+    def earth_accel(self, vx, vy, vz, dcm):
+        '''acceleration, in m/s/s, in earth frame, for the given earth
+        frame velocity and attitude'''
+        (airspeed, alpha, beta, u, v, w) = self.air_data(vx, vy, vz, dcm)
+        qS = 0.5 * air_density * airspeed * airspeed * self.wing_area
+
+        # body frame force, with drag against the relative air flow and
+        # lift at right angles to it
+        fx = self._thrust
+        (fy, fz) = (0.0, 0.0)
+        if airspeed >= 0.1:
+            CL = table_lookup(self.CL_alpha, alpha) + self.CL_de*self._elevator
+            CD = table_lookup(self.CD_alpha, alpha) + table_lookup(self.CD_beta, beta) + \
+                self.CD_induced*CL*CL + self.CD_de*abs(self._elevator)/self.elevator_range[1]
+            lift = qS * CL
+            drag = qS * CD / airspeed
+            fx += lift*sin(alpha) - drag*u
+            fy = qS*self.CY_beta*beta - drag*v
+            fz = -lift*cos(alpha) - drag*w
+
+        m = self.mass
+        (a, b, c) = (dcm.a, dcm.b, dcm.c)
+        ax = (a.x*fx + a.y*fy + a.z*fz) / m
+        ay = (b.x*fx + b.y*fy + b.z*fz) / m
+        az = (c.x*fx + c.y*fy + c.z*fz) / m + self.gravity
+
+        # the ground holds us up and the wheels slow us down
+        if self.on_ground():
+            if az > 0:
+                az = 0
+            ax -= vx * self.ground_drag
+            ay -= vy * self.ground_drag
+        return (ax, ay, az)
+
+    def update(self, state, delta_time=None):
+        '''update the model from the control surfaces. The time step is
+        delta_time seconds, or the wall clock time since the last update
+        if delta_time is None'''
+        # how much time has passed?
+        delta_time = self.time_advance(delta_time)
+
+        # the wind is held for the whole update
+        self.wind.locate(self.latitude, self.longitude, self.altitude, self.time_now)
+        (speed, direction) = self.wind.current(delta_time)
+        self._wind = self.wind.vector(speed, direction)
+
+        # controls are held for the whole update
+        self._aileron = surface_angle(state.aileron, *self.aileron_range)
+        self._elevator = surface_angle(state.elevator, *self.elevator_range)
+        self._rudder = surface_angle(state.rudder, *self.rudder_range)
+        throttle = min(max(state.throttle, 0.0), 1.0)
+
+        h = delta_time / self.substeps
+        for i in range(self.substeps):
+            was_on_ground = self.on_ground()
+
+            # air data at the start of the step
+            v = self.velocity
+            (airspeed, alpha, beta, u, vb, w) = self.air_data(v.x, v.y, v.z, self.dcm)
+            self._airspeed = airspeed
+            self._alpha = alpha
+            self._beta = beta
+            self._qS = 0.5 * air_density * airspeed * airspeed * self.wing_area
+            self._damp = 0.25 * air_density * airspeed * self.wing_area
+            self._thrust = throttle * self.max_thrust * max(0.0, 1.0 - airspeed/self.prop_speed)
+
+            # update rates, attitude, velocity and position
+            self.integrate(h)
+
+            # work out acceleration as seen by the accelerometers. It sees the kinematic
+            # acceleration (ie. real movement), plus gravity
+            accel_earth = self.accel_earth
+            self.dcm_T.mul_vec_into(self._accel_body.set(accel_earth.x,
+                                                         accel_earth.y,
+                                                         accel_earth.z - self.gravity),
+                                    self.accel_body)
+
+            # constrain height to the ground, rolling along it in the
+            # direction we are pointing
+            if self.on_ground():
+                if not was_on_ground and v.z > 1.0:
+                    print("Hit ground at %f m/s" % (v.z))
+
+                (r, p, y) = self.euler
+                (cy, sy) = (cos(y), sin(y))
+                speed = v.x*cy + v.y*sy
+                v.set(speed*cy, speed*sy, min(v.z, 0.0))
+
+                # wings level, nose not below the horizon
+                g = self.gyro
+                if p <= 0:
+                    p = 0
+                    g.y = max(g.y, 0.0)
+                g.x = 0
+                self.set_euler(0, p, y)
+
+                self.position.z = -(self.ground_level + self.frame_height - self.home_altitude)
+
+        # update lat/lon/altitude
+        self.update_position(delta_time)
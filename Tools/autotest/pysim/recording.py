@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''
+record and read back the UDP packet streams between SITL and a
+simulator. A recording is an append-only file starting with a short
+header, followed by records of a type byte, a monotonic timestamp in
+seconds and the packet length, then the packet itself
+'''
+
+import struct, mmap, os
+from scheduler import monotonic_time
+
+RECORDING_MAGIC = 'PYSIMREC'
+RECORDING_VERSION = 1
+
+# record types
+RECORD_CONTROL = 1  # control packet received from SITL
+RECORD_FDM = 2      # FDM packet sent to SITL
+
+file_header = struct.Struct('<8sH')
+record_header = struct.Struct('<BdH')
+
+class Recorder(object):
+    '''append packets to a recording through a buffered writer'''
+    def __init__(self, filename, buffer_size=65536):
+        self.f = open(filename, mode='ab', buffering=buffer_size)
+        if self.f.tell() == 0:
+            self.f.write(file_header.pack(RECORDING_MAGIC, RECORDING_VERSION))
+        self.header = bytearray(record_header.size)
+        self.count = 0
+
+    def write(self, rtype, buf, length=None):
+        '''append a packet of the given record type'''
+        if length is None:
+            length = len(buf)
+        record_header.pack_into(self.header, 0, rtype, monotonic_time(), length)
+        self.f.write(self.header)
+        self.f.write(buffer(buf, 0, length))
+        self.count += 1
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class Recording(object):
+    '''a recording opened for reading through a memory map. records()
+    walks it without copying packets'''
+    def __init__(self, filename):
+        self.f = open(filename, mode='rb')
+        size = os.fstat(self.f.fileno()).st_size
+        if size < file_header.size:
+            raise RuntimeError("%s is not a recording" % filename)
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version) = file_header.unpack_from(self.mm, 0)
+        if magic != RECORDING_MAGIC:
+            raise RuntimeError("%s is not a recording" % filename)
+        if version != RECORDING_VERSION:
+            raise RuntimeError("%s is recording version %u, not %u" % (filename, version, RECORDING_VERSION))
+
+    def records(self, rtype=None):
+        '''yield (type, timestamp, offset, length) for each record, or
+        only for records of one type. The packet is at offset in mm,
+        ready for unpack_from(). A truncated last record is ignored, as
+        the recorder may have been killed mid write'''
+        mm = self.mm
+        end = len(mm)
+        offset = file_header.size
+        while offset + record_header.size <= end:
+            (t, timestamp, length) = record_header.unpack_from(mm, offset)
+            offset += record_header.size
+            if offset + length > end:
+                break
+            if rtype is None or t == rtype:
+                yield (t, timestamp, offset, length)
+            offset += length
+
+    def packet(self, offset, length):
+        '''return a copy of one packet'''
+        return self.mm[offset:offset+length]
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+'''
+replay a recording of the SITL packet streams made with --record.
+
+In model mode the recorded control packets drive a vehicle model as
+fast as it will run, with each step taking the time between the
+recorded packets, or a fixed step with --rate. In fdm mode the
+recorded FDM packets are sent to SITL again, one for each control
+packet SITL sends, or back to back with --fast. Neither mode depends
+on the wall clock
+'''
+
+import sys, time, socket, math
+import recording, sitl_protocol, runner
+
+def run_model(rec, opts):
+    '''feed the recorded control stream to a model'''
+    if opts.vehicle == 'rover':
+        from rover import Rover
+        a = Rover(skid_steering=opts.skid_steering)
+        decoder = runner.SteeringDecoder()
+    elif opts.vehicle == 'plane':
+        from plane import Plane
+        a = Plane()
+        decoder = runner.PlaneDecoder(elevon=opts.elevon, vtail=opts.vtail)
+    else:
+        from multicopter import MultiCopter
+        a = MultiCopter(frame=opts.frame)
+        decoder = runner.ServoDecoder()
+
+    if opts.home:
+        home = runner.parse_home(opts.home)
+    else:
+        # start where the recorded vehicle started
+        home = None
+        for (t, timestamp, offset, length) in rec.records(recording.RECORD_FDM):
+            v = sitl_protocol.fdm_struct.unpack_from(rec.mm, offset)
+            home = (v[0], v[1], v[2], v[3])
+            break
+        if home is None:
+            print("No FDM packets to take the home position from, use --home")
+            sys.exit(1)
+    a.set_home(*home)
+
+    out = None
+    if opts.out:
+        out = open(opts.out, mode='w')
+        out.write('time,lat,lon,alt,roll,pitch,yaw\n')
+
+    control = sitl_protocol.ControlPacket(None)
+    last_timestamp = None
+    count = 0
+    tstart = time.time()
+    for (t, timestamp, offset, length) in rec.records(recording.RECORD_CONTROL):
+        control.values = sitl_protocol.control_struct.unpack_from(rec.mm, offset)
+        decoder.decode(control, a)
+        if opts.rate:
+            delta_time = 1.0/opts.rate
+        elif last_timestamp is None:
+            delta_time = 0
+        else:
+            delta_time = timestamp - last_timestamp
+        last_timestamp = timestamp
+        a.update(decoder.inputs(), delta_time)
+        count += 1
+        if out is not None:
+            (roll, pitch, yaw) = a.euler
+            out.write('%.4f,%.8f,%.8f,%.3f,%.2f,%.2f,%.2f\n' % (
+                a.time_now, a.latitude, a.longitude, a.altitude,
+                math.degrees(roll), math.degrees(pitch), math.degrees(yaw)))
+    if out is not None:
+        out.close()
+
+    elapsed = time.time() - tstart
+    print("Replayed %u control packets covering %.1fs in %.2fs" % (count, a.time_now, elapsed))
+    print("Final position lat=%f lon=%f alt=%.1f" % (a.latitude, a.longitude, a.altitude))
+
+def run_fdm(rec, opts):
+    '''send the recorded FDM stream to SITL'''
+    sim_out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sim_out.connect(runner.interpret_address(opts.simout))
+    sim_in = None
+    if not opts.fast:
+        sim_in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sim_in.bind(runner.interpret_address(opts.simin))
+    buf = bytearray(sitl_protocol.control_struct.size+1)
+    count = 0
+    for (t, timestamp, offset, length) in rec.records(recording.RECORD_FDM):
+        if sim_in is not None:
+            # wait for SITL to ask for the next state
+            sim_in.recv_into(buf)
+        try:
+            sim_out.send(rec.packet(offset, length))
+        except socket.error:
+            pass
+        count += 1
+    print("Sent %u FDM packets" % count)
+
+##################
+# main program
+from optparse import OptionParser
+parser = OptionParser("replay.py [options] RECORDING")
+parser.add_option("--mode", default='model', help="replay mode (model,fdm)")
+parser.add_option("--vehicle", default='copter', help="vehicle model for model mode (copter,rover,plane)")
+parser.add_option("--frame", default='+', help="multicopter frame type")
+parser.add_option("--skid-steering", action='store_true', default=False, help="rover uses skid steering")
+parser.add_option("--elevon", action='store_true', default=False, help="plane has elevon mixing")
+parser.add_option("--vtail", action='store_true', default=False, help="plane has vtail mixing")
+parser.add_option("--home", default=None, help="home lat,lng,alt,hdg, by default from the recording")
+parser.add_option("--rate", type='float', default=None, help="fixed model rate instead of the recorded timing")
+parser.add_option("--out", default=None, help="CSV file of the replayed model state")
+parser.add_option("--simin",  help="SITL input for fdm mode (IP:port)", default="127.0.0.1:5502")
+parser.add_option("--simout", help="SITL output for fdm mode (IP:port)", default="127.0.0.1:5501")
+parser.add_option("--fast", action='store_true', default=False, help="in fdm mode send back to back rather than per SITL packet")
+
+(opts, args) = parser.parse_args()
+
+if len(args) != 1:
+    parser.print_help()
+    sys.exit(1)
+
+rec = recording.Recording(args[0])
+if opts.mode == 'model':
+    run_model(rec, opts)
+elif opts.mode == 'fdm':
+    run_fdm(rec, opts)
+else:
+    print("Unknown mode '%s'" % opts.mode)
+    sys.exit(1)
+rec.close()
@@ -25,8 +25,16 @@
 
 from math import sin, cos, sqrt, asin, atan2, pi, radians, acos
 
-class Vector3:
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for the batch Vector3Array and Matrix3Array classes
+    numpy = None
+
+class Vector3(object):
     '''a vector'''
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x=None, y=None, z=None):
         if x != None and y != None and z != None:
             self.x = float(x)
@@ -113,8 +121,55 @@ class Vector3:
         self.y = v.y
         self.z = v.z
 
-class Matrix3:
+    # in-place operations. These modify the vector and return it, so
+    # they can be used without allocating new Vector3 objects
+
+    def set(self, x, y, z):
+        '''set all three components'''
+        self.x = x
+        self.y = y
+        self.z = z
+        return self
+
+    def copy_from(self, v):
+        '''set this vector from another vector'''
+        self.x = v.x
+        self.y = v.y
+        self.z = v.z
+        return self
+
+    def iadd(self, v):
+        '''add another vector in place'''
+        self.x += v.x
+        self.y += v.y
+        self.z += v.z
+        return self
+
+    def isub(self, v):
+        '''subtract another vector in place'''
+        self.x -= v.x
+        self.y -= v.y
+        self.z -= v.z
+        return self
+
+    def imul_scalar(self, s):
+        '''multiply by a scalar in place'''
+        self.x *= s
+        self.y *= s
+        self.z *= s
+        return self
+
+    def iadd_scaled(self, v, s):
+        '''add another vector multiplied by a scalar in place'''
+        self.x += v.x * s
+        self.y += v.y * s
+        self.z += v.z * s
+        return self
+
+class Matrix3(object):
     '''a 3x3 matrix, intended as a rotation matrix'''
+    __slots__ = ('a', 'b', 'c')
+
     def __init__(self, a=None, b=None, c=None):
         if a is not None and b is not None and c is not None:
             self.a = a.copy()
@@ -216,37 +271,522 @@ class Matrix3:
 
     def rotate(self, g):
         '''rotate the matrix by a given amount on 3 axes'''
-	temp_matrix = Matrix3()
-        a = self.a
-        b = self.b
-        c = self.c
-	temp_matrix.a.x = a.y * g.z - a.z * g.y
-	temp_matrix.a.y = a.z * g.x - a.x * g.z
-	temp_matrix.a.z = a.x * g.y - a.y * g.x
-	temp_matrix.b.x = b.y * g.z - b.z * g.y
-	temp_matrix.b.y = b.z * g.x - b.x * g.z
-	temp_matrix.b.z = b.x * g.y - b.y * g.x
-	temp_matrix.c.x = c.y * g.z - c.z * g.y
-	temp_matrix.c.y = c.z * g.x - c.x * g.z
-	temp_matrix.c.z = c.x * g.y - c.y * g.x
-        self.a += temp_matrix.a
-        self.b += temp_matrix.b
-        self.c += temp_matrix.c
+        self.rotate_inplace(g)
 
     def normalize(self):
         '''re-normalise a rotation matrix'''
-	error = self.a * self.b
-	t0 = self.a - (self.b * (0.5 * error))
-	t1 = self.b - (self.a * (0.5 * error))
-	t2 = t0 % t1
-        self.a = t0 * (1.0 / t0.length())
-        self.b = t1 * (1.0 / t1.length())
-        self.c = t2 * (1.0 / t2.length())
+        self.normalize_inplace()
+
+    # in-place operations. These write into existing objects rather
+    # than allocating new Vector3 and Matrix3 objects
+
+    def copy_from(self, m):
+        '''set this matrix from another matrix'''
+        self.a.copy_from(m.a)
+        self.b.copy_from(m.b)
+        self.c.copy_from(m.c)
+        return self
+
+    def transposed_into(self, out):
+        '''set out to the transpose of the matrix. out must not be self'''
+        out.a.set(self.a.x, self.b.x, self.c.x)
+        out.b.set(self.a.y, self.b.y, self.c.y)
+        out.c.set(self.a.z, self.b.z, self.c.z)
+        return out
+
+    def mul_vec_into(self, v, out):
+        '''set out to the matrix multiplied by v. out may be v'''
+        a = self.a
+        b = self.b
+        c = self.c
+        x = v.x
+        y = v.y
+        z = v.z
+        out.x = a.x * x + a.y * y + a.z * z
+        out.y = b.x * x + b.y * y + b.z * z
+        out.z = c.x * x + c.y * y + c.z * z
+        return out
+
+    def transposed_mul_into(self, v, out):
+        '''set out to the transpose of the matrix multiplied by v. out may be v'''
+        a = self.a
+        b = self.b
+        c = self.c
+        x = v.x
+        y = v.y
+        z = v.z
+        out.x = a.x * x + b.x * y + c.x * z
+        out.y = a.y * x + b.y * y + c.y * z
+        out.z = a.z * x + b.z * y + c.z * z
+        return out
+
+    def rotate_inplace(self, g, scale=1.0):
+        '''rotate the matrix by a given amount on 3 axes, optionally
+        scaling g (for example by a time step) without allocating'''
+        gx = g.x * scale
+        gy = g.y * scale
+        gz = g.z * scale
+        for r in (self.a, self.b, self.c):
+            x = r.x
+            y = r.y
+            z = r.z
+            r.x = x + y * gz - z * gy
+            r.y = y + z * gx - x * gz
+            r.z = z + x * gy - y * gx
+
+    def normalize_inplace(self):
+        '''re-normalise a rotation matrix in place'''
+        a = self.a
+        b = self.b
+        c = self.c
+        error = 0.5 * (a.x * b.x + a.y * b.y + a.z * b.z)
+        t0x = a.x - b.x * error
+        t0y = a.y - b.y * error
+        t0z = a.z - b.z * error
+        t1x = b.x - a.x * error
+        t1y = b.y - a.y * error
+        t1z = b.z - a.z * error
+        t2x = t0y * t1z - t0z * t1y
+        t2y = t0z * t1x - t0x * t1z
+        t2z = t0x * t1y - t0y * t1x
+        n = 1.0 / sqrt(t0x*t0x + t0y*t0y + t0z*t0z)
+        a.x = t0x * n
+        a.y = t0y * n
+        a.z = t0z * n
+        n = 1.0 / sqrt(t1x*t1x + t1y*t1y + t1z*t1z)
+        b.x = t1x * n
+        b.y = t1y * n
+        b.z = t1z * n
+        n = 1.0 / sqrt(t2x*t2x + t2y*t2y + t2z*t2z)
+        c.x = t2x * n
+        c.y = t2y * n
+        c.z = t2z * n
 
     def trace(self):
         '''the trace of the matrix'''
         return self.a.x + self.b.y + self.c.z
 
+class Quaternion(object):
+    '''a quaternion, intended as an attitude. This follows the
+    conventions of the Quaternion class in AP_Math, with q1 as the
+    scalar part'''
+    __slots__ = ('q1', 'q2', 'q3', 'q4')
+
+    def __init__(self, q1=1.0, q2=0.0, q3=0.0, q4=0.0):
+        self.q1 = float(q1)
+        self.q2 = float(q2)
+        self.q3 = float(q3)
+        self.q4 = float(q4)
+
+    def __repr__(self):
+        return 'Quaternion(%.4f, %.4f, %.4f, %.4f)' % (self.q1,
+                                                       self.q2,
+                                                       self.q3,
+                                                       self.q4)
+
+    def __mul__(self, q):
+        '''quaternion product'''
+        return Quaternion(self.q1*q.q1 - self.q2*q.q2 - self.q3*q.q3 - self.q4*q.q4,
+                          self.q1*q.q2 + self.q2*q.q1 + self.q3*q.q4 - self.q4*q.q3,
+                          self.q1*q.q3 - self.q2*q.q4 + self.q3*q.q1 + self.q4*q.q2,
+                          self.q1*q.q4 + self.q2*q.q3 - self.q3*q.q2 + self.q4*q.q1)
+
+    def __copy__(self):
+        return Quaternion(self.q1, self.q2, self.q3, self.q4)
+
+    copy = __copy__
+
+    def identity(self):
+        self.q1 = 1.0
+        self.q2 = self.q3 = self.q4 = 0.0
+
+    def inverse(self):
+        '''the inverse of a unit quaternion'''
+        return Quaternion(self.q1, -self.q2, -self.q3, -self.q4)
+
+    def length(self):
+        return sqrt(self.q1**2 + self.q2**2 + self.q3**2 + self.q4**2)
+
+    def normalize(self):
+        '''re-normalise the quaternion. Unlike a rotation matrix this
+        only needs a single scale factor'''
+        n = 1.0 / sqrt(self.q1*self.q1 + self.q2*self.q2 + self.q3*self.q3 + self.q4*self.q4)
+        self.q1 *= n
+        self.q2 *= n
+        self.q3 *= n
+        self.q4 *= n
+
+    def from_euler(self, roll, pitch, yaw):
+        '''fill the quaternion from Euler angles in radians'''
+        cr2 = cos(roll*0.5)
+        cp2 = cos(pitch*0.5)
+        cy2 = cos(yaw*0.5)
+        sr2 = sin(roll*0.5)
+        sp2 = sin(pitch*0.5)
+        sy2 = sin(yaw*0.5)
+        self.q1 = cr2*cp2*cy2 + sr2*sp2*sy2
+        self.q2 = sr2*cp2*cy2 - cr2*sp2*sy2
+        self.q3 = cr2*sp2*cy2 + sr2*cp2*sy2
+        self.q4 = cr2*cp2*sy2 - sr2*sp2*cy2
+
+    def to_euler(self):
+        '''find Euler angles for the quaternion'''
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        q4 = self.q4
+        roll = atan2(2.0*(q1*q2 + q3*q4), 1.0 - 2.0*(q2*q2 + q3*q3))
+        sp = 2.0*(q1*q3 - q4*q2)
+        if sp >= 1.0:
+            pitch = pi/2
+        elif sp <= -1.0:
+            pitch = -pi/2
+        else:
+            pitch = asin(sp)
+        yaw = atan2(2.0*(q1*q4 + q2*q3), 1.0 - 2.0*(q3*q3 + q4*q4))
+        return (roll, pitch, yaw)
+
+    def rotation_matrix(self, m=None):
+        '''return the equivalent rotation matrix. If m is given it is
+        filled in place'''
+        if m is None:
+            m = Matrix3()
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        q4 = self.q4
+        q2q2 = q2 * q2
+        q3q3 = q3 * q3
+        q4q4 = q4 * q4
+        q1q2 = q1 * q2
+        q1q3 = q1 * q3
+        q1q4 = q1 * q4
+        q2q3 = q2 * q3
+        q2q4 = q2 * q4
+        q3q4 = q3 * q4
+        m.a.x = 1.0 - 2.0*(q3q3 + q4q4)
+        m.a.y = 2.0*(q2q3 - q1q4)
+        m.a.z = 2.0*(q2q4 + q1q3)
+        m.b.x = 2.0*(q2q3 + q1q4)
+        m.b.y = 1.0 - 2.0*(q2q2 + q4q4)
+        m.b.z = 2.0*(q3q4 - q1q2)
+        m.c.x = 2.0*(q2q4 - q1q3)
+        m.c.y = 2.0*(q3q4 + q1q2)
+        m.c.z = 1.0 - 2.0*(q2q2 + q3q3)
+        return m
+
+    def from_rotation_matrix(self, m):
+        '''fill the quaternion from a rotation matrix'''
+        tr = m.trace()
+        if tr > 0:
+            s = sqrt(tr + 1.0) * 2.0
+            self.q1 = 0.25 * s
+            self.q2 = (m.c.y - m.b.z) / s
+            self.q3 = (m.a.z - m.c.x) / s
+            self.q4 = (m.b.x - m.a.y) / s
+        elif m.a.x > m.b.y and m.a.x > m.c.z:
+            s = sqrt(1.0 + m.a.x - m.b.y - m.c.z) * 2.0
+            self.q1 = (m.c.y - m.b.z) / s
+            self.q2 = 0.25 * s
+            self.q3 = (m.a.y + m.b.x) / s
+            self.q4 = (m.a.z + m.c.x) / s
+        elif m.b.y > m.c.z:
+            s = sqrt(1.0 + m.b.y - m.a.x - m.c.z) * 2.0
+            self.q1 = (m.a.z - m.c.x) / s
+            self.q2 = (m.a.y + m.b.x) / s
+            self.q3 = 0.25 * s
+            self.q4 = (m.b.z + m.c.y) / s
+        else:
+            s = sqrt(1.0 + m.c.z - m.a.x - m.b.y) * 2.0
+            self.q1 = (m.b.x - m.a.y) / s
+            self.q2 = (m.a.z + m.c.x) / s
+            self.q3 = (m.b.z + m.c.y) / s
+            self.q4 = 0.25 * s
+
+    def rotate(self, g, scale=1.0):
+        '''rotate the quaternion by a given body frame rotation vector,
+        optionally scaled (for example by a time step). The rotation is
+        applied exactly as an axis-angle rotation, so unlike
+        Matrix3.rotate() it does not introduce first order drift'''
+        gx = g.x * scale
+        gy = g.y * scale
+        gz = g.z * scale
+        theta = sqrt(gx*gx + gy*gy + gz*gz)
+        if theta < 1.0e-6:
+            # use the series expansion for small angles
+            c = 1.0 - theta*theta/8.0
+            s = 0.5 - theta*theta/48.0
+        else:
+            c = cos(0.5*theta)
+            s = sin(0.5*theta) / theta
+        d1 = c
+        d2 = gx * s
+        d3 = gy * s
+        d4 = gz * s
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        q4 = self.q4
+        self.q1 = q1*d1 - q2*d2 - q3*d3 - q4*d4
+        self.q2 = q1*d2 + q2*d1 + q3*d4 - q4*d3
+        self.q3 = q1*d3 - q2*d4 + q3*d1 + q4*d2
+        self.q4 = q1*d4 + q2*d3 - q3*d2 + q4*d1
+
+def _need_numpy():
+    if numpy is None:
+        raise RuntimeError("numpy is required for batch vector and matrix operations")
+
+class Vector3Array(object):
+    '''an array of N vectors, held as a contiguous Nx3 numpy array'''
+    def __init__(self, n=0, data=None):
+        _need_numpy()
+        if data is not None:
+            self.data = numpy.array(data, dtype=float).reshape(-1, 3)
+        else:
+            self.data = numpy.zeros((n, 3))
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        '''build from a list of Vector3'''
+        _need_numpy()
+        return cls(data=[(v.x, v.y, v.z) for v in vectors])
+
+    @classmethod
+    def from_vector(cls, v, n):
+        '''build from n copies of one Vector3'''
+        _need_numpy()
+        return cls(data=numpy.tile((v.x, v.y, v.z), (n, 1)))
+
+    def to_vectors(self):
+        '''return a list of Vector3'''
+        return [Vector3(r[0], r[1], r[2]) for r in self.data.tolist()]
+
+    def __repr__(self):
+        return 'Vector3Array(%u)' % len(self)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, i):
+        r = self.data[i]
+        return Vector3(r[0], r[1], r[2])
+
+    def __setitem__(self, i, v):
+        self.data[i] = (v.x, v.y, v.z)
+
+    @property
+    def x(self):
+        return self.data[:,0]
+
+    @property
+    def y(self):
+        return self.data[:,1]
+
+    @property
+    def z(self):
+        return self.data[:,2]
+
+    def __add__(self, v):
+        return Vector3Array(data=self.data + _vdata(v))
+
+    __radd__ = __add__
+
+    def __sub__(self, v):
+        return Vector3Array(data=self.data - _vdata(v))
+
+    def __rsub__(self, v):
+        return Vector3Array(data=_vdata(v) - self.data)
+
+    def __neg__(self):
+        return Vector3Array(data=-self.data)
+
+    def __iadd__(self, v):
+        self.data += _vdata(v)
+        return self
+
+    def __isub__(self, v):
+        self.data -= _vdata(v)
+        return self
+
+    def __mul__(self, v):
+        if isinstance(v, (Vector3, Vector3Array)):
+            '''per-vector dot product'''
+            return (self.data * _vdata(v)).sum(axis=1)
+        return Vector3Array(data=self.data * _sdata(v))
+
+    __rmul__ = __mul__
+
+    def __div__(self, v):
+        return Vector3Array(data=self.data / _sdata(v))
+
+    def __mod__(self, v):
+        '''per-vector cross product'''
+        return Vector3Array(data=numpy.cross(self.data, _vdata(v)))
+
+    def __copy__(self):
+        return Vector3Array(data=self.data)
+
+    copy = __copy__
+
+    def length(self):
+        return numpy.sqrt((self.data**2).sum(axis=1))
+
+    def zero(self):
+        self.data[:] = 0
+
+    def normalized(self):
+        return self / self.length()
+
+    def normalize(self):
+        self.data /= self.length()[:,None]
+
+class Matrix3Array(object):
+    '''an array of N rotation matrices, held as a contiguous Nx3x3 numpy array.
+    Row 0, 1 and 2 of each matrix correspond to a, b and c in Matrix3'''
+    def __init__(self, n=0, data=None):
+        _need_numpy()
+        if data is not None:
+            self.data = numpy.array(data, dtype=float).reshape(-1, 3, 3)
+        else:
+            self.data = numpy.zeros((n, 3, 3))
+            self.identity()
+
+    @classmethod
+    def from_matrices(cls, matrices):
+        '''build from a list of Matrix3'''
+        _need_numpy()
+        return cls(data=[((m.a.x, m.a.y, m.a.z),
+                          (m.b.x, m.b.y, m.b.z),
+                          (m.c.x, m.c.y, m.c.z)) for m in matrices])
+
+    def to_matrices(self):
+        '''return a list of Matrix3'''
+        return [Matrix3(Vector3(r[0]), Vector3(r[1]), Vector3(r[2])) for r in self.data.tolist()]
+
+    def __repr__(self):
+        return 'Matrix3Array(%u)' % len(self)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, i):
+        r = self.data[i].tolist()
+        return Matrix3(Vector3(r[0]), Vector3(r[1]), Vector3(r[2]))
+
+    def __setitem__(self, i, m):
+        self.data[i] = ((m.a.x, m.a.y, m.a.z),
+                        (m.b.x, m.b.y, m.b.z),
+                        (m.c.x, m.c.y, m.c.z))
+
+    def identity(self):
+        self.data[:] = numpy.eye(3)
+
+    def transposed(self):
+        return Matrix3Array(data=self.data.transpose(0, 2, 1))
+
+    def from_euler(self, roll, pitch, yaw):
+        '''fill the matrices from arrays of Euler angles in radians'''
+        cp = numpy.cos(pitch)
+        sp = numpy.sin(pitch)
+        sr = numpy.sin(roll)
+        cr = numpy.cos(roll)
+        sy = numpy.sin(yaw)
+        cy = numpy.cos(yaw)
+        d = self.data
+        d[:,0,0] = cp * cy
+        d[:,0,1] = (sr * sp * cy) - (cr * sy)
+        d[:,0,2] = (cr * sp * cy) + (sr * sy)
+        d[:,1,0] = cp * sy
+        d[:,1,1] = (sr * sp * sy) + (cr * cy)
+        d[:,1,2] = (cr * sp * sy) - (sr * cy)
+        d[:,2,0] = -sp
+        d[:,2,1] = sr * cp
+        d[:,2,2] = cr * cp
+
+    def to_euler(self):
+        '''find Euler angles for the matrices, as a tuple of arrays'''
+        d = self.data
+        cx = d[:,2,0]
+        pitch = numpy.where(cx >= 1.0, pi,
+                            numpy.where(cx <= -1.0, -pi,
+                                        -numpy.arcsin(numpy.clip(cx, -1.0, 1.0))))
+        roll = numpy.arctan2(d[:,2,1], d[:,2,2])
+        yaw  = numpy.arctan2(d[:,1,0], d[:,0,0])
+        return (roll, pitch, yaw)
+
+    def __add__(self, m):
+        return Matrix3Array(data=self.data + m.data)
+
+    __radd__ = __add__
+
+    def __sub__(self, m):
+        return Matrix3Array(data=self.data - m.data)
+
+    def __mul__(self, other):
+        if isinstance(other, (Vector3, Vector3Array)):
+            return Vector3Array(data=numpy.einsum('nij,nj->ni', self.data, _vdata(other) * numpy.ones((len(self), 1))))
+        elif isinstance(other, Matrix3Array):
+            return Matrix3Array(data=numpy.einsum('nij,njk->nik', self.data, other.data))
+        return Matrix3Array(data=self.data * _mdata(other))
+
+    def __div__(self, v):
+        return Matrix3Array(data=self.data / _mdata(v))
+
+    def __neg__(self):
+        return Matrix3Array(data=-self.data)
+
+    def __copy__(self):
+        return Matrix3Array(data=self.data)
+
+    copy = __copy__
+
+    def transposed_mul(self, v):
+        '''the transpose of each matrix multiplied by the matching vector
+        of a Vector3Array, without building the transposes'''
+        return Vector3Array(data=numpy.einsum('nji,nj->ni', self.data, _vdata(v)))
+
+    def rotate(self, g):
+        '''rotate each matrix by a given amount on 3 axes. g is a
+        Vector3Array of per-matrix rotations, or a single Vector3'''
+        g = _vdata(g) * numpy.ones((len(self), 1))
+        self.data += numpy.cross(self.data, g[:,None,:])
+
+    def normalize(self):
+        '''re-normalise the rotation matrices'''
+        a = self.data[:,0]
+        b = self.data[:,1]
+        error = (a * b).sum(axis=1)[:,None]
+        t0 = a - (b * (0.5 * error))
+        t1 = b - (a * (0.5 * error))
+        t2 = numpy.cross(t0, t1)
+        self.data[:,0] = t0 / numpy.sqrt((t0**2).sum(axis=1))[:,None]
+        self.data[:,1] = t1 / numpy.sqrt((t1**2).sum(axis=1))[:,None]
+        self.data[:,2] = t2 / numpy.sqrt((t2**2).sum(axis=1))[:,None]
+
+    def trace(self):
+        '''the trace of each matrix'''
+        return numpy.trace(self.data, axis1=1, axis2=2)
+
+def _vdata(v):
+    '''return the numpy form of a Vector3 or Vector3Array operand'''
+    if isinstance(v, Vector3Array):
+        return v.data
+    return numpy.array((v.x, v.y, v.z))
+
+def _sdata(v):
+    '''return the numpy form of a scalar or per-element array operand,
+    shaped to broadcast against an Nx3 array'''
+    if numpy.ndim(v) == 1:
+        return numpy.asarray(v)[:,None]
+    return v
+
+def _mdata(v):
+    '''return the numpy form of a scalar or per-element array operand,
+    shaped to broadcast against an Nx3x3 array'''
+    if numpy.ndim(v) == 1:
+        return numpy.asarray(v)[:,None,None]
+    return v
+
 def test_euler():
     '''check that from_euler() and to_euler() are consistent'''
     m = Matrix3()
@@ -262,7 +802,64 @@ def test_euler():
                 if diff.length() > 1.0e-12:
                     print('EULER ERROR:', v1, v2, diff.length())
 
+def test_quaternion():
+    '''check that the quaternion matches the rotation matrix'''
+    from math import radians
+    q = Quaternion()
+    m = Matrix3()
+    for r in range(-179, 179, 15):
+        for p in range(-89, 89, 15):
+            for y in range(-179, 179, 15):
+                m.from_euler(radians(r), radians(p), radians(y))
+                q.from_rotation_matrix(m)
+                diff = Vector3(q.to_euler()) - Vector3(m.to_euler())
+                if diff.length() > 1.0e-9:
+                    print('QUATERNION ERROR:', m, q, diff.length())
+                q.from_euler(radians(r), radians(p), radians(y))
+                m2 = q.rotation_matrix()
+                diff = m2.a - m.a + m2.b - m.b + m2.c - m.c
+                if diff.length() > 1.0e-9:
+                    print('QUATERNION MATRIX ERROR:', m, m2, diff.length())
+                g = Vector3(0.001, -0.002, 0.003)
+                for i in range(10):
+                    q.rotate(g)
+                    m.rotate(g)
+                    m.normalize()
+                m2 = q.rotation_matrix()
+                diff = m2.a - m.a + m2.b - m.b + m2.c - m.c
+                if diff.length() > 1.0e-4:
+                    print('QUATERNION ROTATE ERROR:', m, q, diff.length())
+
+def test_array():
+    '''check that the batch classes match the scalar classes'''
+    if numpy is None:
+        return
+    n = 100
+    ma = Matrix3Array(n)
+    roll  = numpy.random.uniform(-pi, pi, n)
+    pitch = numpy.random.uniform(-pi/2, pi/2, n)
+    yaw   = numpy.random.uniform(-pi, pi, n)
+    ma.from_euler(roll, pitch, yaw)
+    g = Vector3Array(data=numpy.random.uniform(-0.1, 0.1, (n, 3)))
+    ma.rotate(g)
+    ma.normalize()
+    va = ma.transposed() * g
+    (r2, p2, y2) = ma.to_euler()
+    for i in range(n):
+        m = Matrix3()
+        m.from_euler(roll[i], pitch[i], yaw[i])
+        m.rotate(g[i])
+        m.normalize()
+        diff = (m.transposed() * g[i]) - va[i]
+        if diff.length() > 1.0e-12:
+            print('ARRAY ERROR:', m, ma[i], diff.length())
+        diff = Vector3(m.to_euler()) - Vector3(r2[i], p2[i], y2[i])
+        if diff.length() > 1.0e-12:
+            print('ARRAY EULER ERROR:', m, ma[i], diff.length())
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
     test_euler()
+    test_quaternion()
+    test_array()
@@ -8,6 +8,8 @@ import util, time, math
 from math import degrees, radians, sin, cos, pi, asin
 from rotmat import Vector3, Matrix3
 
+sin_35 = sin(radians(35))
+
 class Rover(Aircraft):
     '''a simple rover'''
     def __init__(self,
@@ -17,33 +19,61 @@ class Rover(Aircraft):
                  wheeltrack=0.296,
                  max_wheel_turn=35,
                  turning_circle=1.8,
-                 skid_steering=False):
-        Aircraft.__init__(self)
+                 skid_steering=False,
+                 use_quaternion=False,
+                 substeps=1):
+        Aircraft.__init__(self, use_quaternion=use_quaternion)
+        self.substeps = substeps
         self.max_speed = max_speed
         self.max_accel = max_accel
         self.turning_circle = turning_circle
         self.wheelbase = wheelbase
         self.wheeltrack = wheeltrack
         self.max_wheel_turn = max_wheel_turn
-        self.last_time = time.time()
         self.skid_steering = skid_steering
 
+        # yaw per meter travelled for steering from -steering_range to
+        # steering_range, interpolated by curvature(). Skid steering
+        # gives up to twice the range of normal steering
+        self.steering_range = 2.0
+        self.steering_points = 2000
+        self.steering_step = 2*self.steering_range / self.steering_points
+        self.steering_table = [ self.curvature_exact(-self.steering_range + i*self.steering_step)
+                                for i in range(self.steering_points+1) ]
+
+        # minimum turning circle used by lat_accel2() and steering_angle()
+        self.mincircle = self.wheelbase/sin(radians(35))
+
+        # scratch vectors, reused each step to avoid allocation
+        self._accel_body = Vector3()
+        self._accel_earth = Vector3()
+
     def turn_circle(self, steering):
         '''return turning circle (diameter) in meters for steering angle proportion in degrees
         '''
         if abs(steering) < 1.0e-6:
             return 0
-        return self.turning_circle * sin(radians(35)) / sin(radians(steering*35))
+        return self.turning_circle * sin_35 / sin(radians(steering*35))
+
+    def curvature_exact(self, steering):
+        '''return the yaw in degrees per meter travelled for a steering
+        angle proportion, so the yaw rate is this times the speed'''
+        return 360.0 * sin(radians(steering*35)) / (pi * self.turning_circle * sin_35)
+
+    def curvature(self, steering):
+        '''curvature_exact() interpolated from the steering table'''
+        f = (steering + self.steering_range) / self.steering_step
+        i = int(f)
+        if f < 0 or i >= self.steering_points:
+            return self.curvature_exact(steering)
+        t = self.steering_table
+        return t[i] + (t[i+1] - t[i]) * (f - i)
 
     def yaw_rate(self, steering, speed):
         '''return yaw rate in degrees/second given steering_angle and speed'''
         if abs(steering) < 1.0e-6 or abs(speed) < 1.0e-6:
             return 0
-        d = self.turn_circle(steering)
-        c = pi * d
-        t = c / speed
-        rate = 360.0 / t
-        return rate
+        return self.curvature(steering) * speed
 
     def lat_accel(self, steering_angle, speed):
         '''return lateral acceleration in m/s/s'''
@@ -53,17 +83,18 @@ class Rover(Aircraft):
 
     def lat_accel2(self, steering_angle, speed):
         '''return lateral acceleration in m/s/s'''
-        mincircle = self.wheelbase/sin(radians(35))
         steer = steering_angle/35
-        return steer * (speed**2) * (2/mincircle)
+        return steer * (speed**2) * (2/self.mincircle)
 
     def steering_angle(self, lat_accel, speed):
         '''return steering angle to achieve the given lat_accel'''
-        mincircle = self.wheelbase/sin(radians(35))
-        steer = 0.5 * lat_accel * mincircle / (speed**2)
+        steer = 0.5 * lat_accel * self.mincircle / (speed**2)
         return steer * 35
 
-    def update(self, state):
+    def update(self, state, delta_time=None):
+        '''update the model from the control state. The time step is
+        delta_time seconds, or the wall clock time since the last update
+        if delta_time is None'''
 
         # if in skid steering mode the steering and throttle values are used for motor1 and motor2
         if self.skid_steering:
@@ -76,57 +107,70 @@ class Rover(Aircraft):
             throttle = state.throttle
 
         # how much time has passed?
-        t = time.time()
-        delta_time = t - self.last_time
-        self.last_time = t
+        delta_time = self.time_advance(delta_time)
 
-        # speed in m/s in body frame
-        velocity_body = self.dcm.transposed() * self.velocity
+        # steering is fixed over the update
+        if abs(steering) < 1.0e-6:
+            curvature = 0
+        else:
+            curvature = self.curvature(steering)
 
-        # speed along x axis, +ve is forward
-        speed = velocity_body.x
+        h = delta_time / self.substeps
+        for i in range(self.substeps):
+            # speed in m/s in body frame
+            velocity_body = self.velocity_body
 
-        # yaw rate in degrees/s
-        yaw_rate = self.yaw_rate(steering, speed)
+            # speed along x axis, +ve is forward
+            speed = velocity_body.x
 
-        # target speed with current throttle
-        target_speed = throttle * self.max_speed
+            # yaw rate in degrees/s
+            if abs(speed) < 1.0e-6:
+                yaw_rate = 0
+            else:
+                yaw_rate = curvature * speed
 
-        # linear acceleration in m/s/s - very crude model
-        accel = self.max_accel * (target_speed - speed) / self.max_speed
+            # target speed with current throttle
+            target_speed = throttle * self.max_speed
+
+            # linear acceleration in m/s/s - very crude model
+            accel = self.max_accel * (target_speed - speed) / self.max_speed
 
 #        print('speed=%f throttle=%f steering=%f yaw_rate=%f accel=%f' % (speed, state.throttle, state.steering, yaw_rate, accel))
         
-        self.gyro = Vector3(0,0,radians(yaw_rate))
+            self.gyro.set(0, 0, radians(yaw_rate))
+
+            # update attitude
+            self.update_attitude(h)
 
-        # update attitude
-        self.dcm.rotate(self.gyro * delta_time)
-        self.dcm.normalize()
+            # accel in body frame due to motor
+            accel_body = self._accel_body.set(accel, 0, 0)
 
-        # accel in body frame due to motor
-        accel_body = Vector3(accel, 0, 0)
+            # add in accel due to direction change
+            accel_body.y += radians(yaw_rate) * speed
 
-        # add in accel due to direction change
-        accel_body.y += radians(yaw_rate) * speed
+            # now in earth frame
+            accel_earth = self.dcm.mul_vec_into(accel_body, self._accel_earth)
+            accel_earth.z += self.gravity
 
-        # now in earth frame
-        accel_earth = self.dcm * accel_body
-        accel_earth += Vector3(0, 0, self.gravity)
+            # if we're on the ground, then our vertical acceleration is limited
+            # to zero. This effectively adds the force of the ground on the aircraft
+            accel_earth.z = 0
 
-        # if we're on the ground, then our vertical acceleration is limited
-        # to zero. This effectively adds the force of the ground on the aircraft
-        accel_earth.z = 0
+            # work out acceleration as seen by the accelerometers. It sees the kinematic
+            # acceleration (ie. real movement), plus gravity
+            self.dcm_T.mul_vec_into(accel_body.set(accel_earth.x,
+                                                   accel_earth.y,
+                                                   accel_earth.z - self.gravity),
+                                    self.accel_body)
 
-        # work out acceleration as seen by the accelerometers. It sees the kinematic
-        # acceleration (ie. real movement), plus gravity
-        self.accel_body = self.dcm.transposed() * (accel_earth + Vector3(0, 0, -self.gravity))
+            # new velocity vector
+            self.velocity.iadd_scaled(accel_earth, h)
 
-        # new velocity vector
-        self.velocity += accel_earth * delta_time
+            # new position vector
+            self.position.iadd_scaled(self.velocity, h)
 
-        # new position vector
-        old_position = self.position.copy()
-        self.position += self.velocity * delta_time
+            # velocity has changed
+            self.invalidate()
 
         # update lat/lon/altitude
         self.update_position(delta_time)
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+'''
+run a pysim vehicle model against SITL. SimulatorRunner owns the
+sockets, the clock, the event loop and the statistics, so the sim
+scripts are thin entry points and the autotest harness can run a
+simulator in-process and look at the model directly
+'''
+
+import socket, errno, math, signal, threading, json
+from math import degrees
+import util, sitl_protocol
+from scheduler import FrameScheduler, monotonic_time
+from runtime import Runtime, CommandChannel
+from telemetry import Telemetry, TelemetryOutput
+from recording import Recorder
+from windfield import WindField
+from plane import ControlSurfaces
+
+def interpret_address(addrstr):
+    '''interpret a IP:port string'''
+    a = addrstr.split(':')
+    a[1] = int(a[1])
+    return tuple(a)
+
+def parse_home(homestr):
+    '''parse a lat,lng,alt,hdg home string'''
+    v = homestr.split(',')
+    if len(v) != 4:
+        raise RuntimeError("home should be lat,lng,alt,hdg")
+    return [ float(x) for x in v ]
+
+
+class ControlDecoder(object):
+    '''turns SITL control packets into the input for a model's update().
+    decode() is called for each new packet and inputs() for each frame.
+    wind_override is set while the wind is controlled over the control
+    endpoint rather than by SITL'''
+    def __init__(self):
+        self.wind_override = False
+
+    def decode(self, control, model):
+        '''take the state from a new control packet'''
+        pass
+
+    def inputs(self):
+        '''the input for the next model update'''
+        return None
+
+    def motors(self):
+        '''up to 4 motor outputs from 0 to 1, for display'''
+        return [ 0.0 ] * 4
+
+
+class ServoDecoder(ControlDecoder):
+    '''servo outputs from 0 to 1, as used by MultiCopter, with the wind
+    taken from SITL'''
+    def __init__(self):
+        ControlDecoder.__init__(self)
+        self.servos = [ 0.0 ] * 11
+
+    def decode(self, control, model):
+        pwm = control.pwm
+        for i in range(11):
+            self.servos[i] = (pwm[i]-1000)/1000.0
+        if not self.wind_override:
+            model.wind.speed = control.speed*0.01
+            model.wind.direction = control.direction*0.01
+            model.wind.turbulance = control.turbulance*0.01
+
+    def inputs(self):
+        return self.servos[:]
+
+    def motors(self):
+        return self.servos[:4]
+
+
+class ControlState(object):
+    def __init__(self):
+        # steering from -1 to 1, where -1 is left, 1 is right
+        self.steering = 0
+        # throttle from -1 to 1, where -1 is full reverse, 1 is full forward
+        self.throttle = 0
+
+class SteeringDecoder(ControlDecoder):
+    '''steering and throttle from -1 to 1, as used by Rover'''
+    def __init__(self):
+        ControlDecoder.__init__(self)
+        self.state = ControlState()
+
+    def decode(self, control, model):
+        pwm = control.pwm
+        self.state.steering = (pwm[0]-1500)/500.0
+        self.state.throttle = (pwm[2]-1500)/500.0
+
+    def inputs(self):
+        return self.state
+
+
+class PlaneDecoder(ControlDecoder):
+    '''aileron, elevator, rudder and throttle, as used by Plane, with the
+    wind taken from SITL. With elevon or vtail set the outputs are mixed
+    back into separate surfaces as jsbsim/runsim.py does'''
+    def __init__(self, elevon=False, vtail=False):
+        ControlDecoder.__init__(self)
+        self.state = ControlSurfaces()
+        self.elevon = elevon
+        self.vtail = vtail
+
+    def decode(self, control, model):
+        pwm = control.pwm
+        if not self.wind_override:
+            model.wind.speed = control.speed*0.01
+            model.wind.direction = control.direction*0.01
+            model.wind.turbulance = control.turbulance*0.01
+
+        aileron  = (pwm[0]-1500)/500.0
+        elevator = (pwm[1]-1500)/500.0
+        throttle = (pwm[2]-1000)/1000.0
+        rudder   = (pwm[3]-1500)/500.0
+
+        if self.elevon:
+            # fake an elevon plane
+            ch1 = aileron
+            ch2 = elevator
+            aileron  = (ch2-ch1)/2.0
+            # the minus does away with the need for RC2_REV=-1
+            elevator = -(ch2+ch1)/2.0
+
+        if self.vtail:
+            # fake a vtail plane, this matches VTAIL_OUTPUT==2
+            ch1 = elevator
+            ch2 = rudder
+            elevator = (ch2-ch1)/2.0
+            rudder   = (ch2+ch1)/2.0
+
+        s = self.state
+        s.aileron = aileron
+        s.elevator = elevator
+        s.rudder = rudder
+        s.throttle = throttle
+
+    def inputs(self):
+        return self.state
+
+    def motors(self):
+        return [ self.state.throttle, 0.0, 0.0, 0.0 ]
+
+
+class FlightGearOutput(object):
+    '''FlightGear display output. The fgFDM field indices and unit
+    conversions are worked out once, and send() writes straight into
+    the packet values'''
+    def __init__(self, address):
+        from pymavlink import fgFDM
+        self.fdm = fgFDM.fgFDM()
+        self.fdm.set('num_engines', 4)
+        self.fields = [ self.field('latitude', 'degrees'),
+                        self.field('longitude', 'degrees'),
+                        self.field('altitude', 'meters'),
+                        self.field('phi', 'radians'),
+                        self.field('theta', 'radians'),
+                        self.field('psi', 'radians'),
+                        self.field('phidot', 'rps'),
+                        self.field('thetadot', 'rps'),
+                        self.field('psidot', 'rps'),
+                        self.field('vcas', 'mps'),
+                        self.field('v_north', 'mps'),
+                        self.field('v_east', 'mps') ]
+        self.rpm = self.field('rpm')[0]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(interpret_address(address))
+        self.sock.setblocking(0)
+
+    def field(self, name, units=None):
+        '''return the value index of a field and the factor converting
+        from units to the units FlightGear expects'''
+        var = self.fdm.mapping.vars[name]
+        if units is None:
+            return (var.index, 1.0)
+        return (var.index, self.fdm.convert(1.0, units, var.units))
+
+    def send(self, a, motors):
+        '''send the state of aircraft a to flightgear'''
+        earth_rates = a.earth_rates
+        (roll, pitch, yaw) = a.euler
+        state = (a.latitude, a.longitude, a.altitude,
+                 roll, pitch, yaw,
+                 earth_rates.x, earth_rates.y, earth_rates.z,
+                 a.airspeed,
+                 a.velocity.x, a.velocity.y)
+        values = self.fdm.values
+        for ((idx, scale), v) in zip(self.fields, state):
+            values[idx] = v * scale
+        # FG FDM protocol only supports 4 motors for display :(
+        for i in range(4):
+            values[self.rpm+i] = 1000*motors[i]
+        try:
+            self.sock.send(self.fdm.pack())
+        except socket.error as e:
+            if not e.errno in [ errno.ECONNREFUSED ]:
+                raise
+
+    def close(self):
+        self.sock.close()
+
+
+class SimulatorRunner(object):
+    '''run a vehicle model against SITL. In real-time mode the model is
+    stepped at the given rate, using the latest control input. In
+    lockstep mode it is stepped by one frame for each control packet.
+    An optional UDP control endpoint takes pause, resume, checkpoint
+    and wind commands. Frame timing and health telemetry is written
+    every telemetry_period seconds if a telemetry destination is given,
+    and the packets to and from SITL are recorded if a record file is
+    given.
+
+    run() runs the simulator until stop() is called. start() runs it in
+    a background thread instead, for embedding in the autotest harness'''
+    def __init__(self, model, decoder, rate=400,
+                 simin='127.0.0.1:5502', simout='127.0.0.1:5501',
+                 lockstep=False, overload='skip', control=None,
+                 checkpoint=None, telemetry=None, telemetry_period=1.0,
+                 record=None, name='sim'):
+        self.model = model
+        self.decoder = decoder
+        self.rate = rate
+        self.frame_time = 1.0/rate
+        self.name = name
+        self.paused = False
+        self.checkpoint_file = checkpoint
+        self.checkpoint_requested = False
+        self.packets_in = 0
+        self.packets_out = 0
+        self.outputs = []
+        self.thread = None
+
+        # setup input from SITL
+        self.sim_in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sim_in.bind(interpret_address(simin))
+        self.sim_in.setblocking(0)
+        self.control = sitl_protocol.ControlPacket(self.sim_in)
+
+        # setup output to SITL
+        self.sim_out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sim_out.connect(interpret_address(simout))
+        self.sim_out.setblocking(0)
+        self.fdm_pkt = sitl_protocol.FDMPacket()
+
+        self.runtime = Runtime()
+        self.scheduler = None
+        if lockstep:
+            # step the model once per packet from SITL with a fixed time
+            # step, running as fast as SITL sends
+            self.runtime.add_reader(self.sim_in, self.lockstep_input)
+        else:
+            self.scheduler = FrameScheduler(rate, policy=overload, name=name)
+            self.runtime.add_reader(self.sim_in, self.sim_recv)
+            self.runtime.add_tick(self.scheduler, self.physics_tick)
+
+        self.commands = None
+        if control:
+            self.commands = CommandChannel(self.runtime, interpret_address(control))
+            self.commands.add_command('pause', self.pause_command)
+            self.commands.add_command('resume', self.resume_command)
+            self.commands.add_command('checkpoint', self.checkpoint_command)
+            self.commands.add_command('wind', self.wind_command)
+
+        self.recorder = None
+        if record:
+            self.recorder = Recorder(record)
+            self.control.recorder = self.recorder
+            self.fdm_pkt.recorder = self.recorder
+            # the last second may be lost if we are killed
+            self.runtime.call_every(1.0, self.recorder.flush)
+
+        self.telemetry = Telemetry(self)
+        self.telemetry_out = None
+        if telemetry:
+            self.telemetry_out = TelemetryOutput(telemetry)
+            self.runtime.call_every(telemetry_period, self.export_telemetry)
+
+    def sim_recv(self, drain=True):
+        '''receive control information from SITL, by default only the
+        newest of the pending packets'''
+        if not self.control.recv(drain=drain):
+            return False
+        self.decoder.decode(self.control, self.model)
+        self.packets_in += 1
+        self.telemetry.input_received()
+        return True
+
+    def sim_send(self):
+        '''send flight information to SITL'''
+        a = self.model
+        earth_rates = a.earth_rates
+        (roll, pitch, yaw) = a.euler
+        self.fdm_pkt.pack(a.latitude, a.longitude, a.altitude, degrees(yaw),
+                          a.velocity.x, a.velocity.y, a.velocity.z,
+                          a.accelerometer.x, a.accelerometer.y, a.accelerometer.z,
+                          degrees(earth_rates.x), degrees(earth_rates.y), degrees(earth_rates.z),
+                          degrees(roll), degrees(pitch), degrees(yaw),
+                          a.airspeed)
+        self.fdm_pkt.send(self.sim_out)
+        self.packets_out += 1
+
+    def physics_tick(self, delta_time):
+        '''advance the model by one frame and send the new state to SITL'''
+        if self.paused:
+            return
+        t0 = monotonic_time()
+        self.model.update(self.decoder.inputs(), delta_time)
+        self.sim_send()
+        self.check_checkpoint()
+        self.telemetry.frame_times.record(monotonic_time() - t0)
+
+    def lockstep_input(self):
+        '''step the model with a fixed time step for each packet from
+        SITL, taking queued packets one at a time so none are merged'''
+        while self.sim_recv(drain=False):
+            self.physics_tick(self.frame_time)
+
+    def request_checkpoint(self):
+        '''save a checkpoint at the end of the current frame. This is safe
+        to call from a signal handler'''
+        self.checkpoint_requested = True
+
+    def check_checkpoint(self):
+        '''save a checkpoint if one has been requested'''
+        if self.checkpoint_requested:
+            self.checkpoint_requested = False
+            self.model.save_checkpoint(self.checkpoint_file)
+            print("Saved checkpoint %s at %.1fs" % (self.checkpoint_file, self.model.time_now))
+
+    def pause_command(self):
+        '''stop advancing the model'''
+        self.paused = True
+
+    def resume_command(self):
+        '''start advancing the model again'''
+        self.paused = False
+
+    def checkpoint_command(self, filename=None):
+        '''save a checkpoint, by default to the checkpoint file'''
+        if filename is None:
+            filename = self.checkpoint_file
+        if filename is None:
+            raise RuntimeError("no checkpoint file given")
+        self.model.save_checkpoint(filename)
+        return filename
+
+    def wind_command(self, windstring):
+        '''set the wind as speed,direction,turbulance, overriding the wind
+        from SITL, or go back to the SITL wind with "sitl". This is refused
+        while a wind field is loaded, as the field sets the wind speed and
+        direction on every update'''
+        field = self.model.wind.field
+        if field is not None:
+            raise RuntimeError("wind is set by the wind field %s" % field.filename)
+        if windstring == 'sitl':
+            self.decoder.wind_override = False
+            return
+        w = util.Wind(windstring)
+        self.model.wind.speed = w.speed
+        self.model.wind.direction = w.direction
+        self.model.wind.turbulance = w.turbulance
+        self.decoder.wind_override = True
+
+    def add_output(self, rate, callback):
+        '''call callback() at rate Hz, independent of the physics rate'''
+        return self.runtime.call_every(1.0/rate, callback)
+
+    def add_flightgear(self, address, rate):
+        '''send the model state to FlightGear at rate Hz'''
+        fg = FlightGearOutput(address)
+        self.outputs.append(fg)
+        return self.add_output(rate, lambda : fg.send(self.model, self.decoder.motors()))
+
+    def stats(self):
+        '''a dictionary of frame timing and health figures'''
+        return self.telemetry.report(new_interval=False)
+
+    def export_telemetry(self):
+        '''write a telemetry report'''
+        self.telemetry_out.write(self.telemetry.report())
+
+    def dump_telemetry(self):
+        '''write a telemetry report now, to the telemetry destination if
+        there is one, otherwise to stdout'''
+        if self.telemetry_out is not None:
+            self.telemetry_out.write(self.stats())
+        else:
+            print(json.dumps(self.stats(), sort_keys=True))
+
+    def run(self):
+        '''run the simulator until stop() is called'''
+        self.runtime.run()
+
+    def start(self):
+        '''run the simulator in a background thread'''
+        self.runtime.running = True
+        self.thread = threading.Thread(target=self.runtime.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''stop the simulator, waiting for a background thread to finish'''
+        self.runtime.stop()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        '''stop the simulator and close its sockets'''
+        self.stop()
+        self.sim_in.close()
+        self.sim_out.close()
+        if self.commands is not None:
+            self.commands.sock.close()
+        for out in self.outputs:
+            out.close()
+        if self.telemetry_out is not None:
+            self.telemetry_out.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+def add_options(parser, rate=400):
+    '''add the options common to all simulators to an OptionParser'''
+    parser.add_option("--simin",  dest="simin",   help="SIM input (IP:port)",       default="127.0.0.1:5502")
+    parser.add_option("--simout", dest="simout",  help="SIM output (IP:port)",      default="127.0.0.1:5501")
+    parser.add_option("--home", dest="home",  type='string', default=None, help="home lat,lng,alt,hdg (required)")
+    parser.add_option("--rate", dest="rate", type='int', help="SIM update rate", default=rate)
+    parser.add_option("--overload", dest="overload", help="frame overload policy (skip,catchup)", default='skip')
+    parser.add_option("--lockstep", action='store_true', default=False, help="advance one fixed time step per SITL input packet")
+    parser.add_option("--substeps", dest="substeps", type='int', help="physics steps per SIM update", default=1)
+    parser.add_option("--control", dest="control", help="UDP control endpoint (IP:port)", default=None)
+    parser.add_option("--checkpoint", dest="checkpoint", help="checkpoint file written on SIGUSR2", default=None)
+    parser.add_option("--resume", dest="resume", help="start from a checkpoint file", default=None)
+    parser.add_option("--telemetry", dest="telemetry", help="telemetry output, a file or udp:IP:port", default=None)
+    parser.add_option("--telemetry-rate", dest="telemetry_rate", type='float', help="telemetry output rate", default=1.0)
+    parser.add_option("--record", dest="record", help="record the SITL packet streams to a file", default=None)
+    parser.add_option("--wind-field", dest="wind_field", help="gridded wind file for a wind that varies with position, overriding the SITL wind speed and direction. The control endpoint wind command is refused while it is loaded", default=None)
+    parser.add_option("--wgs84", action='store_true', default=False, help="position on the WGS84 ellipsoid rather than a spherical earth")
+    parser.add_option("--quaternion", action='store_true', default=False, help="integrate attitude as a quaternion")
+
+def runner_from_options(model, decoder, opts, name='sim'):
+    '''create a SimulatorRunner for a sim script from its parsed options,
+    placing the model at home or resuming it from a checkpoint'''
+    (lat, lon, alt, hdg) = parse_home(opts.home)
+    model.wgs84 = opts.wgs84
+    model.set_home(lat, lon, alt, hdg)
+    if getattr(opts, 'wind', None):
+        model.wind = util.Wind(opts.wind)
+    if getattr(opts, 'wind_seed', None) is not None:
+        model.wind.seed(opts.wind_seed)
+    if opts.wind_field:
+        model.wind.field = WindField(opts.wind_field)
+
+    if opts.resume:
+        model.load_checkpoint(opts.resume)
+        print("Resumed from checkpoint %s at %.1fs" % (opts.resume, model.time_now))
+
+    sim = SimulatorRunner(model, decoder, rate=opts.rate,
+                          simin=opts.simin, simout=opts.simout,
+                          lockstep=opts.lockstep, overload=opts.overload,
+                          control=opts.control, checkpoint=opts.checkpoint,
+                          telemetry=opts.telemetry, telemetry_period=1.0/opts.telemetry_rate,
+                          record=opts.record, name=name)
+
+    if opts.checkpoint:
+        signal.signal(signal.SIGUSR2, lambda signum, frame : sim.request_checkpoint())
+    signal.signal(signal.SIGUSR1, lambda signum, frame : sim.dump_telemetry())
+
+    print("Starting at lat=%f lon=%f alt=%.1f heading=%.1f" % (lat, lon, alt, hdg))
+    return sim
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+'''
+a single threaded event loop for the simulators. Physics ticks run
+against FrameScheduler deadlines, and socket input, periodic output and
+the control endpoint are callbacks around them, all driven from one
+select() call, so adding an I/O channel does not stretch the physics
+frame and one process can host several vehicles
+'''
+
+import select, errno, socket, heapq
+from scheduler import monotonic_time
+
+class Timer(object):
+    '''a one shot or periodic callback, returned by Runtime.call_later()'''
+    def __init__(self, when, period, callback):
+        self.when = when
+        self.period = period
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        '''stop the timer from firing again'''
+        self.cancelled = True
+
+
+class Runtime(object):
+    '''run physics ticks, timers and socket callbacks from one loop.
+    Ticks take priority: after each select() any tick that is due runs
+    before socket callbacks and timers, so input arriving in a burst
+    can't delay a physics frame by more than one callback'''
+    def __init__(self):
+        self.readers = {}
+        self.timers = []
+        self.ticks = []
+        self.timer_count = 0
+        self.pass_callbacks = []
+        self.running = False
+
+    def add_reader(self, f, callback):
+        '''call callback() whenever f, a socket or anything with a
+        fileno(), has input'''
+        self.readers[f.fileno()] = callback
+
+    def remove_reader(self, f):
+        '''stop watching f for input'''
+        self.readers.pop(f.fileno(), None)
+
+    def call_later(self, delay, callback, period=None):
+        '''call callback() after delay seconds, then every period seconds
+        if a period is given'''
+        t = Timer(monotonic_time() + delay, period, callback)
+        self.push_timer(t)
+        return t
+
+    def call_every(self, period, callback):
+        '''call callback() every period seconds'''
+        return self.call_later(period, callback, period)
+
+    def call_each_pass(self, callback):
+        '''call callback() at the end of every pass of the loop, after
+        the input and timers of that pass have been handled'''
+        self.pass_callbacks.append(callback)
+
+    def push_timer(self, t):
+        '''add a timer to the heap. The count keeps equal times in order'''
+        self.timer_count += 1
+        heapq.heappush(self.timers, (t.when, self.timer_count, t))
+
+    def add_tick(self, scheduler, callback):
+        '''call callback(delta_time) for each frame of a FrameScheduler'''
+        self.ticks.append((scheduler, callback))
+
+    def stop(self):
+        '''make run() return after the current pass'''
+        self.running = False
+
+    def run_ticks(self):
+        '''run any ticks that are due'''
+        now = monotonic_time()
+        for (sched, callback) in self.ticks:
+            if now >= sched.deadline:
+                callback(sched.next_frame())
+
+    def run_once(self, timeout=1.0):
+        '''wait for input or the next deadline, at most timeout seconds,
+        and run what is due'''
+        now = monotonic_time()
+        deadline = now + timeout
+        for (sched, callback) in self.ticks:
+            if sched.deadline is None:
+                sched.start()
+            deadline = min(deadline, sched.deadline)
+        if self.timers:
+            deadline = min(deadline, self.timers[0][0])
+
+        try:
+            (rin, win, xin) = select.select(self.readers.keys(), [], [], max(deadline - now, 0))
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            rin = []
+
+        self.run_ticks()
+        for fd in rin:
+            callback = self.readers.get(fd, None)
+            if callback is not None:
+                callback()
+                self.run_ticks()
+
+        now = monotonic_time()
+        while self.timers and self.timers[0][0] <= now:
+            (when, count, t) = heapq.heappop(self.timers)
+            if t.cancelled:
+                continue
+            if t.period:
+                t.when = when + t.period
+                if t.when < now:
+                    t.when = now + t.period
+                self.push_timer(t)
+            t.callback()
+
+        for callback in self.pass_callbacks:
+            callback()
+
+    def run(self):
+        '''run until stop() is called'''
+        self.running = True
+        self.loop()
+
+    def loop(self):
+        '''run while running is set'''
+        while self.running:
+            self.run_once()
+
+
+class CommandChannel(object):
+    '''a UDP control endpoint. Each datagram is a command name followed by
+    arguments, eg. "wind 5,180,0.2". The handler registered for the
+    command is called with the arguments as strings, and the reply is
+    "OK", "OK " plus the handler's return value, or "ERR " and a
+    message'''
+    def __init__(self, runtime, address):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(address)
+        self.sock.setblocking(0)
+        self.handlers = {}
+        runtime.add_reader(self.sock, self.recv)
+
+    def add_command(self, name, handler):
+        '''register handler(*args) for command name'''
+        self.handlers[name] = handler
+
+    def recv(self):
+        '''handle all pending commands'''
+        while True:
+            try:
+                (buf, addr) = self.sock.recvfrom(1024)
+            except socket.error as e:
+                if not e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK ]:
+                    raise
+                return
+            self.reply(self.handle(buf), addr)
+
+    def handle(self, buf):
+        '''run one command, returning the reply'''
+        args = buf.split()
+        if len(args) == 0:
+            return 'ERR empty command'
+        if not args[0] in self.handlers:
+            return 'ERR unknown command %s' % args[0]
+        try:
+            ret = self.handlers[args[0]](*args[1:])
+        except Exception as e:
+            return 'ERR %s' % e
+        if ret is None:
+            return 'OK'
+        return 'OK %s' % ret
+
+    def reply(self, msg, addr):
+        '''send a reply, ignoring errors as nobody may be listening'''
+        try:
+            self.sock.sendto(msg, addr)
+        except socket.error:
+            pass
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+'''
+fixed rate frame scheduling for the simulators, using absolute
+deadlines on a monotonic clock
+'''
+
+import time, sys, select, errno
+
+def _monotonic_clock():
+    '''return a function giving monotonic time in seconds, falling
+    back to the wall clock where none is available'''
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if sys.platform.startswith('linux'):
+        try:
+            import ctypes, ctypes.util
+            class timespec(ctypes.Structure):
+                _fields_ = [ ('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long) ]
+            librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+            clock_gettime = librt.clock_gettime
+            clock_gettime.argtypes = [ ctypes.c_int, ctypes.POINTER(timespec) ]
+            CLOCK_MONOTONIC = 1
+            ts = timespec()
+            def monotonic():
+                if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                    raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+                return ts.tv_sec + ts.tv_nsec * 1.0e-9
+            monotonic()
+            return monotonic
+        except Exception:
+            pass
+    return time.time
+
+monotonic_time = _monotonic_clock()
+
+def sleep_until(deadline):
+    '''sleep until the monotonic clock reaches deadline'''
+    while True:
+        timeout = deadline - monotonic_time()
+        if timeout <= 0:
+            return
+        try:
+            select.select([], [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+class FrameScheduler(object):
+    '''run frames at a fixed rate against absolute deadlines, so timing
+    errors don't accumulate. When a frame is late by more than one
+    frame period the overload policy decides what happens:
+
+      skip    - drop the missed frames and advance the next frame by
+                the time they covered
+      catchup - run the missed frames back to back until the schedule
+                is met again. If more than max_catchup frames were
+                missed the oldest are dropped, so at most max_catchup
+                are run
+
+    wait() returns the simulated time step for the next frame, so the
+    model clock follows the schedule exactly. Lateness is recorded for
+    every frame, and a summary is printed every report_interval seconds
+    in which frames were late'''
+    def __init__(self, rate, policy='skip', max_catchup=10, report_interval=10.0, name='sim'):
+        if policy not in [ 'skip', 'catchup' ]:
+            raise RuntimeError("Unknown overload policy '%s'" % policy)
+        self.period = 1.0/rate
+        self.rate = rate
+        self.policy = policy
+        self.max_catchup = max_catchup
+        self.report_interval = report_interval
+        self.name = name
+        self.deadline = None
+
+        # totals since start
+        self.frames = 0
+        self.late_frames = 0
+        self.skipped_frames = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+        # counts since the last report
+        self.report_time = None
+        self.report_frames = 0
+        self.report_late = 0
+        self.report_skipped = 0
+        self.report_max_lateness = 0.0
+
+    def start(self):
+        '''make the first frame due now'''
+        self.deadline = monotonic_time()
+        self.report_time = self.deadline
+
+    def wait(self):
+        '''wait for the next frame deadline, returning the time step the
+        frame should advance the model by'''
+        if self.deadline is None:
+            self.start()
+        else:
+            sleep_until(self.deadline)
+        return self.next_frame()
+
+    def next_frame(self):
+        '''start the frame that is due, returning its time step. This is
+        for event loops that do their own waiting for the deadline'''
+        now = monotonic_time()
+        lateness = now - self.deadline
+        missed = int(lateness / self.period)
+        if missed <= 0:
+            skipped = 0
+        elif self.policy == 'skip':
+            skipped = missed
+        else:
+            # run up to max_catchup of the missed frames back to back
+            skipped = max(missed - self.max_catchup, 0)
+        self.deadline += self.period * (skipped + 1)
+        self.record(now, lateness, skipped)
+        return self.period * (skipped + 1)
+
+    def record(self, now, lateness, skipped):
+        '''record the lateness of a frame'''
+        self.frames += 1
+        self.report_frames += 1
+        self.total_lateness += lateness
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        if lateness > self.report_max_lateness:
+            self.report_max_lateness = lateness
+        # a frame that starts more than half a period after its
+        # deadline is counted as late
+        if lateness > 0.5 * self.period:
+            self.late_frames += 1
+            self.report_late += 1
+        self.skipped_frames += skipped
+        self.report_skipped += skipped
+        if self.report_interval and now - self.report_time >= self.report_interval:
+            self.report(now)
+
+    def report(self, now):
+        '''print a summary if any frames were late since the last report'''
+        if self.report_late or self.report_skipped:
+            print("%s: can't hold %u Hz: %u of %u frames late, %u skipped, max lateness %.1f ms in last %.1fs" % (
+                self.name, self.rate,
+                self.report_late, self.report_frames, self.report_skipped,
+                self.report_max_lateness * 1000.0, now - self.report_time))
+        self.report_time = now
+        self.report_frames = 0
+        self.report_late = 0
+        self.report_skipped = 0
+        self.report_max_lateness = 0.0
+
+    def mean_lateness(self):
+        '''mean frame lateness in seconds'''
+        if self.frames == 0:
+            return 0.0
+        return self.total_lateness / self.frames
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+'''
+simple fixed wing simulator, a faster alternative to jsbsim/runsim.py
+'''
+
+from plane import Plane
+from runner import PlaneDecoder, add_options, runner_from_options
+import sys
+
+##################
+# main program
+from optparse import OptionParser
+parser = OptionParser("sim_plane.py [options]")
+add_options(parser, rate=400)
+parser.add_option("--fgout", dest="fgout",  help="flightgear output (IP:port), empty to disable", default="127.0.0.1:5503")
+parser.add_option("--fg-rate", dest="fg_rate", type='float', help="flightgear output rate", default=30)
+parser.add_option("--wind", dest="wind", help="Simulate wind (speed,direction,turbulance)", default='0,0,0')
+parser.add_option("--wind-seed", dest="wind_seed", type='int', help="random seed for the wind turbulance", default=None)
+parser.add_option("--elevon", action='store_true', default=False, help='assume elevon input')
+parser.add_option("--vtail", action='store_true', default=False, help='assume vtail input')
+parser.add_option("--integrator", dest="integrator", help="physics integrator (semi-implicit,rk4)", default='semi-implicit')
+
+(opts, args) = parser.parse_args()
+
+for m in [ 'home' ]:
+    if not opts.__dict__[m]:
+        print("Missing required option '%s'" % m)
+        parser.print_help()
+        sys.exit(1)
+
+# create the plane model
+a = Plane(use_quaternion=opts.quaternion, integrator=opts.integrator, substeps=opts.substeps)
+
+sim = runner_from_options(a, PlaneDecoder(elevon=opts.elevon, vtail=opts.vtail), opts, name='sim_plane')
+
+if opts.fgout:
+    sim.add_flightgear(opts.fgout, opts.fg_rate)
+
+print("Simulator ready to fly")
+sim.run()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+'''
+simulate a swarm of multicopters or a fleet of rovers in one process.
+Vehicle i talks to its own SITL instance on the simin/simout ports plus
+i*port-step
+'''
+
+from swarm import SwarmMultiCopter, RoverFleet
+from runner import interpret_address
+from runtime import Runtime
+from scheduler import FrameScheduler
+from windfield import WindField
+import util, sys, math, collections
+import socket, sitl_protocol
+import numpy
+from math import degrees
+
+def sim_send(s, i, euler, earth_rates):
+    '''send flight information for vehicle i to SITL'''
+    (roll, pitch, yaw) = euler
+    fdm_pkt.pack(s.latitude[i], s.longitude[i], s.altitude[i], degrees(yaw[i]),
+                 s.velocity.x[i], s.velocity.y[i], s.velocity.z[i],
+                 s.accelerometer.x[i], s.accelerometer.y[i], s.accelerometer.z[i],
+                 degrees(earth_rates.x[i]), degrees(earth_rates.y[i]), degrees(earth_rates.z[i]),
+                 degrees(roll[i]), degrees(pitch[i]), degrees(yaw[i]),
+                 math.sqrt(s.velocity.x[i]**2 + s.velocity.y[i]**2))
+    fdm_pkt.send(sim_out[i])
+
+
+def decode(i, values):
+    '''take the inputs for vehicle i from the values of a control packet'''
+    if opts.vehicle == 'rover':
+        steering[i] = (values[0]-1500)/500.0
+        throttle[i] = (values[2]-1500)/500.0
+        return
+
+    # update motors
+    for j in range(11):
+        m[i,j] = (values[j]-1000)/1000.0
+
+    # and the wind from SITL
+    w = a.winds[i]
+    w.speed = values[11]*0.01
+    w.direction = values[12]*0.01
+    w.turbulance = values[13]*0.01
+
+
+def sim_recv(i):
+    '''receive control information for vehicle i from SITL, keeping only
+    the newest packet'''
+    if control[i].recv():
+        decode(i, control[i].values)
+
+
+def lockstep_recv(i):
+    '''queue every control packet for vehicle i, then step the swarm for
+    as long as every vehicle has an input waiting'''
+    while control[i].recv(drain=False):
+        pending[i].append(control[i].values)
+    while all(pending):
+        for j in range(opts.count):
+            decode(j, pending[j].popleft())
+        physics_tick(frame_time)
+
+
+def physics_tick(delta_time):
+    '''advance all vehicles by delta_time and send their new state'''
+    if opts.vehicle == 'rover':
+        a.update(steering, throttle, delta_time)
+    else:
+        a.update(m, delta_time)
+    earth_rates = a.earth_rates()
+    euler = a.euler()
+    for i in range(opts.count):
+        sim_send(a, i, euler, earth_rates)
+
+##################
+# main program
+from optparse import OptionParser
+parser = OptionParser("sim_swarm.py [options]")
+parser.add_option("--simin",  dest="simin",   help="SIM input for first vehicle (IP:port)",  default="127.0.0.1:5502")
+parser.add_option("--simout", dest="simout",  help="SIM output for first vehicle (IP:port)", default="127.0.0.1:5501")
+parser.add_option("--port-step", dest="port_step", type='int', help="port offset between vehicles", default=10)
+parser.add_option("--count", dest="count", type='int', help="number of vehicles", default=2)
+parser.add_option("--spacing", dest="spacing", type='float', help="distance east between vehicle homes (meters)", default=5.0)
+parser.add_option("--home", dest="home",  type='string', default=None, help="home lat,lng,alt,hdg of first vehicle (required)")
+parser.add_option("--rate", dest="rate", type='int', help="SIM update rate", default=400)
+parser.add_option("--overload", dest="overload", help="frame overload policy (skip,catchup)", default='skip')
+parser.add_option("--lockstep", action='store_true', default=False, help="advance one fixed time step once every vehicle has a SITL input packet")
+parser.add_option("--substeps", dest="substeps", type='int', help="physics steps per SIM update", default=1)
+parser.add_option("--vehicle", dest="vehicle", help="vehicle type (copter,rover)", default='copter')
+parser.add_option("--skid-steering", dest="skid_steering", help="comma separated list of rovers using skid steering", default='')
+parser.add_option("--frame", dest="frame", help="frame type (+,X,octo)", default='+')
+parser.add_option("--frame-file", dest="frame_file", help="file of extra frame definitions", default=None)
+parser.add_option("--integrator", dest="integrator", help="copter physics integrator (semi-implicit,rk4)", default='semi-implicit')
+parser.add_option("--wind-drag", action='store_true', default=False, help="apply the SITL wind to the copters")
+parser.add_option("--wind-field", dest="wind_field", help="gridded wind file for a wind that varies with position, overriding the SITL wind speed and direction. Implies --wind-drag", default=None)
+parser.add_option("--wind-seed", dest="wind_seed", type='int', help="random seed for the wind turbulance, plus the vehicle number", default=None)
+
+(opts, args) = parser.parse_args()
+
+for m in [ 'home' ]:
+    if not opts.__dict__[m]:
+        print("Missing required option '%s'" % m)
+        parser.print_help()
+        sys.exit(1)
+
+# UDP sockets, one pair per vehicle
+sim_out_address = interpret_address(opts.simout)
+sim_in_address  = interpret_address(opts.simin)
+sim_in = []
+sim_out = []
+control = []
+for i in range(opts.count):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((sim_in_address[0], sim_in_address[1] + i*opts.port_step))
+    s.setblocking(0)
+    sim_in.append(s)
+    control.append(sitl_protocol.ControlPacket(s))
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.connect((sim_out_address[0], sim_out_address[1] + i*opts.port_step))
+    s.setblocking(0)
+    sim_out.append(s)
+fdm_pkt = sitl_protocol.FDMPacket()
+
+# create the swarm model
+if opts.vehicle == 'rover':
+    skid = numpy.zeros(opts.count, dtype=bool)
+    for i in opts.skid_steering.split(','):
+        if i:
+            skid[int(i)] = True
+    a = RoverFleet(opts.count, skid_steering=skid, substeps=opts.substeps)
+    print("Simulating %u rovers, %u with skid steering" % (opts.count, skid.sum()))
+    steering = numpy.zeros(opts.count)
+    throttle = numpy.zeros(opts.count)
+elif opts.vehicle == 'copter':
+    a = SwarmMultiCopter(opts.count, frame=opts.frame, frame_file=opts.frame_file,
+                         integrator=opts.integrator, substeps=opts.substeps,
+                         wind_drag=opts.wind_drag or bool(opts.wind_field))
+    if opts.wind_field:
+        a.wind_field = WindField(opts.wind_field)
+    if opts.wind_seed is not None:
+        for i in range(opts.count):
+            a.winds[i].seed(opts.wind_seed + i)
+    print("Simulating %u vehicles with %u motors for frame %s" % (opts.count, len(a.motors), opts.frame))
+    # motors initially off
+    m = numpy.zeros((opts.count, 11))
+else:
+    print("Unknown vehicle type '%s'" % opts.vehicle)
+    sys.exit(1)
+
+# parse home
+v = opts.home.split(',')
+if len(v) != 4:
+    print("home should be lat,lng,alt,hdg")
+    sys.exit(1)
+for i in range(opts.count):
+    (lat, lon) = util.gps_newpos(float(v[0]), float(v[1]), 90, i*opts.spacing)
+    a.set_home(i, lat, lon, float(v[2]), float(v[3]))
+
+print("Starting at lat=%f lon=%f alt=%.1f heading=%.1f" % (
+    a.home_latitude[0],
+    a.home_longitude[0],
+    a.home_altitude[0],
+    float(v[3])))
+
+frame_time = 1.0/opts.rate
+runtime = Runtime()
+if opts.lockstep:
+    # step the swarm once per round of packets from SITL, with a fixed
+    # time step, running as fast as the slowest SITL sends
+    pending = [ collections.deque() for i in range(opts.count) ]
+    for i in range(opts.count):
+        runtime.add_reader(sim_in[i], lambda i=i: lockstep_recv(i))
+else:
+    for i in range(opts.count):
+        runtime.add_reader(sim_in[i], lambda i=i: sim_recv(i))
+    runtime.add_tick(FrameScheduler(opts.rate, policy=opts.overload, name='sim_swarm'), physics_tick)
+
+runtime.run()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+'''
+the UDP protocol between SITL and the simulators. The simulator sends
+an FDM packet with the vehicle state (struct sitl_fdm in
+libraries/SITL/SITL.h) and receives a control packet with the servo
+outputs and wind settings. Both codecs are precompiled and work on
+preallocated buffers, so nothing is allocated per packet
+'''
+
+import struct, socket, errno
+from recording import RECORD_CONTROL, RECORD_FDM
+
+FDM_MAGIC = 0x4c56414f
+
+fdm_fields = [ 'latitude', 'longitude', 'altitude', 'heading',
+               'speedN', 'speedE', 'speedD',
+               'xAccel', 'yAccel', 'zAccel',
+               'rollRate', 'pitchRate', 'yawRate',
+               'rollDeg', 'pitchDeg', 'yawDeg',
+               'airspeed', 'magic' ]
+
+control_fields = [ 'pwm%u' % i for i in range(11) ] + [ 'speed', 'direction', 'turbulance' ]
+
+fdm_struct = struct.Struct('<17dI')
+control_struct = struct.Struct('<14H')
+
+
+class FDMPacket(object):
+    '''an FDM packet for SITL, packed into a reusable buffer. Fields can
+    be read back by name, eg. pkt.heading. If recorder is set each
+    packet sent is also recorded'''
+    size = fdm_struct.size
+
+    def __init__(self):
+        self.buf = bytearray(self.size)
+        self.recorder = None
+
+    def pack(self, latitude, longitude, altitude, heading,
+             speedN, speedE, speedD,
+             xAccel, yAccel, zAccel,
+             rollRate, pitchRate, yawRate,
+             rollDeg, pitchDeg, yawDeg,
+             airspeed):
+        '''pack the vehicle state into the buffer. Angles are in degrees,
+        rates in degrees/s, accelerations in m/s/s in body frame'''
+        fdm_struct.pack_into(self.buf, 0,
+                             latitude, longitude, altitude, heading,
+                             speedN, speedE, speedD,
+                             xAccel, yAccel, zAccel,
+                             rollRate, pitchRate, yawRate,
+                             rollDeg, pitchDeg, yawDeg,
+                             airspeed, FDM_MAGIC)
+
+    def unpack(self):
+        '''return all fields as a tuple'''
+        return fdm_struct.unpack_from(self.buf, 0)
+
+    def send(self, sock):
+        '''send the packet, ignoring a missing receiver'''
+        if self.recorder is not None:
+            self.recorder.write(RECORD_FDM, self.buf)
+        try:
+            sock.send(self.buf)
+        except socket.error as e:
+            if not e.errno in [ errno.ECONNREFUSED ]:
+                raise
+
+def _fdm_accessor(idx):
+    fmt = struct.Struct('<I' if fdm_fields[idx] == 'magic' else '<d')
+    offset = 8*idx
+    return property(lambda self: fmt.unpack_from(self.buf, offset)[0])
+
+for _i in range(len(fdm_fields)):
+    setattr(FDMPacket, fdm_fields[_i], _fdm_accessor(_i))
+
+
+class ControlPacket(object):
+    '''the latest control packet from SITL. recv() drains every pending
+    datagram from a non-blocking socket into preallocated buffers and
+    keeps only the newest, so a slow reader never acts on stale data.
+    recv(drain=False) takes just the next packet, for callers that must
+    act on every one.
+    Packets of the wrong size are counted as dropped, and valid packets
+    superseded by a newer one as coalesced. Fields can be read by name,
+    eg. pkt.pwm0 or pkt.speed, or all servos at once from pkt.pwm. If
+    recorder is set every valid packet received is recorded, including
+    coalesced ones'''
+    size = control_struct.size
+
+    def __init__(self, sock):
+        self.sock = sock
+        # one spare byte so oversized packets are detected, not truncated
+        self.buf = bytearray(self.size+1)
+        self.spare = bytearray(self.size+1)
+        self.values = (1000,)*11 + (0, 0, 0)
+        self.packets = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.recorder = None
+
+    def recv(self, drain=True):
+        '''receive pending packets, returning True if a new one arrived.
+        Unless drain is set only one packet is taken'''
+        got = False
+        while True:
+            try:
+                n = self.sock.recv_into(self.spare)
+            except socket.error as e:
+                if not e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK ]:
+                    raise
+                break
+            if n != self.size:
+                self.dropped += 1
+                continue
+            if self.recorder is not None:
+                self.recorder.write(RECORD_CONTROL, self.spare, n)
+            if got:
+                self.coalesced += 1
+            got = True
+            (self.buf, self.spare) = (self.spare, self.buf)
+            if not drain:
+                break
+        if got:
+            self.packets += 1
+            self.values = control_struct.unpack_from(self.buf, 0)
+        return got
+
+    @property
+    def pwm(self):
+        '''the 11 servo outputs in microseconds'''
+        return self.values[:11]
+
+def _control_accessor(idx):
+    return property(lambda self: self.values[idx])
+
+for _i in range(len(control_fields)):
+    setattr(ControlPacket, control_fields[_i], _control_accessor(_i))
@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+'''
+batched multicopter and rover simulator cores, stepping N vehicles at once
+'''
+
+from multicopter import MultiCopter
+from rover import Rover
+import util, time, math
+from math import radians
+from rotmat import Vector3Array, Matrix3Array
+from geodesy import LocalTangentPlaneArray
+import numpy
+
+def drag_accel_array(wind, wx, wy, vx, vy, vz):
+    '''Wind.drag_accel() for arrays of wind and velocity'''
+    rx = vx - wx
+    ry = vy - wy
+    k = 0.1 * wind.cross_section * numpy.sqrt(rx*rx + ry*ry + vz*vz)
+    return (-k*rx, -k*ry)
+
+
+class SwarmMultiCopter(object):
+    '''N multicopters of the same frame, held as arrays. This applies the
+    same physics as MultiCopter.update to every vehicle at once, using the
+    frame, mixer and parameters of a template MultiCopter built from the
+    keyword arguments, including its integrator, substeps and wind drag.
+    Each vehicle has its own wind, in winds, with the steady part taken
+    from wind_field if one is set'''
+    def __init__(self, count, frame='+', **kwargs):
+        self.count = count
+        self.template = MultiCopter(frame=frame, **kwargs)
+        t = self.template
+        if t.use_quaternion:
+            raise RuntimeError("SwarmMultiCopter does not support use_quaternion")
+        if t.integrator not in [ 'semi-implicit', 'rk4' ]:
+            raise RuntimeError("Unknown integrator '%s'" % t.integrator)
+        mixer = t.mixer
+        self.motors = t.motors
+        self.servo_index = numpy.array(mixer.servo_index)
+        # mixing matrix, one column per axis
+        self.mix = numpy.array([mixer.roll, mixer.pitch, mixer.yaw]).T
+
+        self.integrator = t.integrator
+        self.substeps = t.substeps
+        self.wind_drag = t.wind_drag
+        self.mass = t.mass
+        self.gravity = t.gravity
+        self.thrust_scale = t.thrust_scale
+        self.frame_height = t.frame_height
+        self.terminal_velocity = t.terminal_velocity
+        self.rot_drag = numpy.array([t.rot_drag_xy, t.rot_drag_xy, t.rot_drag_z])
+
+        self.home_latitude  = numpy.zeros(count)
+        self.home_longitude = numpy.zeros(count)
+        self.home_altitude  = numpy.zeros(count)
+        self.ground_level   = numpy.zeros(count)
+        self.latitude  = numpy.zeros(count)
+        self.longitude = numpy.zeros(count)
+        self.altitude  = numpy.zeros(count)
+
+        # position conversion about the homes, rebuilt when a home moves
+        self.wgs84 = False
+        self.ltp = None
+
+        self.dcm = Matrix3Array(count)
+        self.gyro = Vector3Array(count) # rad/s
+        self.velocity = Vector3Array(count) # m/s, North, East, Down
+        self.position = Vector3Array(count) # m North, East, Down
+        self.motor_speed = numpy.zeros((count, len(self.motors)))
+        self.accel_body = Vector3Array(data=numpy.tile((0, 0, -self.gravity), (count, 1)))
+        self.accelerometer = self.accel_body.copy()
+
+        self.winds = [ util.Wind('0,0,0') for i in range(count) ]
+
+        # an optional windfield.WindField giving the steady wind at each
+        # vehicle's position
+        self.wind_field = None
+
+        # motor rotational acceleration, thrust and wind as x,y vectors
+        # for the current update
+        self._motor_rot_accel = numpy.zeros((count, 3))
+        self._thrust = numpy.zeros(count)
+        self._wind_x = numpy.zeros(count)
+        self._wind_y = numpy.zeros(count)
+
+        self.time_now = 0.0
+        self.last_time = time.time()
+
+    def set_home(self, i, latitude, longitude, altitude, yaw_degrees):
+        '''set the home position and heading of vehicle i'''
+        self.home_latitude[i] = latitude
+        self.home_longitude[i] = longitude
+        self.home_altitude[i] = altitude
+        self.ground_level[i] = altitude
+        self.latitude[i] = latitude
+        self.longitude[i] = longitude
+        self.altitude[i] = altitude
+        self.ltp = None
+        self.position.data[i] = 0
+        (roll, pitch, yaw) = self.dcm.to_euler()
+        m = Matrix3Array(1)
+        m.from_euler(roll[i], pitch[i], radians(yaw_degrees))
+        self.dcm.data[i] = m.data[0]
+
+    def on_ground(self, position=None):
+        '''return a boolean array, true for vehicles on the ground'''
+        if position is None:
+            position = self.position
+        return (-position.z) + self.home_altitude <= self.ground_level + self.frame_height
+
+    def time_advance(self, delta_time=None):
+        '''advance the simulation clock, returning the time step'''
+        if delta_time is None:
+            t = time.time()
+            delta_time = t - self.last_time
+            self.last_time = t
+        self.time_now += delta_time
+        return delta_time
+
+    def rotational_accel(self, g):
+        '''MultiCopter.rotational_accel() for an N x 3 array of body frame
+        rotation rates'''
+        return self._motor_rot_accel - g * self.rot_drag
+
+    def earth_accel(self, v, dcm):
+        '''MultiCopter.earth_accel() for an N x 3 array of earth frame
+        velocities and an N x 3 x 3 array of attitudes'''
+        # thrust acts along the body z axis, which is column 2 of the dcm
+        accel = dcm[:,:,2] * (-self._thrust / self.mass)[:,None]
+        accel[:,2] += self.gravity
+
+        # air resistance
+        accel -= v * (self.gravity / self.terminal_velocity)
+
+        # add in some wind (turn force into accel by dividing by mass)
+        if self.wind_drag:
+            (dx, dy) = drag_accel_array(self.template.wind, self._wind_x, self._wind_y,
+                                        v[:,0], v[:,1], v[:,2])
+            accel[:,0] += dx / self.mass
+            accel[:,1] += dy / self.mass
+
+        # if we're on the ground, then our vertical acceleration is limited
+        # to zero. This effectively adds the force of the ground on the aircraft
+        accel[:,2] = numpy.where(self.on_ground() & (accel[:,2] > 0), 0, accel[:,2])
+        return accel
+
+    def rotate(self, dcm, g, h):
+        '''rotate an N x 3 x 3 array of attitudes by rates g for h seconds'''
+        m = Matrix3Array(data=dcm)
+        m.rotate(Vector3Array(data=g * h))
+        m.normalize()
+        return m.data
+
+    def integrate(self, h):
+        '''Aircraft.integrate() for all vehicles, returning the mean earth
+        frame acceleration over the step'''
+        g = self.gyro.data
+        v = self.velocity.data
+        if self.integrator == 'semi-implicit':
+            # rates are updated before they are used
+            g += self.rotational_accel(g) * h
+            self.dcm.data = self.rotate(self.dcm.data, g, h)
+            accel = self.earth_accel(v, self.dcm.data)
+            v += accel * h
+            self.position.data += v * h
+            return accel
+
+        g0 = g.copy()
+        f = self.rotational_accel
+        k1 = f(g0)
+        g2 = g0 + 0.5*h*k1
+        k2 = f(g2)
+        g3 = g0 + 0.5*h*k2
+        k3 = f(g3)
+        g4 = g0 + h*k3
+        k4 = f(g4)
+        g += h*(k1 + 2*k2 + 2*k3 + k4)/6.0
+
+        # rotate by the mean rate over the step, keeping the start and
+        # mid-point attitudes for the translational stages
+        wm = (g0 + 2*g2 + 2*g3 + g4)/6.0
+        dcm0 = self.dcm.data
+        dcm_mid = self.rotate(dcm0, wm, 0.5*h)
+        self.dcm.data = self.rotate(dcm0, wm, h)
+
+        f = self.earth_accel
+        k1 = f(v, dcm0)
+        v2 = v + 0.5*h*k1
+        k2 = f(v2, dcm_mid)
+        v3 = v + 0.5*h*k2
+        k3 = f(v3, dcm_mid)
+        v4 = v + h*k3
+        k4 = f(v4, self.dcm.data)
+        accel = (k1 + 2*k2 + 2*k3 + k4)/6.0
+        self.position.data += h*(v + 2*v2 + 2*v3 + v4)/6.0
+        v += h*accel
+        return accel
+
+    def update_wind(self, delta_time):
+        '''work out the wind of each vehicle for this update. With a wind
+        field the steady wind comes from it, overriding the SITL wind as
+        Wind.locate() does, looked up for the whole swarm at once so
+        vehicles in the same cell share its reads'''
+        if self.wind_field is not None:
+            field = self.wind_field.lookup_many(self.latitude, self.longitude, self.altitude, self.time_now)
+            for i in range(self.count):
+                (n, e, d) = field[i]
+                self.winds[i].speed = math.sqrt(n*n + e*e)
+                self.winds[i].direction = math.degrees(math.atan2(e, n))
+        for i in range(self.count):
+            (speed, direction) = self.winds[i].current(delta_time)
+            (self._wind_x[i], self._wind_y[i]) = self.winds[i].vector(speed, direction)
+
+    def update(self, servos, delta_time=None):
+        '''update all vehicles from an N x 11 array of servo outputs'''
+        m = numpy.asarray(servos, dtype=float)[:, self.servo_index]
+        numpy.maximum(m, 0, out=m)
+        self.motor_speed = m
+
+        delta_time = self.time_advance(delta_time)
+
+        # the wind is held for the whole update
+        if self.wind_drag:
+            self.update_wind(delta_time)
+
+        # rotational acceleration from the motors, in rad/s/s, in body frame
+        self._motor_rot_accel = m.dot(self.mix)
+        self._thrust = m.sum(axis=1) * self.thrust_scale # newtons
+
+        h = delta_time / self.substeps
+        for i in range(self.substeps):
+            ground = self.on_ground()
+
+            # update rates, attitude, velocity and position
+            accel_earth = self.integrate(h)
+
+            # work out acceleration as seen by the accelerometers
+            kinematic = accel_earth.copy()
+            kinematic[:,2] -= self.gravity
+            self.accel_body = self.dcm.transposed_mul(Vector3Array(data=kinematic))
+
+            # constrain height to the ground
+            landed = self.on_ground()
+            if landed.any():
+                for i in numpy.nonzero(landed & ~ground)[0]:
+                    print("Vehicle %u hit ground at %f m/s" % (i, self.velocity.z[i]))
+                self.velocity.data[landed] = 0
+                # zero roll/pitch, but keep yaw
+                (r, p, y) = self.dcm.to_euler()
+                level = Matrix3Array(int(landed.sum()))
+                level.from_euler(0, 0, y[landed])
+                self.dcm.data[landed] = level.data
+                self.position.data[landed, 2] = -(self.ground_level + self.frame_height - self.home_altitude)[landed]
+
+        self.update_position()
+
+    def update_position(self):
+        '''update lat/lon/alt from position for all vehicles'''
+        if self.ltp is None:
+            self.ltp = LocalTangentPlaneArray(self.home_latitude, self.home_longitude,
+                                              self.home_altitude, wgs84=self.wgs84)
+        (self.latitude, self.longitude, self.altitude) = self.ltp.ned_to_lla(self.position.x,
+                                                                             self.position.y,
+                                                                             self.position.z)
+        self.accelerometer = self.accel_body.copy()
+
+    def earth_rates(self):
+        '''rotation rates in earth frame for all vehicles, as a Vector3Array'''
+        (phi, theta, psi) = self.dcm.to_euler()
+        p = self.gyro.x
+        q = self.gyro.y
+        r = self.gyro.z
+        phiDot   = p + numpy.tan(theta)*(q*numpy.sin(phi) + r*numpy.cos(phi))
+        thetaDot = q*numpy.cos(phi) - r*numpy.sin(phi)
+        theta = numpy.where(numpy.fabs(numpy.cos(theta)) < 1.0e-20, theta + 1.0e-10, theta)
+        psiDot   = (q*numpy.sin(phi) + r*numpy.cos(phi))/numpy.cos(theta)
+        return Vector3Array(data=numpy.column_stack((phiDot, thetaDot, psiDot)))
+
+    def euler(self):
+        '''roll, pitch and yaw arrays in radians'''
+        return self.dcm.to_euler()
+
+
+
+class RoverFleet(object):
+    '''N rovers held as arrays. This applies the same physics as
+    Rover.update to every vehicle at once, using the parameters and
+    steering table of a template Rover. skid_steering is either one
+    value for the whole fleet or a sequence with one per rover, so
+    normal and skid steered rovers can be mixed'''
+    def __init__(self, count, skid_steering=False, **kwargs):
+        self.count = count
+        self.template = Rover(**kwargs)
+        t = self.template
+        self.skid_steering = numpy.zeros(count, dtype=bool) | numpy.asarray(skid_steering, dtype=bool)
+        self.max_speed = t.max_speed
+        self.max_accel = t.max_accel
+        self.substeps = t.substeps
+        self.gravity = t.gravity
+        self.steering_range = t.steering_range
+        self.steering_x = numpy.linspace(-t.steering_range, t.steering_range, t.steering_points+1)
+        self.steering_table = numpy.array(t.steering_table)
+
+        self.home_latitude  = numpy.zeros(count)
+        self.home_longitude = numpy.zeros(count)
+        self.home_altitude  = numpy.zeros(count)
+        self.latitude  = numpy.zeros(count)
+        self.longitude = numpy.zeros(count)
+        self.altitude  = numpy.zeros(count)
+
+        # position conversion about the homes, rebuilt when a home moves
+        self.wgs84 = False
+        self.ltp = None
+
+        # rovers stay level, so attitude is just yaw
+        self.yaw = numpy.zeros(count)      # radians
+        self.yaw_rate = numpy.zeros(count) # rad/s
+        self.velocity = Vector3Array(count) # m/s, North, East, Down
+        self.position = Vector3Array(count) # m North, East, Down
+        self.accel_body = Vector3Array(data=numpy.tile((0, 0, -self.gravity), (count, 1)))
+        self.accelerometer = self.accel_body.copy()
+
+        self.time_now = 0.0
+        self.last_time = time.time()
+
+    def set_home(self, i, latitude, longitude, altitude, yaw_degrees):
+        '''set the home position and heading of rover i'''
+        self.home_latitude[i] = latitude
+        self.home_longitude[i] = longitude
+        self.home_altitude[i] = altitude
+        self.latitude[i] = latitude
+        self.longitude[i] = longitude
+        self.altitude[i] = altitude
+        self.ltp = None
+        self.position.data[i] = 0
+        self.yaw[i] = radians(yaw_degrees)
+
+    def time_advance(self, delta_time=None):
+        '''advance the simulation clock, returning the time step'''
+        if delta_time is None:
+            t = time.time()
+            delta_time = t - self.last_time
+            self.last_time = t
+        self.time_now += delta_time
+        return delta_time
+
+    def curvature(self, steering):
+        '''yaw in degrees per meter travelled for an array of steering
+        values, interpolated from the steering table'''
+        c = numpy.interp(steering, self.steering_x, self.steering_table)
+        outside = numpy.fabs(steering) > self.steering_range
+        if outside.any():
+            t = self.template
+            c[outside] = 360.0 * numpy.sin(numpy.radians(steering[outside]*35)) / (math.pi * t.turning_circle * math.sin(radians(35)))
+        c[numpy.fabs(steering) < 1.0e-6] = 0
+        return c
+
+    def update(self, steering, throttle, delta_time=None):
+        '''update all rovers from arrays of steering and throttle from
+        -1 to 1. For skid steered rovers these are the left and right
+        motors, as in Rover.update'''
+        steering = numpy.array(steering, dtype=float)
+        throttle = numpy.array(throttle, dtype=float)
+        skid = self.skid_steering
+        if skid.any():
+            (motor1, motor2) = (steering[skid], throttle[skid])
+            steering[skid] = motor1 - motor2
+            throttle[skid] = 0.5*(motor1 + motor2)
+
+        delta_time = self.time_advance(delta_time)
+
+        # steering is fixed over the update
+        curvature = self.curvature(steering)
+        target_speed = throttle * self.max_speed
+
+        h = delta_time / self.substeps
+        v = self.velocity.data
+        for i in range(self.substeps):
+            # speed along x axis, +ve is forward
+            (c, s) = (numpy.cos(self.yaw), numpy.sin(self.yaw))
+            speed = v[:,0]*c + v[:,1]*s
+
+            # yaw rate in rad/s
+            rate = numpy.radians(curvature * speed)
+            rate[numpy.fabs(speed) < 1.0e-6] = 0
+            self.yaw_rate = rate
+
+            # linear acceleration in m/s/s - very crude model
+            accel = self.max_accel * (target_speed - speed) / self.max_speed
+
+            # update attitude. A first order rotation of the dcm, as
+            # Rover uses, turns through atan of the angle once normalized
+            self.yaw = numpy.fmod(self.yaw + numpy.arctan(rate*h), 2*math.pi)
+            (c, s) = (numpy.cos(self.yaw), numpy.sin(self.yaw))
+
+            # accel in body frame due to motor and direction change, and
+            # in earth frame. Vertical acceleration is held at zero by
+            # the ground
+            lat_accel = rate * speed
+            self.accel_body = Vector3Array(data=numpy.column_stack((accel, lat_accel,
+                                                                    numpy.full(self.count, -self.gravity))))
+            v[:,0] += (c*accel - s*lat_accel) * h
+            v[:,1] += (s*accel + c*lat_accel) * h
+
+            # new position
+            self.position.data += v * h
+
+        self.update_position()
+
+    def update_position(self):
+        '''update lat/lon/alt from position for all rovers'''
+        if self.ltp is None:
+            self.ltp = LocalTangentPlaneArray(self.home_latitude, self.home_longitude,
+                                              self.home_altitude, wgs84=self.wgs84)
+        (self.latitude, self.longitude, self.altitude) = self.ltp.ned_to_lla(self.position.x,
+                                                                             self.position.y,
+                                                                             self.position.z)
+        self.accelerometer = self.accel_body.copy()
+
+    def euler(self):
+        '''roll, pitch and yaw arrays in radians'''
+        zero = numpy.zeros(self.count)
+        return (zero, zero, self.yaw)
+
+    def earth_rates(self):
+        '''rotation rates in earth frame for all rovers, as a Vector3Array'''
+        zero = numpy.zeros(self.count)
+        return Vector3Array(data=numpy.column_stack((zero, zero, self.yaw_rate)))
+
+
+def test_drag_array():
+    '''check that drag_accel_array() matches Wind.drag_accel()'''
+    wind = util.Wind('0,0,0')
+    rng = numpy.random.RandomState(1)
+    (wx, wy, vx, vy, vz) = rng.normal(scale=5.0, size=(5, 100))
+    (ax, ay) = drag_accel_array(wind, wx, wy, vx, vy, vz)
+    for i in range(100):
+        (x, y) = wind.drag_accel(wx[i], wy[i], vx[i], vy[i], vz[i])
+        assert abs(ax[i] - x) < 1.0e-12 and abs(ay[i] - y) < 1.0e-12
+
+
+if __name__ == "__main__":
+    test_drag_array()
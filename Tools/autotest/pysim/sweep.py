@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+'''
+run the pysim vehicle models headless over a grid of parameters,
+recording step response metrics for each combination. No SITL is
+needed: the models are driven by a simple built in controller or a
+scripted servo profile, using a fixed time step.
+
+The copter controller flies around --hover, or around the model's
+hover_throttle when that is swept. MultiCopter scales its thrust from
+its mass, so sweeping mass does not change a copter's response
+'''
+
+import sys, time, math, itertools
+from multicopter import MultiCopter
+from rover import Rover
+
+def number(s):
+    '''convert a string to an int if possible, otherwise a float'''
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+def parse_param(s):
+    '''parse a name=start:stop:step or name=v1,v2,... parameter range'''
+    (name, spec) = s.split('=', 1)
+    if ':' in spec:
+        (start, stop, step) = [float(x) for x in spec.split(':')]
+        values = []
+        v = start
+        while v <= stop + step*1.0e-6:
+            values.append(v)
+            v = start + len(values)*step
+    else:
+        values = [number(x) for x in spec.split(',')]
+    return (name, values)
+
+def load_profile(filename):
+    '''load a scripted profile. Each line is a time in seconds followed by
+    the control values to apply from that time on: servo outputs from 0
+    to 1 for a copter, or steering and throttle from -1 to 1 for a rover'''
+    profile = []
+    f = open(filename, mode='r')
+    for line in f:
+        a = line.split()
+        if len(a) == 0 or a[0].startswith('#'):
+            continue
+        profile.append((float(a[0]), [float(x) for x in a[1:]]))
+    f.close()
+    profile.sort()
+    return profile
+
+def profile_value(profile, t, idx):
+    '''return the profile entry in effect at time t, starting from index idx'''
+    while idx+1 < len(profile) and profile[idx+1][0] <= t:
+        idx += 1
+    return idx
+
+def step_metrics(times, values, target, band):
+    '''settle time, overshoot and final error of a step response. The
+    settling band is a fraction of the target, or an absolute band for a
+    target of zero. Overshoot is the percentage of the step by which the
+    response went past the target, in the direction of the step'''
+    if target != 0:
+        tolerance = band * abs(target)
+    else:
+        tolerance = band
+    step = target - values[0]
+    settle_time = 0.0
+    peak = values[0]
+    for (t, v) in zip(times, values):
+        if abs(v - target) > tolerance:
+            settle_time = t
+        if (step >= 0 and v > peak) or (step < 0 and v < peak):
+            peak = v
+    if step != 0:
+        overshoot = 100.0 * max(0.0, (peak - target) / float(step))
+    else:
+        overshoot = 0.0
+    return { 'settle_time' : settle_time,
+             'overshoot'   : overshoot,
+             'final_error' : values[-1] - target }
+
+class ControlState(object):
+    def __init__(self):
+        self.steering = 0
+        self.throttle = 0
+
+def run_copter(params, settings):
+    '''climb to the target altitude and hold, returning metrics'''
+    a = MultiCopter(frame=settings.frame, **params)
+    profile = settings.profile
+    dt = 1.0/settings.rate
+    nsteps = int(settings.duration * settings.rate)
+    servos = [0.0] * 11
+    times = []
+    alts = []
+    energy = 0.0
+    idx = 0
+    if 'hover_throttle' in params:
+        hover = a.hover_throttle
+    else:
+        hover = settings.hover
+    for i in range(nsteps):
+        t = i * dt
+        if profile:
+            idx = profile_value(profile, t, idx)
+            servos[:len(profile[idx][1])] = profile[idx][1]
+        else:
+            # simple PD altitude controller around a nominal hover throttle
+            err = settings.target - (-a.position.z)
+            throttle = hover + settings.kp * err + settings.kd * a.velocity.z
+            throttle = min(max(throttle, 0.0), 1.0)
+            for mot in a.motors:
+                servos[mot.servo-1] = throttle
+        a.update(servos, dt)
+        energy += sum(a.motor_speed) * dt
+        times.append(t + dt)
+        alts.append(-a.position.z)
+    ret = step_metrics(times, alts, settings.target, settings.band)
+    ret['energy'] = energy
+    return ret
+
+def run_rover(params, settings):
+    '''accelerate to the target speed, returning metrics'''
+    a = Rover(**params)
+    profile = settings.profile
+    dt = 1.0/settings.rate
+    nsteps = int(settings.duration * settings.rate)
+    state = ControlState()
+    times = []
+    speeds = []
+    energy = 0.0
+    idx = 0
+    for i in range(nsteps):
+        t = i * dt
+        if profile:
+            idx = profile_value(profile, t, idx)
+            (state.steering, state.throttle) = profile[idx][1][:2]
+        else:
+            throttle = min(max(settings.target / a.max_speed, -1.0), 1.0)
+            if a.skid_steering:
+                # steering and throttle drive the left and right motors
+                state.steering = throttle + 0.5*settings.steering
+                state.throttle = throttle - 0.5*settings.steering
+            else:
+                state.steering = settings.steering
+                state.throttle = throttle
+        a.update(state, dt)
+        if a.skid_steering:
+            # both motors draw power. Each moves half the rover, as
+            # Rover.update() averages them into one throttle
+            energy += 0.5 * (abs(state.steering) + abs(state.throttle)) * dt
+        else:
+            energy += abs(state.throttle) * dt
+        times.append(t + dt)
+        speeds.append(math.sqrt(a.velocity.x**2 + a.velocity.y**2))
+    ret = step_metrics(times, speeds, settings.target, settings.band)
+    ret['energy'] = energy
+    return ret
+
+def run_case(case):
+    '''run one parameter combination. This is the process pool worker'''
+    (params, settings) = case
+    if settings.vehicle == 'rover':
+        return (params, run_rover(params, settings))
+    return (params, run_copter(params, settings))
+
+metric_names = [ 'settle_time', 'overshoot', 'final_error', 'energy' ]
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    from multiprocessing import Pool
+    parser = OptionParser("sweep.py [options] NAME=START:STOP:STEP|NAME=V1,V2,...")
+    parser.add_option("--vehicle", default='copter', help="vehicle model (copter,rover)")
+    parser.add_option("--frame", default='+', help="multicopter frame type")
+    parser.add_option("--rate", type='int', default=400, help="physics rate in Hz")
+    parser.add_option("--duration", type='float', default=20.0, help="length of each run in seconds")
+    parser.add_option("--target", type='float', default=10.0, help="target altitude (copter) or speed (rover)")
+    parser.add_option("--band", type='float', default=0.05, help="settling band as a fraction of the target, or in absolute units for a target of zero")
+    parser.add_option("--hover", type='float', default=0.45, help="controller hover throttle (copter), unless hover_throttle is swept")
+    parser.add_option("--kp", type='float', default=0.05, help="controller altitude gain (copter)")
+    parser.add_option("--kd", type='float', default=0.1, help="controller climb rate gain (copter)")
+    parser.add_option("--steering", type='float', default=0.0, help="steering during the run (rover)")
+    parser.add_option("--profile", default=None, help="scripted control profile instead of the controller")
+    parser.add_option("--jobs", type='int', default=None, help="number of worker processes")
+    parser.add_option("--out", default='sweep.csv', help="results file")
+
+    (opts, args) = parser.parse_args()
+
+    if len(args) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    if opts.vehicle not in [ 'copter', 'rover' ]:
+        print("Unknown vehicle '%s'" % opts.vehicle)
+        sys.exit(1)
+
+    if opts.profile:
+        opts.profile = load_profile(opts.profile)
+
+    ranges = [ parse_param(a) for a in args ]
+    names = [ r[0] for r in ranges ]
+    if opts.vehicle == 'copter' and 'mass' in names:
+        print("Note: MultiCopter thrust scales with mass, so mass does not change the response")
+    cases = [ (dict(zip(names, values)), opts) for values in itertools.product(*[ r[1] for r in ranges ]) ]
+    print("Running %u cases" % len(cases))
+
+    tstart = time.time()
+    f = open(opts.out, mode='w')
+    f.write(','.join(names + metric_names) + '\n')
+    pool = Pool(processes=opts.jobs)
+    count = 0
+    for (params, metrics) in pool.imap(run_case, cases, chunksize=4):
+        f.write(','.join(['%g' % params[n] for n in names] +
+                         ['%.4f' % metrics[n] for n in metric_names]) + '\n')
+        count += 1
+    pool.close()
+    pool.join()
+    f.close()
+    print("Wrote %u results to %s in %.1f seconds" % (count, opts.out, time.time() - tstart))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+'''
+frame timing and health telemetry for the simulators, exported as one
+JSON object per line to a file or a UDP port
+'''
+
+import json, socket, errno, time
+from scheduler import monotonic_time
+
+# upper bounds of the frame time histogram bins, in milliseconds. The
+# last bin counts everything longer
+frame_time_bins = [ 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50 ]
+
+class FrameTimes(object):
+    '''a histogram of how long each frame took to process, with a count
+    of frames that took longer than the frame period'''
+    def __init__(self, period):
+        self.period = period
+        self.counts = [ 0 ] * (len(frame_time_bins)+1)
+        self.max_time = 0.0
+        self.overruns = 0
+        self.frames = 0
+
+    def record(self, frame_time):
+        '''record the processing time of one frame, in seconds'''
+        ms = frame_time * 1000.0
+        i = 0
+        while i < len(frame_time_bins) and ms > frame_time_bins[i]:
+            i += 1
+        self.counts[i] += 1
+        self.frames += 1
+        if frame_time > self.max_time:
+            self.max_time = frame_time
+        if frame_time > self.period:
+            self.overruns += 1
+
+
+class TelemetryOutput(object):
+    '''write telemetry lines to a file, or to a UDP port when the
+    destination is given as udp:IP:port'''
+    def __init__(self, dest):
+        self.dest = dest
+        self.sock = None
+        self.f = None
+        if dest.startswith('udp:'):
+            a = dest[4:].split(':')
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((a[0], int(a[1])))
+            self.sock.setblocking(0)
+        else:
+            self.f = open(dest, mode='w')
+
+    def write(self, report):
+        '''write one report dictionary as a JSON line'''
+        line = json.dumps(report, sort_keys=True) + '\n'
+        if self.sock is not None:
+            try:
+                self.sock.send(line)
+            except socket.error as e:
+                if not e.errno in [ errno.ECONNREFUSED, errno.EAGAIN, errno.EWOULDBLOCK ]:
+                    raise
+        else:
+            self.f.write(line)
+            self.f.flush()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        else:
+            self.f.close()
+
+
+class Telemetry(object):
+    '''collect frame timing and health figures for a SimulatorRunner and
+    build reports from them. The achieved rate is over the time since
+    the previous report, everything else is a total since start'''
+    def __init__(self, runner):
+        self.runner = runner
+        self.frame_times = FrameTimes(runner.frame_time)
+        self.last_input = None
+        self.last_report = monotonic_time()
+        self.last_frames = 0
+
+    def input_received(self):
+        '''note the arrival of a control packet from SITL'''
+        self.last_input = monotonic_time()
+
+    def report(self, new_interval=True):
+        '''return a report dictionary, by default starting a new interval
+        for the achieved rate'''
+        r = self.runner
+        now = monotonic_time()
+        ft = self.frame_times
+        interval = now - self.last_report
+        rate = 0.0
+        if interval > 0:
+            rate = (ft.frames - self.last_frames) / interval
+        if new_interval:
+            self.last_report = now
+            self.last_frames = ft.frames
+
+        ret = { 'name'              : r.name,
+                'timestamp'         : time.time(),
+                'sim_time'          : r.model.time_now,
+                'target_rate'       : r.rate,
+                'rate'              : rate,
+                'frames'            : ft.frames,
+                'frame_time_bins_ms' : frame_time_bins,
+                'frame_time_counts' : ft.counts,
+                'frame_time_max_ms' : ft.max_time * 1000.0,
+                'overruns'          : ft.overruns,
+                'packets_in'        : r.packets_in,
+                'packets_out'       : r.packets_out,
+                'control_coalesced' : r.control.coalesced,
+                'control_dropped'   : r.control.dropped,
+                'paused'            : r.paused }
+        if self.last_input is None:
+            ret['since_input'] = None
+        else:
+            ret['since_input'] = now - self.last_input
+        sched = r.scheduler
+        if sched is not None:
+            ret['late_frames'] = sched.late_frames
+            ret['skipped_frames'] = sched.skipped_frames
+            ret['lateness_mean_ms'] = sched.mean_lateness() * 1000.0
+            ret['lateness_max_ms'] = sched.max_lateness * 1000.0
+        return ret
@@ -4,6 +4,12 @@ import os, sys, time, random
 from rotmat import Vector3, Matrix3
 from subprocess import call, check_call,Popen, PIPE
 
+try:
+    import numpy
+except ImportError:
+    # numpy is only used to work out the wind turbulance faster
+    numpy = None
+
 def m2ft(x):
     '''meters to feet'''
     return float(x) / 0.3048
@@ -241,11 +247,12 @@ def EarthRatesToBodyRates(dcm, earth_rates):
     r = cos(phi)*psiDot*cos(theta) - sin(phi)*thetaDot
     return Vector3(p, q, r)
 
-def BodyRatesToEarthRates(dcm, gyro):
+def BodyRatesToEarthRates(dcm, gyro, euler=None):
     '''convert the angular velocities from body frame to
     earth frame.
 
-    all inputs and outputs are in radians/s
+    all inputs and outputs are in radians/s. If the Euler angles
+    for dcm are already known they can be passed in as euler
 
     returns a earth rate vector
     '''
@@ -255,7 +262,9 @@ def BodyRatesToEarthRates(dcm, gyro):
     q      = gyro.y
     r      = gyro.z
 
-    (phi, theta, psi) = dcm.to_euler()
+    if euler is None:
+        euler = dcm.to_euler()
+    (phi, theta, psi) = euler
 
     phiDot   = p + tan(theta)*(q*sin(phi) + r*cos(phi))
     thetaDot = q*cos(phi) - r*sin(phi)
@@ -283,9 +292,33 @@ def gps_newpos(lat, lon, bearing, distance):
     return (degrees(lat2), degrees(lon2))
 
 
+def _decay_walk(mul, z, s, k):
+    '''the walk mul += s*z - (mul-1)*k over a numpy array of random
+    numbers z, for 0 < k < 1, as a list. With a = 1-k the offset from 1
+    after n steps is a**n times the offset at the start plus the sum of
+    s*z[j]/a**(j+1) for j < n, which is a cumulative sum. It is taken in
+    runs short enough that the powers of a stay well inside the range of
+    a float'''
+    a = 1.0 - k
+    run = max(1, int(20.0 / -math.log(a)))
+    x = mul - 1.0
+    walk = numpy.empty(len(z))
+    for start in range(0, len(z), run):
+        zr = z[start:start+run]
+        p = a ** numpy.arange(1, len(zr)+1)
+        xr = p * (x + s*numpy.cumsum(zr / p))
+        walk[start:start+len(zr)] = xr
+        x = xr[-1]
+    return (walk + 1.0).tolist()
+
+
 class Wind(object):
-    '''a wind generation object'''
-    def __init__(self, windstring, cross_section=0.1):
+    '''a wind generation object. The turbulance is a random walk that
+    decays back to the steady wind, worked out in blocks of steps ahead
+    of time from its own random number generator, which can be seeded
+    for repeatable runs. The blocks are made with numpy if it is
+    available, so a seed gives a different walk with and without it'''
+    def __init__(self, windstring, cross_section=0.1, seed=None, block_size=4096):
         a = windstring.split(',')
         if len(a) != 3:
             raise RuntimeError("Expected wind in speed,direction,turbulance form, not %s" % windstring)
@@ -307,6 +340,117 @@ class Wind(object):
         # initial turbulance multiplier
         self.turbulance_mul = 1.0
 
+        # an optional windfield.WindField giving the steady wind at
+        # each position, set by locate()
+        self.field = None
+
+        # random numbers for the walk, and the walk worked out from them
+        # for the time step and turbulance it was made for. The generator
+        # state the block was made from is kept so a snapshot can leave
+        # the block out
+        self.block_size = block_size
+        if numpy is not None:
+            self.rng = numpy.random.RandomState(seed)
+        else:
+            self.rng = random.Random(seed)
+        self._block_state = None
+        self._normals = []
+        self._normal_idx = 0
+        self._walk = []
+        self._walk_idx = 0
+        self._walk_deltat = None
+        self._walk_turbulance = None
+        self._last_deltat = None
+
+    def __getstate__(self):
+        # leave the random number block and the walk out of snapshots, as
+        # they are most of the size and can be made again. The walk is
+        # restarted from where it had got to
+        state = self.__dict__.copy()
+        state['_normal_idx'] = self._normal_idx + self._walk_idx
+        state['_normals'] = None
+        state['_walk'] = []
+        state['_walk_idx'] = 0
+        state['_walk_deltat'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._normals is None:
+            self._normals = []
+            if self._block_state is not None:
+                self._set_rng_state(self._block_state)
+                normal_idx = self._normal_idx
+                self._normal_idx = len(self._normals)
+                self._next_normals()
+                self._normal_idx = normal_idx
+
+    def _rng_state(self):
+        if numpy is not None:
+            return self.rng.get_state()
+        return self.rng.getstate()
+
+    def _set_rng_state(self, state):
+        if numpy is not None:
+            self.rng.set_state(state)
+        else:
+            self.rng.setstate(state)
+
+    def seed(self, seed):
+        '''restart the turbulance random numbers from a seed'''
+        self.rng.seed(seed)
+        self._end_walk()
+        self._block_state = None
+        self._normals = []
+        self._normal_idx = 0
+
+    def _next_normals(self):
+        '''make sure there are unused normally distributed random
+        numbers, making a new block if needed, with numpy or else with
+        the Box-Muller transform'''
+        if self._normal_idx < len(self._normals):
+            return
+        self._block_state = self._rng_state()
+        if numpy is not None:
+            self._normals = self.rng.normal(size=self.block_size).tolist()
+            self._normal_idx = 0
+            return
+        rand = self.rng.random
+        normals = []
+        for i in range(self.block_size//2):
+            u = 2*pi*rand()
+            m = sqrt(-2.0*math.log(1.0-rand()))
+            normals.append(m*cos(u))
+            normals.append(m*sin(u))
+        self._normals = normals
+        self._normal_idx = 0
+
+    def _make_walk(self, deltat):
+        '''work out the random walk for the rest of the random number
+        block, for a fixed time step'''
+        self._next_normals()
+        s = sqrt(deltat)*self.turbulance
+        k = deltat/self.turbulance_time_constant
+        if numpy is not None and 0 < k < 1:
+            walk = _decay_walk(self.turbulance_mul, numpy.array(self._normals[self._normal_idx:]), s, k)
+        else:
+            mul = self.turbulance_mul
+            walk = []
+            for z in self._normals[self._normal_idx:]:
+                mul += s*z - (mul-1.0)*k
+                walk.append(mul)
+        self._walk = walk
+        self._walk_idx = 0
+        self._walk_deltat = deltat
+        self._walk_turbulance = self.turbulance
+
+    def _end_walk(self):
+        '''stop using the walk, keeping the random numbers it did not use'''
+        self._normal_idx += self._walk_idx
+        self._walk = []
+        self._walk_idx = 0
+        self._walk_deltat = None
+
     def current(self, deltat=None):
         '''return current wind speed and direction as a tuple
         speed is in m/s, direction in degrees
@@ -316,52 +460,66 @@ class Wind(object):
             deltat = tnow - self.tlast
             self.tlast = tnow
 
-        # update turbulance random walk
-        w_delta = math.sqrt(deltat)*(1.0-random.gauss(1.0, self.turbulance))
-        w_delta -= (self.turbulance_mul-1.0)*(deltat/self.turbulance_time_constant)
-        self.turbulance_mul += w_delta
+        # update turbulance random walk. The walk is worked out in blocks
+        # once the time step has settled, any other step is taken on its
+        # own. Both use the same random numbers in the same order, so the
+        # result does not depend on which was used, other than by rounding
+        i = self._walk_idx
+        if i >= len(self._walk) or deltat != self._walk_deltat or \
+                self.turbulance != self._walk_turbulance:
+            self._end_walk()
+            if deltat == self._last_deltat:
+                self._make_walk(deltat)
+                i = 0
+            else:
+                self._last_deltat = deltat
+                self._next_normals()
+                z = self._normals[self._normal_idx]
+                self._normal_idx += 1
+                self.turbulance_mul += sqrt(deltat)*self.turbulance*z - \
+                    (self.turbulance_mul-1.0)*(deltat/self.turbulance_time_constant)
+                return (self.speed * math.fabs(self.turbulance_mul), self.direction)
+        self.turbulance_mul = self._walk[i]
+        self._walk_idx = i+1
         speed = self.speed * math.fabs(self.turbulance_mul)
         return (speed, self.direction)
 
+    def locate(self, latitude, longitude, altitude, t=0.0):
+        '''take the steady wind speed and direction from the wind field at
+        a position, if there is one. The vertical component is ignored'''
+        if self.field is None:
+            return
+        (n, e, d) = self.field.lookup(latitude, longitude, altitude, t)
+        self.speed = sqrt(n*n + e*e)
+        self.direction = math.degrees(atan2(e, n))
+
+    def vector(self, speed, direction):
+        '''the wind as a North, East vector in m/s for drag_accel(), from a
+        speed in m/s and the direction in degrees the wind is going in'''
+        direction = math.radians(direction)
+        return (speed*cos(direction), speed*sin(direction))
+
+    def drag_accel(self, wx, wy, vx, vy, vz):
+        '''drag on the aircraft from the air moving past it, without
+        building any vectors. wx,wy is the wind from vector() and vx,vy,vz
+        the earth frame velocity of the aircraft in m/s. The drag opposes
+        the velocity relative to the air, growing with its square as in
+        drag_force(). Returns the North and East force in newtons, which
+        the caller divides by its mass'''
+        rx = vx - wx
+        ry = vy - wy
+        rel_speed = sqrt(rx*rx + ry*ry + vz*vz)
+        k = 0.1 * self.cross_section * rel_speed
+        return (-k*rx, -k*ry)
 
     # Calculate drag.
     def drag(self, velocity, deltat=None, testing=None):
         '''return current wind force in Earth frame.  The velocity parameter is
            a Vector3 of the current velocity of the aircraft in earth frame, m/s'''
-        from math import radians
-
-        # (m/s, degrees) : wind vector as a magnitude and angle.
         (speed, direction) = self.current(deltat=deltat)
-        # speed = self.speed
-        # direction = self.direction
-
-        # Get the wind vector.
-        w = toVec(speed, radians(direction))
-
-        obj_speed = velocity.length()
-
-        # Compute the angle between the object vector and wind vector by taking
-        # the dot product and dividing by the magnitudes.
-        d = w.length() * obj_speed
-        if d == 0: 
-            alpha = 0
-        else: 
-            alpha = acos((w * velocity) / d)
-
-        # Get the relative wind speed and angle from the object.  Note that the
-        # relative wind speed includes the velocity of the object; i.e., there
-        # is a headwind equivalent to the object's speed even if there is no
-        # absolute wind.
-        (rel_speed, beta) = apparent_wind(speed, obj_speed, alpha)
-
-        # Return the vector of the relative wind, relative to the coordinate
-        # system.
-        relWindVec = toVec(rel_speed, beta + atan2(velocity.y, velocity.x))
-
-        # Combine them to get the acceleration vector.
-        return Vector3( acc(relWindVec.x, drag_force(self, relWindVec.x))
-                      , acc(relWindVec.y, drag_force(self, relWindVec.y))
-                      , 0 )
+        (wx, wy) = self.vector(speed, direction)
+        (ax, ay) = self.drag_accel(wx, wy, velocity.x, velocity.y, velocity.z)
+        return Vector3(ax, ay, 0)
 
 # http://en.wikipedia.org/wiki/Apparent_wind
 #
@@ -409,6 +567,26 @@ def toVec(magnitude, angle):
     return m.transposed() * v
 
 
+def test_drag():
+    '''check that drag opposes motion through still air and is zero when
+    moving with the wind'''
+    wind = Wind('0,0,0')
+    for (vx, vy) in [ (5, 0), (0, 5), (-5, 0), (0, -5), (3, -4) ]:
+        (ax, ay) = wind.drag_accel(0, 0, vx, vy, 0)
+        assert ax*vx + ay*vy < 0
+        assert abs(ax*vy - ay*vx) < 1.0e-12
+    for direction in [ 0, 45, 90, 180, 270 ]:
+        (wx, wy) = wind.vector(5, direction)
+        assert wind.drag_accel(wx, wy, wx, wy, 0) == (0, 0)
+        # a vehicle at rest is pushed the way the wind is going
+        (ax, ay) = wind.drag_accel(wx, wy, 0, 0, 0)
+        assert ax*wx + ay*wy > 0
+        assert abs(ax*wy - ay*wx) < 1.0e-12
+    (wx, wy) = wind.vector(5, 90)
+    assert abs(wx) < 1.0e-12 and abs(wy - 5) < 1.0e-12
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
+    test_drag()
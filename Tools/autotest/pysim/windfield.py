@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+'''
+a spatially varying wind field, read from a gridded wind file. The file
+holds North, East and Down wind components in m/s on a regular grid of
+latitude, longitude and altitude, optionally repeated over time. It is
+memory mapped, so only the cells the vehicles fly through are read
+'''
+
+import struct, mmap, os
+
+WINDFIELD_MAGIC = 'PYSIMWND'
+WINDFIELD_VERSION = 1
+
+# magic, version, grid size as nlat, nlon, nalt, ntime, then the
+# origin and spacing of each axis as lat0, dlat, lon0, dlon, alt0, dalt,
+# t0, dt. The grid follows as float32 N,E,D vectors, indexed
+# [time][alt][lat][lon]
+windfield_header = struct.Struct('<8sH4I8d')
+wind_vector = struct.Struct('<3f')
+
+def write_windfield(filename, lat0, dlat, lon0, dlon, alt0, dalt, values, t0=0.0, dt=1.0):
+    '''write a wind file. values is a nested list of N,E,D tuples
+    indexed [time][alt][lat][lon]'''
+    ntime = len(values)
+    nalt = len(values[0])
+    nlat = len(values[0][0])
+    nlon = len(values[0][0][0])
+    f = open(filename, mode='wb')
+    f.write(windfield_header.pack(WINDFIELD_MAGIC, WINDFIELD_VERSION,
+                                  nlat, nlon, nalt, ntime,
+                                  lat0, dlat, lon0, dlon, alt0, dalt, t0, dt))
+    for t in values:
+        for a in t:
+            if len(a) != nlat:
+                raise RuntimeError("Wind grid rows must all have %u latitudes" % nlat)
+            for la in a:
+                if len(la) != nlon:
+                    raise RuntimeError("Wind grid rows must all have %u longitudes" % nlon)
+                for v in la:
+                    f.write(wind_vector.pack(*v))
+    f.close()
+
+def _blend(corners, frac):
+    '''interpolate between pairs of neighbouring corners'''
+    ret = []
+    for i in range(0, len(corners), 2):
+        (a0, a1, a2) = corners[i]
+        (b0, b1, b2) = corners[i+1]
+        ret.append((a0 + (b0-a0)*frac,
+                    a1 + (b1-a1)*frac,
+                    a2 + (b2-a2)*frac))
+    return ret
+
+
+class WindField(object):
+    '''a gridded wind file opened through a memory map. lookup() gives the
+    wind at a position by interpolating between the corners of the grid
+    cell around it, keeping the corners of the last cell so a vehicle
+    staying in one cell costs no reads. Positions outside the grid take
+    the wind at its edge'''
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, mode='rb')
+        size = os.fstat(self.f.fileno()).st_size
+        if size < windfield_header.size:
+            raise RuntimeError("%s is not a wind file" % filename)
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version,
+         self.nlat, self.nlon, self.nalt, self.ntime,
+         self.lat0, self.dlat, self.lon0, self.dlon,
+         self.alt0, self.dalt, self.t0, self.dt) = windfield_header.unpack_from(self.mm, 0)
+        if magic != WINDFIELD_MAGIC:
+            raise RuntimeError("%s is not a wind file" % filename)
+        if version != WINDFIELD_VERSION:
+            raise RuntimeError("%s is wind file version %u, not %u" % (filename, version, WINDFIELD_VERSION))
+        if min(self.nlat, self.nlon, self.nalt, self.ntime) < 1:
+            raise RuntimeError("%s has an empty wind grid" % filename)
+        expected = windfield_header.size + wind_vector.size * self.nlat * self.nlon * self.nalt * self.ntime
+        if size < expected:
+            raise RuntimeError("%s is truncated, %u bytes of %u" % (filename, size, expected))
+
+        # byte strides of each axis in the grid
+        self.lon_stride = wind_vector.size
+        self.lat_stride = self.lon_stride * self.nlon
+        self.alt_stride = self.lat_stride * self.nlat
+        self.time_stride = self.alt_stride * self.nalt
+
+        # origin, spacing, last cell and byte stride of the axes with
+        # more than one point, which are the ones interpolated along,
+        # innermost first, with the index of the position coordinate
+        # for each as lookup() takes them
+        self.axes = []
+        for (idx, x0, dx, n, stride) in [ (1, self.lon0, self.dlon, self.nlon, self.lon_stride),
+                                          (0, self.lat0, self.dlat, self.nlat, self.lat_stride),
+                                          (2, self.alt0, self.dalt, self.nalt, self.alt_stride),
+                                          (3, self.t0, self.dt, self.ntime, self.time_stride) ]:
+            if n > 1:
+                self.axes.append((idx, x0, dx, n-2, stride))
+
+        self.cell = None
+        self.corners = None
+        self.reads = 0
+
+    def __getstate__(self):
+        # the memory map can't be pickled into a checkpoint, so reopen
+        # the file on restore
+        return { 'filename' : self.filename }
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'])
+
+    def _cell(self, position):
+        '''return the byte offset of the cell around a (lat, lon, alt, t)
+        position and the fractions across it, innermost axis first.
+        Positions off the grid are moved to its edge'''
+        offset = windfield_header.size
+        fracs = []
+        for (idx, x0, dx, last, stride) in self.axes:
+            f = (position[idx] - x0) / dx
+            if f <= 0:
+                fracs.append(0.0)
+            elif f >= last+1:
+                offset += last*stride
+                fracs.append(1.0)
+            else:
+                i = int(f)
+                offset += i*stride
+                fracs.append(f - i)
+        return (offset, fracs)
+
+    def _read_corners(self, offset):
+        '''read the wind vectors at the corners of the cell at offset'''
+        offsets = [ offset ]
+        for axis in reversed(self.axes):
+            stride = axis[4]
+            offsets = [ o + d for o in offsets for d in (0, stride) ]
+        self.reads += 1
+        return [ wind_vector.unpack_from(self.mm, o) for o in offsets ]
+
+    def _interpolate(self, corners, fracs):
+        for frac in fracs:
+            corners = _blend(corners, frac)
+        return corners[0]
+
+    def lookup(self, lat, lon, alt, t=0.0):
+        '''return the wind at a position as a North, East, Down tuple in
+        m/s. Altitude is in meters, t in seconds'''
+        (offset, fracs) = self._cell((lat, lon, alt, t))
+        if offset != self.cell:
+            self.corners = self._read_corners(offset)
+            self.cell = offset
+        return self._interpolate(self.corners, fracs)
+
+    def lookup_many(self, lats, lons, alts, t=0.0):
+        '''return the wind for several positions at once, as a list of
+        North, East, Down tuples. Vehicles sharing a cell share one
+        read of its corners'''
+        cells = {}
+        ret = []
+        for i in range(len(lats)):
+            (offset, fracs) = self._cell((lats[i], lons[i], alts[i], t))
+            corners = cells.get(offset, None)
+            if corners is None:
+                corners = self._read_corners(offset)
+                cells[offset] = corners
+            ret.append(self._interpolate(corners, fracs))
+        return ret
+
+    def close(self):
+        self.mm.close()
+        self.f.close()